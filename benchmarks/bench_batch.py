@@ -0,0 +1,72 @@
+# compares per-image predict() against batched predict_batch() throughput
+# usage: python -m benchmarks.bench_batch --model models/wd-vit-tagger-v3.onnx --images <folder>
+import argparse
+import time
+from pathlib import Path
+from PIL import Image
+from tagger.model_runner import ONNXTagger
+from tagger.selected_tags_loader import SelectedTagsLoader
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def load_images(folder: Path, limit: int):
+    paths = sorted(p for p in folder.iterdir() if p.suffix.lower() in IMAGE_EXTS)
+    images = []
+    for path in paths[:limit]:
+        with Image.open(path) as image:
+            image.load()
+            images.append(image.copy())
+    return images
+
+
+def time_per_image(tagger: ONNXTagger, images: list) -> float:
+    start = time.perf_counter()
+    for image in images:
+        tagger.predict(image)
+    return len(images) / (time.perf_counter() - start)
+
+
+def time_batched(tagger: ONNXTagger, images: list, batch_size: int) -> float:
+    start = time.perf_counter()
+    tagger.predict_batch(images, batch_size=batch_size)
+    return len(images) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched vs per-image throughput")
+    parser.add_argument("--model", type=Path, required=True)
+    parser.add_argument("--tags", type=Path, help="defaults to selected_tags.csv")
+    parser.add_argument("--images", type=Path, required=True)
+    parser.add_argument("--limit", type=int, default=64)
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16,32")
+    args = parser.parse_args()
+
+    csv_path = args.tags or args.model.parent / "selected_tags.csv"
+    tag_names, rating_indexes, general_indexes, character_indexes = SelectedTagsLoader(
+        csv_path
+    ).load_tags()
+    tagger = ONNXTagger(
+        args.model, tag_names, rating_indexes, general_indexes, character_indexes
+    )
+    images = load_images(args.images, args.limit)
+    if not images:
+        print("No images found.")
+        return
+
+    # warm up the session so the first measurement is not penalized
+    tagger.predict(images[0])
+    baseline = time_per_image(tagger, images)
+    print(f"per-image predict:   {baseline:8.2f} images/sec")
+    for batch_size in (int(x) for x in args.batch_sizes.split(",")):
+        rate = time_batched(tagger, images, batch_size)
+        print(
+            f"predict_batch({batch_size:>3}): {rate:8.2f} images/sec "
+            f"({rate / baseline:.2f}x)"
+        )
+    if tagger.fixed_batch_size is not None:
+        print(f"note: model has a fixed batch dimension of {tagger.fixed_batch_size}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# compares full-resolution decoding against JPEG draft-mode decoding:
+# preprocessing time, decoded pixel count and how much the predicted tags move
+# usage: python -m benchmarks.bench_decode --model models/wd-vit-tagger-v3.onnx --images <folder>
+import argparse
+import time
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from tagger.model_runner import ONNXTagger
+from tagger.selected_tags_loader import SelectedTagsLoader
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def run_path(tagger: ONNXTagger, paths: list, fast_decode: bool):
+    tagger.fast_decode = fast_decode
+    tensors = []
+    decoded_pixels = 0
+    start = time.perf_counter()
+    for path in paths:
+        with Image.open(path) as image:
+            tensors.append(tagger.prepare_image(image, tagger.target_size))
+            decoded_pixels += image.size[0] * image.size[1]
+    elapsed = time.perf_counter() - start
+    preds = np.concatenate([tagger.run_batch(tensor) for tensor in tensors])
+    return elapsed, decoded_pixels, preds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Draft-mode decode benchmark")
+    parser.add_argument("--model", type=Path, required=True)
+    parser.add_argument("--tags", type=Path, help="defaults to selected_tags.csv")
+    parser.add_argument("--images", type=Path, required=True)
+    parser.add_argument("--limit", type=int, default=64)
+    args = parser.parse_args()
+
+    csv_path = args.tags or args.model.parent / "selected_tags.csv"
+    tag_names, rating_indexes, general_indexes, character_indexes = SelectedTagsLoader(
+        csv_path
+    ).load_tags()
+    tagger = ONNXTagger(
+        args.model, tag_names, rating_indexes, general_indexes, character_indexes
+    )
+    paths = sorted(p for p in args.images.iterdir() if p.suffix.lower() in IMAGE_EXTS)
+    paths = paths[: args.limit]
+    if not paths:
+        print("No images found.")
+        return
+
+    full_time, full_pixels, full_preds = run_path(tagger, paths, False)
+    draft_time, draft_pixels, draft_preds = run_path(tagger, paths, True)
+    print(f"full decode:  {full_time / len(paths) * 1e3:8.2f} ms/image")
+    print(
+        f"draft decode: {draft_time / len(paths) * 1e3:8.2f} ms/image "
+        f"({full_time / draft_time:.2f}x)"
+    )
+    print(f"decoded pixels: {full_pixels / 1e6:.1f} MP -> {draft_pixels / 1e6:.1f} MP")
+
+    full_tags = tagger.postprocess_batch(full_preds)
+    draft_tags = tagger.postprocess_batch(draft_preds)
+    changed = 0
+    jaccard = []
+    for (full_general, _, full_char, _), (draft_general, _, draft_char, _) in zip(
+        full_tags, draft_tags
+    ):
+        a = set(full_general + full_char)
+        b = set(draft_general + draft_char)
+        changed += a != b
+        jaccard.append(len(a & b) / len(a | b) if a | b else 1.0)
+    print(f"max |prob difference|: {np.abs(full_preds - draft_preds).max():.4f}")
+    print(f"images with different tags: {changed} / {len(paths)}")
+    print(f"mean tag-set Jaccard similarity: {np.mean(jaccard):.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# compares the buffer-based preprocessing against the original PIL canvas/paste
+# implementation: per-image latency, peak traced memory and tensor differences
+# usage: python -m benchmarks.bench_preprocess --model models/wd-vit-tagger-v3.onnx --images <folder>
+import argparse
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from tagger.model_runner import ONNXTagger
+from tagger.selected_tags_loader import SelectedTagsLoader
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def legacy_prepare_image(image: Image.Image, target_size: int) -> np.ndarray:
+    # the pre-buffer implementation, kept here as the reference
+    if image.mode == "RGBA":
+        canvas = Image.new("RGBA", image.size, (255, 255, 255))
+        canvas.alpha_composite(image)
+        image = canvas.convert("RGB")
+    else:
+        image = image.convert("RGB")
+    max_dim = max(image.size)
+    pad_left = (max_dim - image.size[0]) // 2
+    pad_top = (max_dim - image.size[1]) // 2
+    padded = Image.new("RGB", (max_dim, max_dim), (255, 255, 255))
+    padded.paste(image, (pad_left, pad_top))
+    if max_dim != target_size:
+        padded = padded.resize((target_size, target_size), Image.BICUBIC)
+    image_np = np.asarray(padded, dtype=np.float32)
+    image_np = image_np[:, :, ::-1]
+    image_np = np.expand_dims(image_np, axis=0)
+    return image_np
+
+
+def measure(prepare, images: list, batch_size: int):
+    tracemalloc.start()
+    start = time.perf_counter()
+    outputs = []
+    for offset in range(0, len(images), batch_size):
+        outputs.extend(prepare(images[offset : offset + batch_size]))
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed / len(images), peak, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocessing benchmark")
+    parser.add_argument("--model", type=Path, required=True)
+    parser.add_argument("--tags", type=Path, help="defaults to selected_tags.csv")
+    parser.add_argument("--images", type=Path, required=True)
+    parser.add_argument("--limit", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    csv_path = args.tags or args.model.parent / "selected_tags.csv"
+    tag_names, rating_indexes, general_indexes, character_indexes = SelectedTagsLoader(
+        csv_path
+    ).load_tags()
+    tagger = ONNXTagger(
+        args.model, tag_names, rating_indexes, general_indexes, character_indexes
+    )
+    size = tagger.target_size
+    paths = sorted(p for p in args.images.iterdir() if p.suffix.lower() in IMAGE_EXTS)
+    images = []
+    for path in paths[: args.limit]:
+        with Image.open(path) as image:
+            image.load()
+            images.append(image.copy())
+    if not images:
+        print("No images found.")
+        return
+
+    def legacy(batch):
+        # what ORT received before: a stacked copy of reversed-stride views
+        tensor = np.concatenate([legacy_prepare_image(image, size) for image in batch])
+        return [tagger.run_batch(tensor)]
+
+    def buffered(batch):
+        return [tagger.run_resized([tagger.resize_image(i, size) for i in batch])]
+
+    legacy_time, legacy_peak, _ = measure(legacy, images, args.batch_size)
+    buffered_time, buffered_peak, _ = measure(buffered, images, args.batch_size)
+    print(
+        f"legacy:   {legacy_time * 1e3:7.2f} ms/image, "
+        f"peak {legacy_peak / 2**20:7.1f} MiB"
+    )
+    print(
+        f"buffered: {buffered_time * 1e3:7.2f} ms/image, "
+        f"peak {buffered_peak / 2**20:7.1f} MiB"
+    )
+
+    diffs = []
+    for image in images:
+        expected = legacy_prepare_image(image, size)
+        actual = tagger.prepare_image(image, size)
+        diffs.append(np.abs(expected - actual))
+    diffs = np.concatenate(diffs)
+    print(
+        f"tensor difference (0-255 scale): mean {diffs.mean():.3f}, "
+        f"99th percentile {np.percentile(diffs, 99):.1f}, max {diffs.max():.1f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# compares onnxruntime session settings on the same images: session creation
+# time, single-image latency percentiles and batched throughput per variant
+# usage: python -m benchmarks.bench_session --model models/wd-vit-tagger-v3.onnx --images <folder> [--setting graph_optimization]
+import argparse
+import time
+from pathlib import Path
+import numpy as np
+import onnxruntime as ort
+from PIL import Image
+from tagger.model_runner import ONNXTagger
+from tagger.selected_tags_loader import SelectedTagsLoader
+from tagger.session_config import (
+    EXECUTION_MODES,
+    GRAPH_OPTIMIZATION_LEVELS,
+    SessionConfig,
+    resolve_providers,
+)
+import config_manager
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+# each setting maps to the overrides compared against each other
+SETTINGS = {
+    "graph_optimization": [
+        {"graph_optimization": level} for level in GRAPH_OPTIMIZATION_LEVELS
+    ],
+    "cache_optimized_model": [
+        {"cache_optimized_model": False},
+        {"cache_optimized_model": True},
+    ],
+    "threads": [{"intra_op_num_threads": n} for n in (1, 2, 4, 0)],
+    "execution_mode": [{"execution_mode": mode} for mode in EXECUTION_MODES],
+    "cpu_mem_arena": [{"cpu_mem_arena": True}, {"cpu_mem_arena": False}],
+    "mem_pattern": [{"mem_pattern": True}, {"mem_pattern": False}],
+    "allow_spinning": [{"allow_spinning": True}, {"allow_spinning": False}],
+    "providers": [{"providers": [p]} for p in ort.get_available_providers()],
+}
+
+
+def load_resized(tagger: ONNXTagger, folder: Path, limit: int):
+    # images are decoded and resized once so only inference is measured
+    paths = sorted(p for p in folder.iterdir() if p.suffix.lower() in IMAGE_EXTS)
+    resized = []
+    for path in paths[:limit]:
+        with Image.open(path) as image:
+            resized.append(tagger.resize_image(image, tagger.target_size))
+    return resized
+
+
+def bench_variant(build, resized: list, batch_size: int, repeats: int):
+    start = time.perf_counter()
+    tagger = build()
+    load_time = time.perf_counter() - start
+    # warm up so the first run's allocations are not counted
+    tagger.run_resized(resized[:batch_size])
+    latencies = []
+    for _ in range(repeats):
+        for item in resized:
+            start = time.perf_counter()
+            tagger.run_resized([item])
+            latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for i in range(0, len(resized), batch_size):
+            tagger.run_resized(resized[i : i + batch_size])
+    throughput = repeats * len(resized) / (time.perf_counter() - start)
+    p50, p95 = np.percentile(np.array(latencies) * 1000, [50, 95])
+    return load_time, p50, p95, throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description="onnxruntime session settings")
+    parser.add_argument("--model", type=Path, required=True)
+    parser.add_argument("--tags", type=Path, help="defaults to selected_tags.csv")
+    parser.add_argument("--images", type=Path, required=True)
+    parser.add_argument("--limit", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument(
+        "--setting",
+        choices=list(SETTINGS) + ["all"],
+        default="all",
+        help="which setting to vary; the others come from the config",
+    )
+    args = parser.parse_args()
+
+    csv_path = args.tags or args.model.parent / "selected_tags.csv"
+    tag_names, rating_indexes, general_indexes, character_indexes = SelectedTagsLoader(
+        csv_path
+    ).load_tags()
+    base = vars(SessionConfig.from_config(config_manager.ConfigManager()))
+
+    def build(overrides):
+        return ONNXTagger(
+            args.model,
+            tag_names,
+            rating_indexes,
+            general_indexes,
+            character_indexes,
+            session_config=SessionConfig(**{**base, **overrides}),
+        )
+
+    resized = load_resized(build({}), args.images, args.limit)
+    if not resized:
+        print("No images found.")
+        return
+
+    settings = list(SETTINGS) if args.setting == "all" else [args.setting]
+    print(f"{len(resized)} images, batch size {args.batch_size}")
+    print(f"{'variant':<40} {'load s':>7} {'p50 ms':>8} {'p95 ms':>8} {'images/s':>9}")
+    for setting in settings:
+        for overrides in SETTINGS[setting]:
+            label = ", ".join(f"{k}={v}" for k, v in overrides.items())
+            # the optimized-model cache is compared cold, then warm
+            runs = 1
+            if overrides.get("cache_optimized_model"):
+                runs = 2
+                config = SessionConfig(**{**base, **overrides})
+                config.optimized_model_path(
+                    args.model, resolve_providers(config.providers)
+                ).unlink(missing_ok=True)
+            for run in range(runs):
+                if runs > 1:
+                    label_run = f"{label} ({'cold' if run == 0 else 'warm'})"
+                else:
+                    label_run = label
+                load, p50, p95, throughput = bench_variant(
+                    lambda: build(overrides), resized, args.batch_size, args.repeats
+                )
+                print(
+                    f"{label_run:<40} {load:7.2f} {p50:8.2f} {p95:8.2f} "
+                    f"{throughput:9.1f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
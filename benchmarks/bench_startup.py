@@ -0,0 +1,141 @@
+# GUI startup benchmark: launches the app in a fresh interpreter and times,
+# from process launch, the main imports, building the window, its first paint,
+# the model finishing loading in the background, and the first tag of an
+# image requested right at first paint. Every run gets its own empty home
+# folder, so config, probability and thumbnail caches start cold.
+# usage: python -m benchmarks.bench_startup [--model small|path.onnx] [--offscreen]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+MARKS = ["imported", "window", "first_paint", "model_loaded", "first_tag"]
+
+
+def child(model_path: str, image_path: str):
+    # runs inside the launched interpreter; prints wall clock times per mark
+    marks = {}
+    import main
+    from PySide6.QtCore import QEvent, QObject, QTimer
+    from PySide6.QtWidgets import QApplication
+
+    marks["imported"] = time.time()
+    app = QApplication([])
+    window = main.MainWindow({"benchmark": Path(model_path)})
+    tab = window.tagging_tab
+    marks["window"] = time.time()
+
+    class PaintWatcher(QObject):
+        def eventFilter(self, watched, event):
+            if event.type() == QEvent.Paint and "first_paint" not in marks:
+                marks["first_paint"] = time.time()
+                # as if Tag Image were clicked the moment the window shows
+                tab.image_path = image_path
+                tab.run_tagging()
+            return False
+
+    watcher = PaintWatcher()
+    tab.installEventFilter(watcher)
+
+    def poll():
+        if "model_loaded" not in marks and tab.pool.is_loaded("benchmark"):
+            marks["model_loaded"] = time.time()
+        if tab.tagged_path == image_path or "failed" in tab.tag_output.toPlainText():
+            marks["first_tag"] = time.time()
+            app.quit()
+
+    timer = QTimer()
+    timer.timeout.connect(poll)
+    timer.start(5)
+    QTimer.singleShot(300_000, app.quit)
+    window.show()
+    app.exec()
+    tab.shutdown()
+    print("BENCH " + json.dumps(marks), flush=True)
+
+
+def run_once(model_path: Path, image_path: Path, home: Path, offscreen: bool):
+    env = dict(os.environ, HOME=str(home), USERPROFILE=str(home))
+    if offscreen:
+        env["QT_QPA_PLATFORM"] = "offscreen"
+    start = time.time()
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.bench_startup",
+            "--child",
+            str(model_path),
+            str(image_path),
+        ],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    ).stdout
+    for line in output.splitlines():
+        if line.startswith("BENCH "):
+            marks = json.loads(line[len("BENCH ") :])
+            return {mark: marks[mark] - start for mark in MARKS if mark in marks}
+    raise RuntimeError(f"No timings in the app's output:\n{output}")
+
+
+def main(argv=None):
+    if argv is None and sys.argv[1:2] == ["--child"]:
+        child(*sys.argv[2:4])
+        return 0
+    from benchmarks.fixtures import STAND_IN_MODELS, make_corpus, make_stand_in_model
+
+    parser = argparse.ArgumentParser(description="GUI startup benchmark")
+    parser.add_argument(
+        "--model",
+        default="small",
+        help=f"stand-in model ({', '.join(STAND_IN_MODELS)}) or .onnx path",
+    )
+    parser.add_argument("--image", type=Path, help="defaults to a synthetic image")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--offscreen", action="store_true", help="no display needed (Qt offscreen)"
+    )
+    parser.add_argument("--out", type=Path, help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="tag_manager_startup_") as temp:
+        work_dir = Path(temp)
+        model_path = Path(args.model)
+        if args.model in STAND_IN_MODELS:
+            model_path = work_dir / "models" / f"{args.model}.onnx"
+            make_stand_in_model(model_path, STAND_IN_MODELS[args.model])
+        image_path = args.image or make_corpus(work_dir / "corpus", 1, (1024, 1024))[0]
+        runs = []
+        for i in range(args.repeats):
+            home = work_dir / f"home_{i}"
+            home.mkdir()
+            runs.append(run_once(model_path, image_path, home, args.offscreen))
+            print(
+                f"run {i + 1}: "
+                + ", ".join(f"{mark} {runs[-1][mark]:.2f}s" for mark in runs[-1]),
+                flush=True,
+            )
+
+    summary = {}
+    print(f"\n{'mark':<14} {'median s':>9} {'min s':>9}")
+    for mark in MARKS:
+        times = sorted(run[mark] for run in runs if mark in run)
+        if not times:
+            continue
+        summary[mark] = {"median_s": times[len(times) // 2], "min_s": times[0]}
+        print(f"{mark:<14} {summary[mark]['median_s']:9.2f} {times[0]:9.2f}")
+    if args.out:
+        results = {"args": vars(args), "runs": runs, "summary": summary}
+        args.out.write_text(json.dumps(results, indent=2, default=str), "utf-8")
+        print(f"\nWrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,332 @@
+# end-to-end benchmark harness: per-stage latency percentiles, throughput and
+# peak RSS for file reads, decoding, padding, inference, postprocessing,
+# caption writes and bulk_tag_images as a whole, across image sizes, batch
+# sizes and models. Runs offline on generated stand-in models and a
+# synthetic corpus; results go to JSON so commits can be compared.
+# usage: python -m benchmarks.bench_suite --out before.json
+#        python -m benchmarks.bench_suite --out after.json --compare before.json
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from benchmarks.fixtures import STAND_IN_MODELS, make_corpus, make_stand_in_model
+from benchmarks.measure import reset_peak_rss, stage_peak_rss_mb, summarize
+
+STAGES = [
+    "load",
+    "read",
+    "decode",
+    "pad",
+    "inference",
+    "postprocess",
+    "write",
+    "end_to_end",
+]
+
+
+def timed(fn, items, repeats: int, count=len):
+    # calls fn(item) for every item, `repeats` times; returns the last round's
+    # outputs and the stage summary including the stage's own peak RSS
+    reset_peak_rss()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeats):
+        outputs = []
+        for item in items:
+            t = time.perf_counter()
+            outputs.append(fn(item))
+            latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - start
+    images = repeats * sum(count(item) for item in items)
+    stats = summarize(latencies, images, elapsed)
+    stats["peak_rss_mb"] = stage_peak_rss_mb()
+    return outputs, stats
+
+
+def run_case(case: dict) -> dict:
+    # one model x image size x batch size, in a fresh process
+    from bulk.bulk_processor import bulk_tag_images
+    from tagger.model_runner import ONNXTagger, compose_tags
+    from tagger.prob_cache import bytes_digest
+    from tagger.selected_tags_loader import SelectedTagsLoader
+
+    model_path = Path(case["model_path"])
+    paths = [Path(p) for p in case["images"]]
+    batch_size = case["batch_size"]
+    repeats = case["repeats"]
+    stages = {}
+
+    reset_peak_rss()
+    start = time.perf_counter()
+    tagger = ONNXTagger(
+        model_path,
+        *SelectedTagsLoader(model_path.parent / "selected_tags.csv").load_tags(),
+        fast_decode=case["fast_decode"],
+    )
+    stages["load"] = {
+        "seconds": time.perf_counter() - start,
+        "peak_rss_mb": stage_peak_rss_mb(),
+    }
+    size = tagger.target_size
+
+    def read(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        bytes_digest(data)
+        return data
+
+    def decode(data):
+        with Image.open(io.BytesIO(data)) as image:
+            return tagger.resize_image(image, size)
+
+    one = lambda item: 1
+    datas, stages["read"] = timed(read, paths, repeats, one)
+    resized, stages["decode"] = timed(decode, datas, repeats, one)
+    batches = [resized[i : i + batch_size] for i in range(0, len(resized), batch_size)]
+
+    def pad(batch):
+        tensor = np.empty((len(batch), size, size, 3), dtype=np.float32)
+        for item, out in zip(batch, tensor):
+            tagger.pad_into(item, out)
+        return tensor
+
+    tensors, stages["pad"] = timed(pad, batches, repeats)
+    # the first run allocates, so it is left out
+    tagger.run_batch(tensors[0])
+    preds, stages["inference"] = timed(tagger.run_batch, tensors, repeats)
+
+    def postprocess(batch_preds):
+        return [
+            ", ".join(compose_tags(general, rating, character))
+            for general, rating, character, _ in tagger.postprocess_batch(batch_preds)
+        ]
+
+    captions, stages["postprocess"] = timed(postprocess, preds, repeats)
+    captions = [caption for batch in captions for caption in batch]
+
+    out_dir = Path(tempfile.mkdtemp(prefix="bench_write_"))
+
+    def write(item):
+        # as bulk tagging's CaptionWriter does it
+        index, caption = item
+        with open(out_dir / f"{index}.txt", "w", encoding="utf-8") as f:
+            f.write(caption)
+
+    _, stages["write"] = timed(write, list(enumerate(captions)), repeats, one)
+    shutil.rmtree(out_dir, ignore_errors=True)
+
+    # the whole pipeline on the corpus folder, threads and writer included
+    reset_peak_rss()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        summary = bulk_tag_images(
+            tagger,
+            case["folder"],
+            batch_size=batch_size,
+            incremental=False,
+            resume=False,
+        )
+    elapsed = time.perf_counter() - start
+    stages["end_to_end"] = {
+        "seconds": elapsed,
+        "images_per_second": summary.processed / elapsed,
+        "peak_rss_mb": stage_peak_rss_mb(),
+    }
+    for path in paths:
+        path.with_suffix(".txt").unlink(missing_ok=True)
+    return {key: case[key] for key in ("model", "image_size", "batch_size")} | {
+        "stages": stages
+    }
+
+
+def environment() -> dict:
+    import onnxruntime
+    import PIL
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pillow": PIL.__version__,
+        "onnxruntime": onnxruntime.__version__,
+    }
+
+
+def parse_size(text: str) -> tuple:
+    width, _, height = text.partition("x")
+    return int(width), int(height or width)
+
+
+def build_cases(args, work_dir: Path) -> list:
+    models = []
+    for name in args.models:
+        if name in STAND_IN_MODELS:
+            path = work_dir / "models" / name / f"{name}.onnx"
+            if not path.exists():
+                make_stand_in_model(path, STAND_IN_MODELS[name], args.tags)
+            models.append((name, path))
+        else:
+            # a real model, with its selected_tags.csv next to it
+            models.append((Path(name).stem, Path(name)))
+    cases = []
+    for size in args.sizes:
+        width, height = parse_size(size)
+        folder = work_dir / "corpus" / f"{width}x{height}_{args.format}"
+        paths = make_corpus(folder, args.images, (width, height), args.format)
+        for name, path in models:
+            for batch_size in args.batch_sizes:
+                cases.append(
+                    {
+                        "model": name,
+                        "model_path": str(path),
+                        "image_size": f"{width}x{height}",
+                        "batch_size": batch_size,
+                        "folder": str(folder),
+                        "images": [str(p) for p in paths],
+                        "repeats": args.repeats,
+                        "fast_decode": args.fast_decode,
+                    }
+                )
+    return cases
+
+
+def case_key(case: dict) -> tuple:
+    return case["model"], case["image_size"], case["batch_size"]
+
+
+def print_results(results: dict):
+    for case in results["cases"]:
+        print(f"\n{case['model']}  {case['image_size']}  batch {case['batch_size']}")
+        print(
+            f"  {'stage':<12} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+            f"{'img/s':>9} {'peak MB':>8}"
+        )
+        for stage in STAGES:
+            stats = case["stages"][stage]
+            if "p50_ms" in stats:
+                timing = (
+                    f"{stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} "
+                    f"{stats['p99_ms']:9.2f}"
+                )
+            else:
+                timing = f"{stats['seconds'] * 1000:9.1f} {'':>9} {'':>9}"
+            rate = stats.get("images_per_second")
+            rate = f"{rate:9.1f}" if rate is not None else f"{'':>9}"
+            rss = stats.get("peak_rss_mb") or float("nan")
+            print(f"  {stage:<12} {timing} {rate} {rss:8.0f}")
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    # p50 latency (or total seconds) and throughput of every stage against
+    # the baseline; returns the stages that got worse by more than tolerance
+    previous = {case_key(case): case for case in baseline["cases"]}
+    regressions = []
+    print(f"\nCompared with {baseline['environment'].get('commit') or 'baseline'}:")
+    for case in results["cases"]:
+        old = previous.get(case_key(case))
+        if old is None:
+            continue
+        for stage in STAGES:
+            new_stats, old_stats = case["stages"][stage], old["stages"].get(stage)
+            if not old_stats:
+                continue
+            metric = "p50_ms" if "p50_ms" in new_stats else "seconds"
+            if not old_stats.get(metric):
+                continue
+            ratio = new_stats[metric] / old_stats[metric]
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = "  REGRESSION"
+                regressions.append((case_key(case), stage, ratio))
+            print(
+                f"  {case['model']:<8} {case['image_size']:>10} b{case['batch_size']:<3}"
+                f" {stage:<12} {metric} x{ratio:5.2f}{flag}"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage tagging benchmark")
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        default=["tiny", "small"],
+        help=f"stand-in models ({', '.join(STAND_IN_MODELS)}) or .onnx paths",
+    )
+    parser.add_argument("--sizes", nargs="+", default=["512x512", "2048x1536"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--images", type=int, default=32, help="images per size")
+    parser.add_argument("--format", choices=["jpg", "png"], default="jpg")
+    parser.add_argument("--tags", type=int, default=10000, help="stand-in tags")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--fast-decode", action="store_true")
+    parser.add_argument(
+        "--work-dir",
+        type=Path,
+        help="keeps the generated models and corpus here between runs",
+    )
+    parser.add_argument("--out", type=Path, help="write the results as JSON")
+    parser.add_argument("--compare", type=Path, help="JSON of an earlier run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="slowdown that counts as a regression with --compare",
+    )
+    args = parser.parse_args(argv)
+
+    temp_dir = None
+    work_dir = args.work_dir
+    if work_dir is None:
+        temp_dir = tempfile.TemporaryDirectory(prefix="tag_manager_bench_")
+        work_dir = Path(temp_dir.name)
+    try:
+        cases = build_cases(args, work_dir)
+        # one process per case, one at a time, so memory figures and thread
+        # pools never overlap between cases
+        ctx = multiprocessing.get_context("spawn")
+        results = {"environment": environment(), "args": vars(args), "cases": []}
+        for case in cases:
+            print(
+                f"{case['model']} {case['image_size']} batch {case['batch_size']}...",
+                flush=True,
+            )
+            with ctx.Pool(1) as pool:
+                results["cases"].append(pool.apply(run_case, (case,)))
+    finally:
+        if temp_dir is not None:
+            temp_dir.cleanup()
+    print_results(results)
+    if args.out:
+        args.out.write_text(json.dumps(results, indent=2, default=str), "utf-8")
+        print(f"\nWrote {args.out}")
+    if args.compare:
+        baseline = json.loads(args.compare.read_text("utf-8"))
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
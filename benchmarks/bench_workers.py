@@ -0,0 +1,86 @@
+# finds the fastest workers x threads-per-worker split for a given core count
+# usage: python -m benchmarks.bench_workers --model models/wd-vit-tagger-v3.onnx --images <folder>
+import argparse
+import os
+import time
+from pathlib import Path
+from tagger.model_runner import ONNXTagger
+from tagger.selected_tags_loader import SelectedTagsLoader
+from bulk.pipeline import CaptionOptions, iter_captions
+from bulk.process_pool import iter_captions_sharded
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def candidate_splits(cores: int):
+    return [
+        (workers, cores // workers)
+        for workers in range(1, cores + 1)
+        if cores % workers == 0
+    ]
+
+
+def measure(tagger, images, batch_size, workers, threads_per_worker) -> float:
+    start = time.perf_counter()
+    if workers == 1:
+        captions = iter_captions(
+            tagger,
+            images,
+            CaptionOptions(),
+            batch_size,
+            min(4, os.cpu_count() or 1),
+            batch_size * 4,
+        )
+    else:
+        captions = iter_captions_sharded(
+            tagger, images, CaptionOptions(), batch_size, workers, threads_per_worker
+        )
+    count = sum(1 for _ in captions)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker/thread split benchmark")
+    parser.add_argument("--model", type=Path, required=True)
+    parser.add_argument("--tags", type=Path, help="defaults to selected_tags.csv")
+    parser.add_argument("--images", type=Path, required=True)
+    parser.add_argument("--limit", type=int, default=256)
+    parser.add_argument("--cores", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    csv_path = args.tags or args.model.parent / "selected_tags.csv"
+    tag_names, rating_indexes, general_indexes, character_indexes = SelectedTagsLoader(
+        csv_path
+    ).load_tags()
+    images = sorted(p for p in args.images.iterdir() if p.suffix.lower() in IMAGE_EXTS)
+    images = images[: args.limit]
+    if not images:
+        print("No images found.")
+        return
+
+    results = []
+    for workers, threads in candidate_splits(args.cores):
+        tagger = ONNXTagger(
+            args.model,
+            tag_names,
+            rating_indexes,
+            general_indexes,
+            character_indexes,
+            intra_op_num_threads=threads,
+            inter_op_num_threads=1,
+        )
+        rate = measure(tagger, images, args.batch_size, workers, threads)
+        results.append((rate, workers, threads))
+        print(
+            f"{workers:>3} worker(s) x {threads:>3} thread(s): {rate:8.2f} images/sec"
+        )
+    rate, workers, threads = max(results)
+    print(
+        f"best split for {args.cores} cores: {workers} worker(s) x {threads} "
+        f"thread(s) ({rate:.2f} images/sec)"
+    )
+
+
+if __name__ == "__main__":
+    main()
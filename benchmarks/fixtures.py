@@ -0,0 +1,117 @@
+# offline stand-ins for benchmarks: a small generated ONNX tagger with the
+# same input and output layout as the wd-tagger models, and a synthetic image
+# corpus. Both are deterministic, so runs on different commits compare.
+from pathlib import Path
+import numpy as np
+from PIL import Image
+
+# conv layers per stand-in model; more layers means more compute per image
+STAND_IN_MODELS = {"tiny": 0, "small": 2, "medium": 4}
+
+
+def make_stand_in_model(
+    path: Path, layers: int = 0, tags: int = 10000, input_size: int = 448
+):
+    # NHWC float input -> sigmoid scores for `tags` tags, plus the
+    # selected_tags.csv next to it: four ratings, every fifth tag a character
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(0)
+    nodes = [helper.make_node("Transpose", ["input_1"], ["x0"], perm=[0, 3, 1, 2])]
+    initializers = []
+    channels = 3
+    for i in range(layers):
+        out_channels = 16 << i
+        weight = rng.normal(0, 0.1, (out_channels, channels, 3, 3)).astype(np.float32)
+        initializers.append(numpy_helper.from_array(weight, f"conv{i}"))
+        nodes.append(
+            helper.make_node(
+                "Conv",
+                [f"x{i}", f"conv{i}"],
+                [f"c{i}"],
+                kernel_shape=[3, 3],
+                strides=[2, 2],
+                pads=[1, 1, 1, 1],
+            )
+        )
+        nodes.append(helper.make_node("Relu", [f"c{i}"], [f"x{i + 1}"]))
+        channels = out_channels
+    if layers:
+        nodes.append(helper.make_node("GlobalAveragePool", [f"x{layers}"], ["pooled"]))
+        features = channels
+    else:
+        # an 8x8 grid of patch averages keeps the tiny model almost free
+        kernel = input_size // 8
+        nodes.append(
+            helper.make_node(
+                "AveragePool",
+                ["x0"],
+                ["pooled"],
+                kernel_shape=[kernel, kernel],
+                strides=[kernel, kernel],
+            )
+        )
+        features = channels * 64
+    weight = rng.normal(0, 0.5, (features, tags)).astype(np.float32)
+    bias = rng.normal(-3, 1.5, (tags,)).astype(np.float32)
+    initializers += [
+        numpy_helper.from_array(weight, "W"),
+        numpy_helper.from_array(bias, "b"),
+    ]
+    nodes += [
+        helper.make_node("Flatten", ["pooled"], ["flat"]),
+        helper.make_node("MatMul", ["flat", "W"], ["logits"]),
+        helper.make_node("Add", ["logits", "b"], ["biased"]),
+        helper.make_node("Sigmoid", ["biased"], ["output"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "stand_in_tagger",
+        [
+            helper.make_tensor_value_info(
+                "input_1", TensorProto.FLOAT, ["batch", input_size, input_size, 3]
+            )
+        ],
+        [helper.make_tensor_value_info("output", TensorProto.FLOAT, ["batch", tags])],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    onnx.save(model, path)
+    with open(path.parent / "selected_tags.csv", "w", encoding="utf-8") as f:
+        f.write("tag_id,name,category,count\n")
+        for i in range(tags):
+            category = 9 if i < 4 else (4 if i % 5 == 0 else 0)
+            f.write(f"{i},tag_{i},{category},1\n")
+    return path
+
+
+def make_corpus(folder: Path, count: int, size: tuple, fmt: str = "jpg", seed=0):
+    # smooth colour fields with fine noise, so files compress roughly like
+    # photos and illustrations rather than like flat colour or pure noise.
+    # Images generated by an earlier run are kept.
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    width, height = size
+    paths = []
+    for i in range(count):
+        path = folder / f"synthetic_{i:05d}.{fmt}"
+        paths.append(path)
+        if path.exists():
+            continue
+        rng = np.random.default_rng((seed, i))
+        coarse = rng.random((height // 64 + 2, width // 64 + 2, 3)) * 255
+        image = Image.fromarray(coarse.astype(np.uint8)).resize(
+            (width, height), Image.BICUBIC
+        )
+        noise = rng.normal(0, 8, (height, width, 3))
+        pixels = np.clip(np.asarray(image, dtype=np.float32) + noise, 0, 255)
+        image = Image.fromarray(pixels.astype(np.uint8))
+        if fmt == "png":
+            image.save(path, "PNG")
+        else:
+            image.save(path, "JPEG", quality=90)
+    return paths
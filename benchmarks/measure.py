@@ -0,0 +1,57 @@
+# timing and memory helpers shared by the benchmarks
+import sys
+import numpy as np
+
+
+def peak_rss_mb():
+    try:
+        import resource
+
+        # kilobytes on Linux, bytes on macOS
+        scale = 1 << 20 if sys.platform == "darwin" else 1 << 10
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    except ImportError:
+        pass
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().peak_wset / (1 << 20)
+    except (ImportError, AttributeError):
+        return None
+
+
+def reset_peak_rss() -> bool:
+    # Linux lets a process reset its own high-water mark, which gives every
+    # stage its own peak; elsewhere the peak covers the process so far
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def stage_peak_rss_mb():
+    # the high-water mark since the last reset_peak_rss, when there is one
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def summarize(latencies: list, items: int, elapsed: float) -> dict:
+    # latencies in seconds per call; items is how many images the calls covered
+    ms = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]) if len(ms) else (0.0, 0.0, 0.0)
+    return {
+        "calls": len(ms),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "mean_ms": float(ms.mean()) if len(ms) else 0.0,
+        "images_per_second": items / elapsed if elapsed > 0 else 0.0,
+    }
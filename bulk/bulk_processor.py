@@ -1,6 +1,19 @@
+import itertools
+import json
+import os
+import time
 from pathlib import Path
 from PIL import Image
 from tagger.model_runner import ONNXTagger
+from bulk.pipeline import CaptionOptions, CaptionWriter, iter_captions
+from bulk.process_pool import iter_captions_sharded
+from bulk.manifest import BulkManifest, settings_signature
+from bulk.journal import BulkJournal
+from bulk.probabilities import TopKWriter
+from bulk.metrics import format_stage_ms, profiled
+from captions.caption_store import CaptionStore
+from tagger.prob_cache import cached_file_digest
+from image_scanner import scan_images
 
 
 def tag_single_image(image_path: Path, tagger: ONNXTagger, output_dir: Path):
@@ -16,24 +29,278 @@ def tag_single_image(image_path: Path, tagger: ONNXTagger, output_dir: Path):
         return (image_path.name, False, str(e))
 
 
-def bulk_tag_images(tagger, folder_path: str, general_mcut=False, character_mcut=False):
+class BulkSummary:
+    # what a bulk run did, in counts only, so memory stays flat however many
+    # images the folder holds; failures are listed in the folder's journal
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        # unchanged since the manifest last saw them
+        self.skipped = 0
+        # finished by an earlier run of the same job that was cut short
+        self.resumed = 0
+        self.elapsed = 0.0
+
+    @property
+    def succeeded(self) -> int:
+        return self.processed - self.failed
+
+
+def bulk_tag_images(
+    tagger,
+    folder_path: str,
+    general_mcut=False,
+    character_mcut=False,
+    batch_size=8,
+    decode_workers=None,
+    prefetch=None,
+    workers=1,
+    threads_per_worker=None,
+    incremental=False,
+    force=False,
+    dry_run=False,
+    recursive=False,
+    progress_callback=None,
+    include_rating=False,
+    exclude_character=False,
+    control=None,
+    caption_store=False,
+    top_k=0,
+    metrics=None,
+    profile=None,
+    profile_path=None,
+    resume=True,
+    retry_failed=False,
+    general_threshold=None,
+    character_threshold=None,
+):
+    # progress_callback(processed, failed, skipped) is called from the writer
+    # thread, with resumed images counted as skipped; control is an optional
+    # JobControl for pause/resume/cancel.
+    # caption_store writes to the folder's CaptionStore instead of .txt files;
+    # top_k > 0 also saves each image's k most likely tags (bulk.probabilities).
+    # metrics is an optional bulk.metrics.RunMetrics fed with every result;
+    # profile ("cprofile" or "pyinstrument") profiles the run into profile_path.
+    # Progress goes to the folder's BulkJournal: a run that stopped early is
+    # resumed unless resume=False or force; retry_failed only retags the
+    # images that failed in the last run with these settings.
+    # The thresholds default to the tagger's and are fixed for the whole run,
+    # so a shared tagger can change its own meanwhile.
     folder = Path(folder_path)
-    image_exts = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
-    images = [p for p in folder.iterdir() if p.suffix.lower() in image_exts]
-    print(f"Found {len(images)} images.")
-    results = []
-    for img_path in images:
-        try:
-            image = Image.open(img_path)
-            sorted_general, rating, sorted_character, general_res = tagger.predict(
-                image, general_mcut=general_mcut, character_mcut=character_mcut
+    decode_workers = decode_workers or min(4, os.cpu_count() or 1)
+    prefetch = prefetch or batch_size * 4
+    if general_threshold is None:
+        general_threshold = tagger.general_threshold
+    if character_threshold is None:
+        character_threshold = tagger.character_threshold
+    options = CaptionOptions(
+        general_mcut,
+        character_mcut,
+        include_rating,
+        exclude_character,
+        top_k,
+        general_threshold,
+        character_threshold,
+    )
+    settings = settings_signature(tagger, options)
+    job = json.dumps([settings, recursive, bool(caption_store)])
+
+    manifest = None
+    store = None
+    journal = None
+    # a dry run never creates the manifest, store or journal, it only reads
+    # existing ones
+    if caption_store and (not dry_run or CaptionStore.exists(folder)):
+        store = CaptionStore(folder, durable=True)
+    if incremental and (not dry_run or BulkManifest.exists(folder)):
+        manifest = BulkManifest(folder, store)
+    probabilities = None
+
+    def checkpoint():
+        # on the writer thread, before the journal commits what it wrote
+        if store is not None:
+            store.commit()
+        if probabilities is not None:
+            probabilities.flush()
+
+    if not dry_run or BulkJournal.exists(folder):
+        journal = BulkJournal(folder, job, checkpoint)
+    if dry_run:
+        images = scan_images(folder, recursive=recursive)
+        pending = _dry_run(images, manifest, journal, settings, force, resume)
+        if store is not None:
+            store.close()
+        return pending
+
+    summary = BulkSummary()
+
+    def needs_tagging(img_path):
+        if manifest.needs_tagging(img_path, settings):
+            return True
+        summary.skipped += 1
+        return False
+
+    if retry_failed:
+        keys = journal.retry()
+        print(f"Retrying {len(keys)} failed images.")
+        images = (folder / key for key in keys if (folder / key).exists())
+        if journal.unfinished:
+            # finishing the job below must not drop the images it never got to
+            print("The last run stopped early, so the rest of it is tagged too.")
+            remaining = (
+                path
+                for path in scan_images(folder, recursive=recursive)
+                if not journal.attempted(path)
+            )
+            if manifest is not None and not force:
+                remaining = filter(needs_tagging, remaining)
+            images = itertools.chain(images, remaining)
+    else:
+        images = scan_images(folder, recursive=recursive)
+        if journal.start(resume and not force):
+            summary.resumed, earlier_failures = journal.counts()
+            summary.resumed += earlier_failures
+            print(
+                f"Resuming an interrupted run: {summary.resumed} images already "
+                f"done, {earlier_failures} of them failed."
             )
-            tags = sorted_general + sorted_character
-            txt_path = img_path.with_suffix(".txt")
-            with open(txt_path, "w", encoding="utf-8") as f:
-                f.write(", ".join(tags))
-            results.append((img_path.name, True, None))
-        except Exception as e:
-            print(f"Failed to process {img_path.name}: {e}")
-            results.append((img_path.name, False, str(e)))
-    return results
+            images = (path for path in images if not journal.attempted(path))
+        if manifest is not None and not force:
+            images = filter(needs_tagging, images)
+
+    model_id = None
+    if store is not None:
+        model_id = store.model_id(
+            tagger.model_path.name, cached_file_digest(tagger.model_path), settings
+        )
+    if top_k:
+        probabilities = TopKWriter(
+            folder, tagger, top_k, cached_file_digest(tagger.model_path)
+        )
+
+    if control is not None:
+        images = control.guard(images)
+    start_time = time.perf_counter()
+    if metrics is not None:
+        metrics.begin(
+            folder,
+            model=tagger.model_path.name,
+            batch_size=batch_size,
+            workers=workers,
+            decode_workers=decode_workers,
+            **options.as_dict(),
+        )
+
+    def on_done(result):
+        summary.processed += 1
+        if result.error is None:
+            if manifest is not None:
+                manifest.record(result, settings)
+        else:
+            summary.failed += 1
+            print(f"Failed to process {result.path.name}: {result.error}")
+        journal.record(result)
+        if metrics is not None:
+            metrics.record(result, result.path.relative_to(folder).as_posix())
+        processed = summary.processed
+        if processed % 1000 == 0:
+            elapsed = time.perf_counter() - start_time
+            print(f"Tagged {processed} images ({processed / elapsed:.1f} images/sec)")
+        if progress_callback is not None:
+            progress_callback(
+                processed, summary.failed, summary.skipped + summary.resumed
+            )
+
+    if workers > 1:
+        captions = iter_captions_sharded(
+            tagger,
+            images,
+            options,
+            batch_size,
+            workers,
+            threads_per_worker,
+        )
+    else:
+        captions = iter_captions(
+            tagger,
+            images,
+            options,
+            batch_size,
+            decode_workers,
+            prefetch,
+        )
+
+    if tagger.prob_cache is not None:
+        tagger.prob_cache.begin_bulk()
+    try:
+        with profiled(profile, profile_path), CaptionWriter(
+            on_done, store=store, model_id=model_id, probabilities=probabilities
+        ) as writer:
+            for result in captions:
+                writer.put(result)
+        # a cancelled job stays open in the journal, so the next run resumes it
+        if control is None or not control.cancelled:
+            journal.finish()
+    finally:
+        if probabilities is not None:
+            probabilities.close()
+        # the outputs are saved before the manifest and journal, so neither
+        # records an image whose caption was not saved; while running, the
+        # journal's checkpoint does the same before each of its commits
+        if store is not None:
+            store.close()
+        if manifest is not None:
+            manifest.close()
+        journal.close()
+        if tagger.prob_cache is not None:
+            tagger.prob_cache.end_bulk()
+            tagger.prob_cache.flush()
+    elapsed = max(time.perf_counter() - start_time, 1e-9)
+    summary.elapsed = elapsed
+    print(
+        f"Tagged {summary.processed} images in {elapsed:.1f}s "
+        f"({summary.processed / elapsed:.1f} images/sec, batch size {batch_size}, "
+        f"{workers} worker(s)), {summary.failed} failed, "
+        f"{summary.skipped} unchanged, {summary.resumed} done earlier."
+    )
+    if metrics is not None:
+        run = metrics.close(skipped=summary.skipped, resumed=summary.resumed)
+        # only metrics that were asked for are reported; the GUI keeps a
+        # RunMetrics without a path for its live display
+        if metrics.path is not None:
+            stage_ms = {stage: s["mean_ms"] for stage, s in run["stages"].items()}
+            if stage_ms:
+                print(f"Mean time per image: {format_stage_ms(stage_ms)}")
+            for entry in run["slowest"][:5]:
+                print(f"  slow: {entry['path']} {entry['ms']:.0f}ms")
+            print(f"Metrics written to {metrics.path}")
+    return summary
+
+
+def _dry_run(images, manifest, journal, settings, force, resume):
+    pending = []
+    total = 0
+    done_earlier = 0
+    resuming = journal is not None and journal.unfinished and resume and not force
+    for img_path in images:
+        total += 1
+        if resuming and journal.attempted(img_path):
+            done_earlier += 1
+            continue
+        if force:
+            reason = "forced"
+        elif manifest is None:
+            reason = "new"
+        else:
+            reason = manifest.needs_tagging(img_path, settings, update=False)
+        if reason:
+            print(f"Would tag {img_path.name} ({reason})")
+            pending.append((img_path.name, reason))
+    if manifest is not None:
+        manifest.close()
+    if journal is not None:
+        journal.close()
+    if done_earlier:
+        print(f"{done_earlier} images are done already, the run would resume.")
+    print(f"{len(pending)} of {total} images would be tagged.")
+    return pending
@@ -0,0 +1,142 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+JOURNAL_NAME = ".tag_manager_journal.sqlite"
+
+
+class BulkJournal:
+    # durable progress of a folder's bulk job: every finished image is
+    # appended as done or failed and committed in batches, so a job cut short
+    # by a crash, reboot or cancel resumes where it stopped. A job is its
+    # settings signature; entries are only ever appended and the latest one
+    # per image counts. Starting a job over drops the previous entries.
+    # checkpoint() runs before every commit and must save whatever the
+    # recorded images wrote (captions, probabilities), so an image is never
+    # journaled as done while its output could still be lost.
+    COMMIT_EVERY = 200
+
+    def __init__(self, folder: Path, signature: str, checkpoint=None):
+        self.folder = Path(folder)
+        self.signature = signature
+        self.checkpoint = checkpoint
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.job = None
+        self.db = sqlite3.connect(self.folder / JOURNAL_NAME, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # batched commits keep FULL cheap, and entries survive a power cut
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, "
+            "signature TEXT, started REAL, finished REAL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (seq INTEGER PRIMARY KEY, "
+            "job INTEGER, path TEXT, ok INTEGER, error TEXT)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_path ON entries (job, path, seq)"
+        )
+        self.db.commit()
+        row = self.db.execute(
+            "SELECT id, signature, finished FROM jobs ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        # the last job, when it ran with these settings
+        self.last_job = row[0] if row is not None and row[1] == signature else None
+        self.unfinished = self.last_job is not None and row[2] is None
+
+    @staticmethod
+    def exists(folder: Path) -> bool:
+        return (Path(folder) / JOURNAL_NAME).exists()
+
+    def key(self, img_path: Path) -> str:
+        return img_path.relative_to(self.folder).as_posix()
+
+    def start(self, resume=True) -> bool:
+        # resumes the last job if it stopped early with the same settings,
+        # otherwise starts a new one; returns whether it resumed
+        with self.lock:
+            if resume and self.unfinished:
+                self.job = self.last_job
+                return True
+            self.db.execute("DELETE FROM entries")
+            self.db.execute("DELETE FROM jobs")
+            self.job = self.db.execute(
+                "INSERT INTO jobs (signature, started) VALUES (?, ?)",
+                (self.signature, time.time()),
+            ).lastrowid
+            self.db.commit()
+            return False
+
+    def retry(self) -> list:
+        # reopens the last job with these settings and returns the keys of the
+        # images whose latest entry failed; failures are few, so they are read
+        # up front rather than streamed while new entries go in
+        if self.last_job is None:
+            return []
+        with self.lock:
+            self.job = self.last_job
+            self.db.execute("UPDATE jobs SET finished = NULL WHERE id = ?", (self.job,))
+            self.db.commit()
+            return [
+                path
+                for (path,) in self.db.execute(
+                    "SELECT path FROM entries AS e WHERE job = ? AND ok = 0 AND "
+                    "seq = (SELECT MAX(seq) FROM entries WHERE job = e.job "
+                    "AND path = e.path)",
+                    (self.job,),
+                )
+            ]
+
+    def attempted(self, img_path: Path) -> bool:
+        # done or failed in the current job
+        with self.lock:
+            row = self.db.execute(
+                "SELECT 1 FROM entries WHERE job = ? AND path = ? LIMIT 1",
+                (self.last_job if self.job is None else self.job, self.key(img_path)),
+            ).fetchone()
+        return row is not None
+
+    def counts(self) -> tuple:
+        # (done, failed) images of the current job, by latest entry
+        with self.lock:
+            row = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(ok = 0), 0) FROM entries AS e "
+                "WHERE job = ? AND seq = (SELECT MAX(seq) FROM entries "
+                "WHERE job = e.job AND path = e.path)",
+                (self.job,),
+            ).fetchone()
+        return row[0] - row[1], row[1]
+
+    def record(self, result):
+        error = None if result.error is None else str(result.error)
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO entries (job, path, ok, error) VALUES (?, ?, ?, ?)",
+                (self.job, self.key(result.path), error is None, error),
+            )
+            self.pending += 1
+            if self.pending >= self.COMMIT_EVERY:
+                self.commit()
+
+    def commit(self):
+        # called with the lock held
+        if self.checkpoint is not None:
+            self.checkpoint()
+        self.db.commit()
+        self.pending = 0
+
+    def finish(self):
+        with self.lock:
+            self.db.execute(
+                "UPDATE jobs SET finished = ? WHERE id = ?", (time.time(), self.job)
+            )
+            self.db.commit()
+
+    def close(self):
+        # the caller saves the outputs first, as close() has no checkpoint
+        with self.lock:
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,105 @@
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from tagger.prob_cache import cached_file_digest, file_digest
+
+MANIFEST_NAME = ".tag_manager_manifest.sqlite"
+
+
+def settings_signature(tagger, options) -> str:
+    return json.dumps(
+        {
+            "general_threshold": tagger.general_threshold,
+            "character_threshold": tagger.character_threshold,
+            **options.as_dict(),
+            "model": tagger.model_path.name,
+            "model_digest": cached_file_digest(tagger.model_path),
+            "fast_decode": tagger.fast_decode,
+        },
+        sort_keys=True,
+    )
+
+
+class BulkManifest:
+    # per-folder record of what each image was last tagged from and with
+    COMMIT_EVERY = 500
+
+    def __init__(self, folder: Path, store=None):
+        # with a CaptionStore, captions are looked for there instead of .txt
+        self.folder = Path(folder)
+        self.store = store
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.db = sqlite3.connect(self.folder / MANIFEST_NAME, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, "
+            "mtime_ns INTEGER, size INTEGER, digest TEXT, settings TEXT)"
+        )
+
+    @staticmethod
+    def exists(folder: Path) -> bool:
+        return (Path(folder) / MANIFEST_NAME).exists()
+
+    def key(self, img_path: Path) -> str:
+        return img_path.relative_to(self.folder).as_posix()
+
+    def needs_tagging(self, img_path: Path, settings: str, update=True):
+        # returns the reason an image has to be (re)tagged, or None to skip it
+        key = self.key(img_path)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT mtime_ns, size, digest, settings FROM images WHERE path = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return "new"
+        mtime_ns, size, digest, old_settings = row
+        if old_settings != settings:
+            return "settings changed"
+        if not self.has_caption(img_path, key):
+            return "caption missing"
+        stat = os.stat(img_path)
+        if stat.st_size != size:
+            return "modified"
+        if stat.st_mtime_ns != mtime_ns:
+            # touched but possibly unchanged, e.g. after a copy
+            if file_digest(img_path) != digest:
+                return "modified"
+            if update:
+                with self.lock:
+                    self.db.execute(
+                        "UPDATE images SET mtime_ns = ? WHERE path = ?",
+                        (stat.st_mtime_ns, key),
+                    )
+        return None
+
+    def has_caption(self, img_path: Path, key: str) -> bool:
+        if self.store is not None:
+            return self.store.has(key)
+        return img_path.with_suffix(".txt").exists()
+
+    def record(self, result, settings: str):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO images "
+                "(path, mtime_ns, size, digest, settings) VALUES (?, ?, ?, ?, ?)",
+                (
+                    self.key(result.path),
+                    result.mtime_ns,
+                    result.size,
+                    result.digest,
+                    settings,
+                ),
+            )
+            self.pending += 1
+            if self.pending >= self.COMMIT_EVERY:
+                self.db.commit()
+                self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
@@ -0,0 +1,240 @@
+import contextlib
+import heapq
+import json
+import random
+import time
+from array import array
+from pathlib import Path
+import numpy as np
+from config_manager import CONFIG_DIR
+
+METRICS_DIR = CONFIG_DIR / "metrics"
+
+# in pipeline order; ImageResult.timings holds seconds per stage. Batch stages
+# (inference, postprocess) are split evenly over the images of the batch.
+STAGES = ["read", "hash", "decode", "inference", "postprocess", "write"]
+
+
+def to_ms(timings: dict) -> dict:
+    return {stage: round(seconds * 1000, 3) for stage, seconds in timings.items()}
+
+
+class StageStats:
+    # one stage's timings in constant memory: exact count, total and max, and
+    # a uniform random sample of at most `size` values for the percentiles
+    def __init__(self, size=10000, seed=0):
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sample = array("f")
+        self.random = random.Random(seed)
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.sample) < self.size:
+            self.sample.append(seconds)
+            return
+        # reservoir sampling keeps every value seen equally likely
+        slot = self.random.randrange(self.count)
+        if slot < self.size:
+            self.sample[slot] = seconds
+
+
+def default_metrics_path(folder: Path) -> Path:
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return METRICS_DIR / f"{stamp}_{Path(folder).name or 'root'}.jsonl"
+
+
+class RunMetrics:
+    # opt-in instrumentation for one bulk run, fed by bulk_tag_images with every
+    # finished ImageResult (on the writer thread). Writes JSON lines: one
+    # "image" record per image, a "snapshot" every `snapshot_interval`
+    # seconds and a "summary" with stage percentiles and the slowest files.
+    # Memory stays flat however many images a run has: stages keep streaming
+    # totals, and percentiles come from a fixed-size sample once a run has
+    # more images than `sample_size`.
+    def __init__(
+        self,
+        path: Path = None,
+        per_image=True,
+        slowest=20,
+        snapshot_interval=5.0,
+        sample_size=10000,
+    ):
+        self.path = Path(path) if path else None
+        self.per_image = per_image
+        self.slowest_count = slowest
+        self.snapshot_interval = snapshot_interval
+        self.file = None
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(self.path, "w", encoding="utf-8")
+        self.stats = {stage: StageStats(sample_size) for stage in STAGES}
+        self.slowest = []
+        self.processed = 0
+        self.failed = 0
+        self.start = None
+        self.window_start = None
+        self.window_count = 0
+        self.window_totals = dict.fromkeys(STAGES, 0.0)
+        self.latest = None
+
+    def begin(self, folder, **settings):
+        self.start = self.window_start = time.perf_counter()
+        self.emit({"type": "start", "folder": str(folder), "settings": settings})
+
+    def emit(self, record: dict):
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+
+    def record(self, result, key: str):
+        timings = result.timings
+        self.processed += 1
+        if result.error is not None:
+            self.failed += 1
+        for stage, seconds in timings.items():
+            self.stats[stage].add(seconds)
+            self.window_totals[stage] += seconds
+        self.window_count += 1
+        work = sum(timings.values())
+        # a min-heap of the slowest images seen so far
+        entry = (work, key, timings)
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, entry)
+        elif work > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, entry)
+        if self.per_image:
+            self.emit(
+                {
+                    "type": "image",
+                    "path": key,
+                    "ok": result.error is None,
+                    "error": None if result.error is None else str(result.error),
+                    "bytes": result.size,
+                    "ms": to_ms(timings),
+                }
+            )
+        now = time.perf_counter()
+        if now - self.window_start >= self.snapshot_interval:
+            self.take_snapshot(now)
+
+    def take_snapshot(self, now=None) -> dict:
+        now = now or time.perf_counter()
+        window = max(now - self.window_start, 1e-9)
+        count = max(self.window_count, 1)
+        self.latest = {
+            "type": "snapshot",
+            "elapsed": now - self.start,
+            "processed": self.processed,
+            "failed": self.failed,
+            "images_per_second": self.window_count / window,
+            "overall_images_per_second": self.processed / max(now - self.start, 1e-9),
+            "stage_ms": {
+                stage: round(total / count * 1000, 3)
+                for stage, total in self.window_totals.items()
+                if total
+            },
+            "slowest": self.slowest_files(1),
+        }
+        self.emit(self.latest)
+        if self.file is not None:
+            self.file.flush()
+        self.window_start = now
+        self.window_count = 0
+        self.window_totals = dict.fromkeys(STAGES, 0.0)
+        return self.latest
+
+    def slowest_files(self, count=None) -> list:
+        ranked = sorted(self.slowest, reverse=True)[:count]
+        return [
+            {
+                "path": key,
+                "ms": round(work * 1000, 3),
+                "stage_ms": to_ms(timings),
+            }
+            for work, key, timings in ranked
+        ]
+
+    def stage_summary(self) -> dict:
+        summary = {}
+        for stage, stats in self.stats.items():
+            if not stats.count:
+                continue
+            ms = np.frombuffer(stats.sample, dtype=np.float32) * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            summary[stage] = {
+                "count": stats.count,
+                "total_s": stats.total,
+                "mean_ms": stats.total / stats.count * 1000,
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99),
+                "max_ms": stats.max * 1000,
+            }
+        return summary
+
+    def close(self, **extra) -> dict:
+        elapsed = time.perf_counter() - self.start if self.start else 0.0
+        summary = {
+            "type": "summary",
+            "elapsed": elapsed,
+            "processed": self.processed,
+            "failed": self.failed,
+            "images_per_second": self.processed / elapsed if elapsed else 0.0,
+            "stages": self.stage_summary(),
+            "slowest": self.slowest_files(),
+            **extra,
+        }
+        self.emit(summary)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        return summary
+
+
+def format_stage_ms(stage_ms: dict) -> str:
+    return ", ".join(
+        f"{stage} {stage_ms[stage]:.1f}ms" for stage in STAGES if stage in stage_ms
+    )
+
+
+@contextlib.contextmanager
+def profiled(kind: str, path: Path):
+    # profiles the calling thread: the loop that feeds decoding and runs
+    # inference. Writes a pstats file for "cprofile" or an HTML report for
+    # "pyinstrument" (pip install pyinstrument)
+    if not kind:
+        yield
+        return
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if kind == "cprofile":
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+            print(f"Profile written to {path}")
+        return
+    if kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise SystemExit("pyinstrument profiling needs: pip install pyinstrument")
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path.write_text(profiler.output_html(), "utf-8")
+            print(f"Profile written to {path}")
+        return
+    raise ValueError(f"Unknown profiler: {kind}")
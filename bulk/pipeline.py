@@ -0,0 +1,338 @@
+import io
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+from tagger.model_runner import compose_tags
+from tagger.prob_cache import bytes_digest
+from bulk.probabilities import top_k_batch
+
+
+class CaptionOptions:
+    # how probabilities become a caption; shared by every bulk execution mode
+    def __init__(
+        self,
+        general_mcut=False,
+        character_mcut=False,
+        include_rating=False,
+        exclude_character=False,
+        top_k=0,
+        general_threshold=None,
+        character_threshold=None,
+    ):
+        self.general_mcut = general_mcut
+        self.character_mcut = character_mcut
+        self.include_rating = include_rating
+        self.exclude_character = exclude_character
+        # keep the k most likely tags of every image next to its caption
+        self.top_k = top_k
+        # None uses the tagger's; bulk_tag_images fixes both when a job starts
+        self.general_threshold = general_threshold
+        self.character_threshold = character_threshold
+
+    def thresholds(self):
+        if self.general_threshold is None or self.character_threshold is None:
+            return None
+        return self.general_threshold, self.character_threshold
+
+    def as_dict(self) -> dict:
+        options = dict(vars(self))
+        # left out while off, so existing manifests stay valid
+        if not self.top_k:
+            del options["top_k"]
+        for name in ("general_threshold", "character_threshold"):
+            if options[name] is None:
+                del options[name]
+        return options
+
+
+class JobControl:
+    # lets another thread pause, resume or cancel a running bulk job; the job
+    # stops feeding new images, and what is already in flight gets written
+    def __init__(self):
+        self.cancelled = False
+        self.resumed = threading.Event()
+        self.resumed.set()
+
+    def pause(self):
+        self.resumed.clear()
+
+    def resume(self):
+        self.resumed.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.resumed.set()
+
+    @property
+    def paused(self) -> bool:
+        return not self.resumed.is_set()
+
+    def guard(self, images):
+        for img_path in images:
+            self.resumed.wait()
+            if self.cancelled:
+                return
+            yield img_path
+
+
+class ImageResult:
+    # one image's trip through the pipeline; filled in stage by stage
+    def __init__(self, path: Path):
+        self.path = path
+        self.caption = None
+        # the model's probability for each tag in the caption
+        self.scores = None
+        # (ids, values, ratings) when CaptionOptions.top_k is set
+        self.top_k = None
+        self.error = None
+        self.digest = None
+        self.mtime_ns = None
+        self.size = None
+        # seconds spent on this image per stage, see bulk.metrics.STAGES
+        self.timings = {}
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.caption is not None
+
+
+def decode_image(result: ImageResult, tagger):
+    # returns (resized, cached_preds); the file is read once, hashed and stat'ed
+    # from the same handle, and a probability cache hit skips decoding entirely
+    timings = result.timings
+    start = time.perf_counter()
+    with open(result.path, "rb") as f:
+        stat = os.fstat(f.fileno())
+        data = f.read()
+    read = time.perf_counter()
+    timings["read"] = read - start
+    result.mtime_ns = stat.st_mtime_ns
+    result.size = stat.st_size
+    result.digest = bytes_digest(data)
+    if tagger.prob_cache is not None:
+        preds = tagger.prob_cache.get(result.digest)
+        if preds is not None:
+            timings["hash"] = time.perf_counter() - read
+            return None, preds
+    hashed = time.perf_counter()
+    timings["hash"] = hashed - read
+    try:
+        image = Image.open(io.BytesIO(data))
+    except UnidentifiedImageError:
+        # the same message as opening the file by path, which names the file
+        raise UnidentifiedImageError(
+            f"cannot identify image file {os.fspath(result.path)!r}"
+        ) from None
+    with image:
+        resized = tagger.resize_image(image, tagger.target_size)
+    timings["decode"] = time.perf_counter() - hashed
+    return resized, None
+
+
+def share_time(results, stage: str, start: float):
+    # a batch stage's time, split evenly over the images in the batch
+    share = (time.perf_counter() - start) / len(results)
+    for result in results:
+        result.timings[stage] = share
+
+
+def iter_prepared(images, tagger, decode_workers: int, prefetch: int):
+    # decodes and preprocesses on a thread pool while keeping at most `prefetch`
+    # images in flight, yielding (result, resized, cached_preds) in input order
+    paths = iter(images)
+    pending = deque()
+
+    def submit(pool, img_path):
+        result = ImageResult(img_path)
+        pending.append((result, pool.submit(decode_image, result, tagger)))
+
+    with ThreadPoolExecutor(
+        max_workers=decode_workers, thread_name_prefix="decode"
+    ) as pool:
+        for img_path in paths:
+            submit(pool, img_path)
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            result, future = pending.popleft()
+            next_path = next(paths, None)
+            if next_path is not None:
+                submit(pool, next_path)
+            try:
+                resized, cached_preds = future.result()
+            except Exception as e:
+                result.error = e
+                resized = cached_preds = None
+            yield result, resized, cached_preds
+
+
+def caption_batch(tagger, results, batch_resized, options: CaptionOptions):
+    # runs one batch and fills in the caption or error of every result
+    start = time.perf_counter()
+    try:
+        batch_preds = tagger.run_resized(batch_resized)
+        if tagger.prob_cache is not None:
+            tagger.prob_cache.put_many(
+                [result.digest for result in results], batch_preds
+            )
+    except Exception as e:
+        for result in results:
+            result.error = e
+        return results
+    share_time(results, "inference", start)
+    return caption_preds(tagger, results, batch_preds, options)
+
+
+def caption_preds(tagger, results, batch_preds, options: CaptionOptions):
+    start = time.perf_counter()
+    try:
+        batch_tags = tagger.postprocess_batch(
+            batch_preds,
+            general_mcut=options.general_mcut,
+            character_mcut=options.character_mcut,
+            thresholds=options.thresholds(),
+        )
+    except Exception as e:
+        for result in results:
+            result.error = e
+        return results
+    columns = tagger.tag_columns
+    for result, preds, (sorted_general, rating, sorted_character, general_res) in zip(
+        results, batch_preds, batch_tags
+    ):
+        tags = compose_tags(
+            sorted_general,
+            rating,
+            sorted_character,
+            options.include_rating,
+            options.exclude_character,
+        )
+        result.caption = ", ".join(tags)
+        result.scores = {tag: round(float(preds[columns[tag]]), 4) for tag in tags}
+    if options.top_k:
+        ids, values, ratings = top_k_batch(tagger, batch_preds, options.top_k)
+        for i, result in enumerate(results):
+            result.top_k = (ids[i], values[i], ratings[i])
+    share_time(results, "postprocess", start)
+    return results
+
+
+def iter_captions(
+    tagger, images, options: CaptionOptions, batch_size, decode_workers, prefetch
+):
+    batch = []
+    batch_resized = []
+    for result, resized, cached_preds in iter_prepared(
+        images, tagger, decode_workers, prefetch
+    ):
+        if result.error is not None:
+            yield result
+        elif cached_preds is not None:
+            yield from caption_preds(
+                tagger, [result], cached_preds[np.newaxis], options
+            )
+        else:
+            batch.append(result)
+            batch_resized.append(resized)
+            if len(batch_resized) >= batch_size:
+                yield from caption_batch(tagger, batch, batch_resized, options)
+                batch = []
+                batch_resized = []
+    if batch_resized:
+        yield from caption_batch(tagger, batch, batch_resized, options)
+
+
+class CaptionWriter:
+    # writes caption files on a background thread; put() blocks once
+    # `max_pending` writes are queued so a slow disk throttles inference.
+    # With a CaptionStore, captions and their scores go there instead of .txt;
+    # with a TopKWriter, top-k probabilities are appended after the caption.
+    # If on_done raises, the writer drops everything after it and put() or
+    # close() re-raise the error on the caller's thread
+    def __init__(
+        self,
+        on_done,
+        max_pending: int = 256,
+        store=None,
+        model_id=None,
+        probabilities=None,
+    ):
+        self.on_done = on_done
+        self.store = store
+        self.model_id = model_id
+        self.probabilities = probabilities
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.thread = threading.Thread(
+            target=self._run, name="caption-writer", daemon=True
+        )
+        self.thread.start()
+
+    def put(self, result: ImageResult):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(result)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            result = self.queue.get()
+            if result is None:
+                return
+            # after a failure the queue is still drained, so put() never blocks
+            if self.error is not None:
+                continue
+            if result.error is None:
+                start = time.perf_counter()
+                try:
+                    self.write(result)
+                except Exception as e:
+                    result.error = e
+                result.timings["write"] = time.perf_counter() - start
+            try:
+                self.on_done(result)
+            except Exception as e:
+                self.error = e
+
+    def write(self, result: ImageResult):
+        self.write_caption(result)
+        if self.probabilities is not None and result.top_k is not None:
+            key = self.probabilities.key(result.path)
+            self.probabilities.append(key, *result.top_k)
+
+    def write_caption(self, result: ImageResult):
+        if self.store is not None:
+            self.store.put(
+                self.store.key(result.path),
+                result.caption,
+                result.scores,
+                self.model_id,
+                result.mtime_ns,
+                result.size,
+            )
+            return
+        txt_path = result.path.with_suffix(".txt")
+        with open(txt_path, "w", encoding="utf-8") as f:
+            f.write(result.caption)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except Exception:
+            # the writer's error is usually what is already propagating
+            if exc_type is None:
+                raise
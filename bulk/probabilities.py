@@ -0,0 +1,220 @@
+import json
+import os
+from pathlib import Path
+import numpy as np
+
+PROBS_DIR = ".tag_manager_probs"
+FORMAT_VERSION = 1
+# int16 tag ids
+MAX_TAGS = 32767
+
+
+def top_k_batch(tagger, preds: np.ndarray, k: int):
+    # the k most likely general/character tags of every row, best first, as
+    # (int16 ids [N, k], float16 values [N, k]) plus every rating as float16
+    candidates = np.sort(np.concatenate([tagger.general_idx, tagger.character_idx]))
+    k = min(k, len(candidates))
+    probs = preds[:, candidates]
+    # argpartition finds the top k in linear time; only those k get sorted
+    part = np.argpartition(-probs, k - 1, axis=1)[:, :k]
+    part_values = np.take_along_axis(probs, part, axis=1)
+    order = np.argsort(-part_values, axis=1, kind="stable")
+    ids = candidates[np.take_along_axis(part, order, axis=1)].astype(np.int16)
+    values = np.take_along_axis(part_values, order, axis=1).astype(np.float16)
+    ratings = preds[:, tagger.rating_idx].astype(np.float16)
+    return ids, values, ratings
+
+
+def model_meta(tagger, k: int, model_digest: str) -> dict:
+    return {
+        "version": FORMAT_VERSION,
+        "k": k,
+        "model": tagger.model_path.name,
+        "model_digest": model_digest,
+        "tag_names": list(tagger.tag_names),
+        "rating_indexes": [int(i) for i in tagger.rating_idx],
+        "general_indexes": [int(i) for i in tagger.general_idx],
+        "character_indexes": [int(i) for i in tagger.character_idx],
+    }
+
+
+class TopKWriter:
+    # appends each image's top-k probabilities to flat binary files under
+    # <folder>/.tag_manager_probs, so a whole dataset can be memory-mapped
+    # later. Rows are only ever appended: a retagged image gets a new row and
+    # readers take the last one per key. A different model, k or tag list
+    # starts the files over.
+    def __init__(self, folder: Path, tagger, k: int, model_digest: str):
+        if len(tagger.tag_names) > MAX_TAGS:
+            raise ValueError(f"{len(tagger.tag_names)} tags do not fit int16 ids")
+        self.folder = Path(folder)
+        self.root = self.folder / PROBS_DIR
+        self.root.mkdir(exist_ok=True)
+        self.k = min(k, len(tagger.general_idx) + len(tagger.character_idx))
+        self.meta = model_meta(tagger, self.k, model_digest)
+        self.ratings = len(self.meta["rating_indexes"])
+        meta_path = self.root / "meta.json"
+        old = None
+        if meta_path.exists():
+            old = json.loads(meta_path.read_text("utf-8"))
+        if old is None or {**old, "rows": 0} != {**self.meta, "rows": 0}:
+            if old is not None:
+                print(f"[TopKWriter] Model or k changed, starting {self.root} over")
+            for name in ("keys.txt", "ids.i16", "values.f16", "ratings.f16"):
+                (self.root / name).unlink(missing_ok=True)
+            self.rows = 0
+        else:
+            self.rows = repair(self.root, self.k, self.ratings)
+        self.write_meta()
+        self.keys = open(self.root / "keys.txt", "a", encoding="utf-8")
+        self.ids = open(self.root / "ids.i16", "ab")
+        self.values = open(self.root / "values.f16", "ab")
+        self.rating_file = open(self.root / "ratings.f16", "ab")
+
+    def key(self, img_path: Path) -> str:
+        return Path(img_path).relative_to(self.folder).as_posix()
+
+    def write_meta(self):
+        temp = self.root / "meta.json.tmp"
+        temp.write_text(json.dumps({**self.meta, "rows": self.rows}), "utf-8")
+        os.replace(temp, self.root / "meta.json")
+
+    def append(self, key: str, ids, values, ratings):
+        # the binary rows go first, so a crash leaves at most a partial row
+        # without a key, which repair() trims away
+        self.ids.write(np.asarray(ids, dtype=np.int16).tobytes())
+        self.values.write(np.asarray(values, dtype=np.float16).tobytes())
+        self.rating_file.write(np.asarray(ratings, dtype=np.float16).tobytes())
+        self.keys.write(key.replace("\n", " ") + "\n")
+        self.rows += 1
+
+    def flush(self):
+        # makes every appended row durable; keys go last, like in append()
+        for f in (self.ids, self.values, self.rating_file, self.keys):
+            f.flush()
+            os.fsync(f.fileno())
+        self.write_meta()
+
+    def close(self):
+        for f in (self.ids, self.values, self.rating_file, self.keys):
+            f.close()
+        self.write_meta()
+
+
+def complete_rows(root: Path, keys: int, k: int, ratings: int) -> int:
+    # rows present in every file; a run still going or cut short can leave
+    # some files a row or a partial row ahead of the others
+    rows = min(
+        keys,
+        os.path.getsize(root / "ids.i16") // (2 * k),
+        os.path.getsize(root / "values.f16") // (2 * k),
+    )
+    if ratings:
+        rows = min(rows, os.path.getsize(root / "ratings.f16") // (2 * ratings))
+    return rows
+
+
+def repair(root: Path, k: int, ratings: int) -> int:
+    # trims every file to the rows that made it into all of them
+    for name in ("ids.i16", "values.f16", "ratings.f16"):
+        open(root / name, "ab").close()
+    with open(root / "keys.txt", "a+", encoding="utf-8") as f:
+        f.seek(0)
+        lines = f.read().split("\n")
+    # a last line without its newline is a key that was cut off
+    complete = lines[:-1]
+    rows = complete_rows(root, len(complete), k, ratings)
+    with open(root / "keys.txt", "w", encoding="utf-8") as f:
+        f.writelines(key + "\n" for key in complete[:rows])
+    for name, width in (("ids.i16", k), ("values.f16", k), ("ratings.f16", ratings)):
+        os.truncate(root / name, rows * width * 2)
+    return rows
+
+
+class TopKProbabilities:
+    # read side: memory-maps what TopKWriter wrote. ids/values are [rows, k],
+    # ratings [rows, ratings]; `rows` maps each key to its latest row
+    def __init__(self, folder: Path):
+        self.root = Path(folder) / PROBS_DIR
+        self.meta = json.loads((self.root / "meta.json").read_text("utf-8"))
+        self.k = self.meta["k"]
+        self.tag_names = np.asarray(self.meta["tag_names"], dtype=object)
+        self.rating_names = self.tag_names[self.meta["rating_indexes"]].tolist()
+        with open(self.root / "keys.txt", "r", encoding="utf-8") as f:
+            keys = f.read().split("\n")[:-1]
+        width = len(self.rating_names)
+        count = complete_rows(self.root, len(keys), self.k, width)
+        self.ids = self._map("ids.i16", np.int16, count, self.k)
+        self.values = self._map("values.f16", np.float16, count, self.k)
+        self.ratings = self._map("ratings.f16", np.float16, count, width)
+        # later rows win, so a retagged image resolves to its newest result
+        self.rows = {key: row for row, key in enumerate(keys[:count])}
+
+    @staticmethod
+    def exists(folder: Path) -> bool:
+        return (Path(folder) / PROBS_DIR / "meta.json").exists()
+
+    def _map(self, name, dtype, rows, width):
+        if rows == 0 or width == 0:
+            return np.zeros((rows, width), dtype=dtype)
+        return np.memmap(self.root / name, dtype=dtype, mode="r", shape=(rows, width))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def scores(self, key: str) -> dict:
+        row = self.rows[key]
+        names = self.tag_names[self.ids[row]].tolist()
+        return dict(zip(names, self.values[row].astype(np.float32).tolist()))
+
+    def thresholds(self, general_threshold: float, character_threshold: float):
+        # per tag id cutoff; ratings and unknown ids never pass
+        cutoffs = np.full(len(self.tag_names), np.inf, dtype=np.float32)
+        cutoffs[self.meta["general_indexes"]] = general_threshold
+        cutoffs[self.meta["character_indexes"]] = character_threshold
+        return cutoffs
+
+    def rethreshold(
+        self,
+        general_threshold: float,
+        character_threshold: float,
+        include_rating=False,
+        exclude_character=False,
+    ) -> dict:
+        # key -> tag list, in the order bulk tagging writes them, computed
+        # from the stored values alone. Tags below the k-th value of an image
+        # were not kept, so this matches a fresh run while thresholds stay
+        # above it, up to float16 rounding of scores within ~1e-4 of a cutoff.
+        cutoffs = self.thresholds(general_threshold, character_threshold)
+        if exclude_character:
+            cutoffs[self.meta["character_indexes"]] = np.inf
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+        ids = np.asarray(self.ids[rows], dtype=np.intp)
+        passed = np.asarray(self.values[rows], dtype=np.float32) > cutoffs[ids]
+        character = np.zeros(len(self.tag_names), dtype=bool)
+        character[self.meta["character_indexes"]] = True
+        best_rating = None
+        if include_rating and self.rating_names:
+            best_rating = np.asarray(self.ratings[rows]).argmax(axis=1)
+        captions = {}
+        for i, key in enumerate(self.rows):
+            selected = ids[i][passed[i]]
+            # general tags first, then characters, each best first
+            is_character = character[selected]
+            tags = self.tag_names[selected[~is_character]].tolist()
+            tags += self.tag_names[selected[is_character]].tolist()
+            if best_rating is not None:
+                tags.insert(0, self.rating_names[best_rating[i]])
+            captions[key] = tags
+        return captions
+
+    def tag_counts(self, general_threshold: float, character_threshold: float):
+        # how many images each tag would be kept on at these thresholds
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+        ids = np.asarray(self.ids[rows], dtype=np.intp)
+        cutoffs = self.thresholds(general_threshold, character_threshold)
+        passed = np.asarray(self.values[rows], dtype=np.float32) > cutoffs[ids]
+        counts = np.bincount(ids[passed], minlength=len(self.tag_names))
+        return {
+            self.tag_names[i]: int(counts[i]) for i in np.flatnonzero(counts).tolist()
+        }
@@ -0,0 +1,110 @@
+import multiprocessing
+import os
+from collections import deque
+from tagger.model_runner import ONNXTagger
+from bulk.pipeline import CaptionOptions, ImageResult, caption_batch, decode_image
+
+_worker_tagger = None
+# why the worker's tagger could not be created; raising in the initializer
+# would only make the pool respawn the worker forever
+_worker_error = None
+
+
+def tagger_init_args(tagger: ONNXTagger, threads_per_worker: int):
+    return (
+        tagger.model_path,
+        tagger.tag_names,
+        tagger.rating_indexes,
+        tagger.general_indexes,
+        tagger.character_indexes,
+        tagger.general_threshold,
+        tagger.character_threshold,
+        threads_per_worker,
+        1,
+        tagger.fast_decode,
+        tagger.session_config,
+    )
+
+
+def _init_worker(init_args):
+    global _worker_tagger, _worker_error
+    try:
+        _worker_tagger = ONNXTagger(*init_args)
+    except Exception as e:
+        _worker_error = f"{type(e).__name__}: {e}"
+
+
+def _tag_shard(shard):
+    if _worker_tagger is None:
+        raise RuntimeError(f"Worker could not load the model: {_worker_error}")
+    img_paths, options = shard
+    results = [ImageResult(img_path) for img_path in img_paths]
+    batch = []
+    batch_resized = []
+    for result in results:
+        try:
+            resized, cached_preds = decode_image(result, _worker_tagger)
+            batch.append(result)
+            batch_resized.append(resized)
+        except Exception as e:
+            result.error = e
+    if batch_resized:
+        caption_batch(_worker_tagger, batch, batch_resized, options)
+    # exceptions may not pickle, so errors travel back as strings
+    for result in results:
+        if result.error is not None:
+            result.error = str(result.error)
+    return results
+
+
+def iter_shards(images, shard_size: int, options: CaptionOptions):
+    shard = []
+    for img_path in images:
+        shard.append(img_path)
+        if len(shard) >= shard_size:
+            yield shard, options
+            shard = []
+    if shard:
+        yield shard, options
+
+
+def _shard_result(pending, processes):
+    # a worker that dies outright (a crash inside onnxruntime, the OOM killer)
+    # is replaced by the pool but its shard is lost, so waiting is bounded by
+    # a check that the original workers are still alive
+    while not pending.ready():
+        pending.wait(1.0)
+        if not pending.ready() and any(p.exitcode is not None for p in processes):
+            raise RuntimeError("A tagging worker process exited unexpectedly")
+    return pending.get()
+
+
+def iter_captions_sharded(
+    tagger: ONNXTagger,
+    images,
+    options: CaptionOptions,
+    batch_size: int,
+    workers: int,
+    threads_per_worker: int = None,
+):
+    # every worker owns its own InferenceSession; shards are yielded back in
+    # input order. `images` is read on the calling thread, with at most two
+    # shards per worker in flight, so a slow consumer holds the scan back
+    # instead of letting finished shards pile up
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    # spawn avoids forking a parent that already runs onnxruntime threads
+    context = multiprocessing.get_context("spawn")
+    before = set(multiprocessing.active_children())
+    with context.Pool(
+        processes=workers,
+        initializer=_init_worker,
+        initargs=(tagger_init_args(tagger, threads_per_worker),),
+    ) as pool:
+        processes = set(multiprocessing.active_children()) - before
+        in_flight = deque()
+        for shard in iter_shards(images, batch_size, options):
+            if len(in_flight) >= 2 * workers:
+                yield from _shard_result(in_flight.popleft(), processes)
+            in_flight.append(pool.apply_async(_tag_shard, (shard,)))
+        while in_flight:
+            yield from _shard_result(in_flight.popleft(), processes)
@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from captions.tag_index import parse_caption
+
+
+def caption_path(image_path: Path) -> Path:
+    return image_path.with_suffix(".txt")
+
+
+def read_caption(image_path: Path) -> set:
+    # the image's tags, or an empty set when it has no caption yet
+    try:
+        with open(caption_path(image_path), "r", encoding="utf-8") as f:
+            return parse_caption(f.read())
+    except FileNotFoundError:
+        return set()
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"[read_caption] Cannot read caption for {image_path}: {e}")
+        return set()
+
+
+def write_caption(txt_path: Path, text: str):
+    # write next to the target and rename over it, so readers and crashes only
+    # ever see the old caption or the new one, never a truncated file
+    temp = txt_path.with_name(f".{txt_path.name}.{os.getpid()}.tmp")
+    try:
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(temp, txt_path)
+    except BaseException:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+
+
+def write_captions(jobs: list, max_workers: int = 8) -> list:
+    # jobs are (key, txt_path, text); returns (key, error) for every failure.
+    # Several writers in flight hide the per-file latency of network shares.
+    def write(job):
+        key, txt_path, text = job
+        try:
+            write_caption(txt_path, text)
+        except Exception as e:
+            return key, str(e)
+        return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return [failure for failure in pool.map(write, jobs) if failure]
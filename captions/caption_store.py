@@ -0,0 +1,217 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from captions.caption_files import caption_path, write_captions
+from image_scanner import scan_images
+
+STORE_NAME = ".tag_manager_captions.sqlite"
+
+
+class CaptionStore:
+    # every caption of a folder in one SQLite file, as an alternative to one
+    # .txt per image: on network shares a single file is far cheaper than
+    # millions of tiny ones. Keys are image paths relative to the folder.
+    # Next to the caption it keeps the model's score for each tag and which
+    # model and settings produced it. Safe to share between threads.
+    COMMIT_EVERY = 2000
+
+    def __init__(self, folder: Path, durable=False):
+        # durable commits survive a power cut, not just a crash, for when
+        # another record (the bulk journal) relies on them
+        self.folder = Path(folder)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.db = sqlite3.connect(self.folder / STORE_NAME, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(f"PRAGMA synchronous={'FULL' if durable else 'NORMAL'}")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS models (id INTEGER PRIMARY KEY, "
+            "name TEXT, digest TEXT, settings TEXT, created REAL, "
+            "UNIQUE (digest, settings))"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS captions (key TEXT PRIMARY KEY, "
+            "caption TEXT NOT NULL, scores TEXT, model_id INTEGER, "
+            "mtime_ns INTEGER, size INTEGER, updated REAL) WITHOUT ROWID"
+        )
+        self.db.commit()
+
+    @staticmethod
+    def exists(folder: Path) -> bool:
+        return (Path(folder) / STORE_NAME).exists()
+
+    def key(self, img_path: Path) -> str:
+        return Path(img_path).relative_to(self.folder).as_posix()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM captions").fetchone()[0]
+
+    def model_id(self, name: str, digest: str, settings: str) -> int:
+        with self.lock:
+            self.db.execute(
+                "INSERT OR IGNORE INTO models (name, digest, settings, created) "
+                "VALUES (?, ?, ?, ?)",
+                (name, digest, settings, time.time()),
+            )
+            self.db.commit()
+            return self.db.execute(
+                "SELECT id FROM models WHERE digest = ? AND settings = ?",
+                (digest, settings),
+            ).fetchone()[0]
+
+    def put(
+        self,
+        key: str,
+        caption: str,
+        scores: dict = None,
+        model_id: int = None,
+        mtime_ns: int = None,
+        size: int = None,
+    ):
+        # a tagging result: replaces the caption and everything recorded with it
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO captions "
+                "(key, caption, scores, model_id, mtime_ns, size, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    caption,
+                    json.dumps(scores) if scores is not None else None,
+                    model_id,
+                    mtime_ns,
+                    size,
+                    time.time(),
+                ),
+            )
+            self.pending += 1
+            if self.pending >= self.COMMIT_EVERY:
+                self.db.commit()
+                self.pending = 0
+
+    def set_captions(self, captions: dict):
+        # hand edits: only the caption changes, the model's scores stay
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                "INSERT INTO captions (key, caption, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET "
+                "caption = excluded.caption, updated = excluded.updated",
+                [(key, caption, now) for key, caption in captions.items()],
+            )
+            self.db.commit()
+            self.pending = 0
+
+    def write_captions(self, jobs: list) -> list:
+        # same contract as caption_files.write_captions, so the Editor can save
+        # to either; the whole batch lands in one transaction
+        try:
+            self.set_captions({key: text for key, _, text in jobs})
+        except sqlite3.Error as e:
+            return [(key, str(e)) for key, _, _ in jobs]
+        return []
+
+    def has(self, key: str) -> bool:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT 1 FROM captions WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT caption FROM captions WHERE key = ?", (key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def scores(self, key: str) -> dict:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT scores FROM captions WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def model_info(self, key: str):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT models.name, models.digest, models.settings FROM captions "
+                "JOIN models ON models.id = captions.model_id WHERE captions.key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        name, digest, settings = row
+        return {"name": name, "digest": digest, "settings": json.loads(settings)}
+
+    def read_all(self) -> dict:
+        # key -> caption for the whole folder in one query
+        with self.lock:
+            return dict(self.db.execute("SELECT key, caption FROM captions"))
+
+    def stats(self) -> dict:
+        with self.lock:
+            captions, scored = self.db.execute(
+                "SELECT COUNT(*), COUNT(scores) FROM captions"
+            ).fetchone()
+            models = self.db.execute(
+                "SELECT models.name, COUNT(captions.key) FROM models "
+                "LEFT JOIN captions ON captions.model_id = models.id "
+                "GROUP BY models.id ORDER BY models.id"
+            ).fetchall()
+        return {"captions": captions, "scored": scored, "models": models}
+
+    def import_txt(self, recursive=False) -> int:
+        # copies the folder's .txt captions in; images without one are skipped
+        rows = []
+        now = time.time()
+        for img_path in scan_images(self.folder, recursive=recursive):
+            try:
+                with open(caption_path(img_path), "r", encoding="utf-8") as f:
+                    caption = f.read().strip()
+            except FileNotFoundError:
+                continue
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"[CaptionStore] Skipping caption of {img_path}: {e}")
+                continue
+            rows.append((self.key(img_path), caption, now))
+        with self.lock:
+            self.db.executemany(
+                "INSERT INTO captions (key, caption, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET "
+                "caption = excluded.caption, updated = excluded.updated",
+                rows,
+            )
+            self.db.commit()
+        return len(rows)
+
+    def export_txt(self, overwrite=True) -> tuple:
+        # writes a .txt next to every image in the store, the layout training
+        # tools expect; returns (written, failures)
+        jobs = []
+        for key, caption in self.read_all().items():
+            txt_path = caption_path(self.folder / key)
+            if not overwrite and txt_path.exists():
+                continue
+            jobs.append((key, txt_path, caption))
+        failures = write_captions(jobs)
+        return len(jobs) - len(failures), failures
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
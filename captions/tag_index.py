@@ -0,0 +1,181 @@
+import sys
+
+
+def parse_caption(text: str) -> set:
+    return {sys.intern(tag.strip()) for tag in text.split(",") if tag.strip()}
+
+
+def parse_query(text: str):
+    # "a, b | c, -d" means a AND (b OR c) AND NOT d: commas separate clauses,
+    # "|" separates alternatives inside a clause and a leading "-" negates one
+    clauses = []
+    excluded = []
+    for clause in text.split(","):
+        terms = [term.strip() for term in clause.split("|") if term.strip()]
+        if not terms:
+            continue
+        if len(terms) == 1 and terms[0].startswith("-"):
+            tag = terms[0][1:].strip()
+            if tag:
+                excluded.append(tag)
+        else:
+            clauses.append(terms)
+    return clauses, excluded
+
+
+class TagIndex:
+    # captions of one folder: image key -> tag set, plus the inverted postings
+    # tag -> image ids, so global edits and filters touch only matching images.
+    # Ids are positions in load order, which keeps query results in list order.
+    # Every edit marks its image dirty until take_dirty hands it to a save.
+    def __init__(self):
+        self.keys = []
+        self.ids = {}
+        self.tags_map = {}
+        self.postings = {}
+        self.dirty = set()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add_image(self, key: str, tags: set) -> int:
+        # tags are expected interned already, as parse_caption returns them;
+        # this is the hot path while a folder loads
+        image_id = len(self.keys)
+        self.keys.append(key)
+        self.ids[key] = image_id
+        self.tags_map[key] = tags
+        postings = self.postings
+        for tag in tags:
+            ids = postings.get(tag)
+            if ids is None:
+                postings[tag] = {image_id}
+            else:
+                ids.add(image_id)
+        return image_id
+
+    def tags_for(self, key: str) -> set:
+        return self.tags_map.get(key, set())
+
+    def add_tag(self, key: str, tag: str) -> bool:
+        tags = self.tags_map[key]
+        if tag in tags:
+            return False
+        tag = sys.intern(tag)
+        tags.add(tag)
+        self.postings.setdefault(tag, set()).add(self.ids[key])
+        self.dirty.add(key)
+        return True
+
+    def remove_tag(self, key: str, tag: str) -> bool:
+        tags = self.tags_map[key]
+        if tag not in tags:
+            return False
+        tags.discard(tag)
+        self._drop_posting(tag, self.ids[key])
+        self.dirty.add(key)
+        return True
+
+    def _drop_posting(self, tag: str, image_id: int):
+        ids = self.postings.get(tag)
+        if ids is None:
+            return
+        ids.discard(image_id)
+        if not ids:
+            del self.postings[tag]
+
+    def add_tag_to_all(self, tag: str, keys=None) -> list:
+        # returns the keys that changed; images already tagged are skipped
+        # through the postings instead of being checked one by one
+        tag = sys.intern(tag)
+        have = self.postings.setdefault(tag, set())
+        if keys is None:
+            changed = [i for i in range(len(self.keys)) if i not in have]
+        else:
+            changed = [self.ids[key] for key in keys if self.ids[key] not in have]
+        for image_id in changed:
+            self.tags_map[self.keys[image_id]].add(tag)
+        have.update(changed)
+        if not have:
+            del self.postings[tag]
+        changed = [self.keys[i] for i in changed]
+        self.dirty.update(changed)
+        return changed
+
+    def remove_tag_everywhere(self, tag: str) -> list:
+        ids = self.postings.pop(tag, set())
+        for image_id in ids:
+            self.tags_map[self.keys[image_id]].discard(tag)
+        changed = [self.keys[i] for i in sorted(ids)]
+        self.dirty.update(changed)
+        return changed
+
+    def caption_text(self, key: str) -> str:
+        return ", ".join(sorted(self.tags_map[key]))
+
+    def take_dirty(self, limit=None) -> dict:
+        # snapshots up to `limit` dirty captions as key -> text and marks them
+        # clean; a failed save hands them back through mark_dirty
+        keys = list(self.dirty)
+        if limit is not None:
+            keys = keys[:limit]
+        self.dirty.difference_update(keys)
+        return {key: self.caption_text(key) for key in keys}
+
+    def mark_dirty(self, keys):
+        self.dirty.update(keys)
+
+    def count(self, tag: str) -> int:
+        return len(self.postings.get(tag, ()))
+
+    def frequencies(self) -> list:
+        # (tag, images) pairs, most used first
+        return sorted(
+            ((tag, len(ids)) for tag, ids in self.postings.items()),
+            key=lambda item: (-item[1], item[0]),
+        )
+
+    def query_ids(self, text: str) -> list:
+        clauses, excluded = parse_query(text)
+        if not clauses and not excluded:
+            return list(range(len(self.keys)))
+        matches = None
+        # the smallest clause first, so every intersection works on the
+        # fewest candidates
+        unions = []
+        for terms in clauses:
+            union = set()
+            for term in terms:
+                union |= self.postings.get(term, set())
+            unions.append(union)
+        for union in sorted(unions, key=len):
+            matches = union if matches is None else matches & union
+            if not matches:
+                return []
+        for tag in excluded:
+            ids = self.postings.get(tag)
+            if not ids:
+                continue
+            if matches is None:
+                matches = set(range(len(self.keys))) - ids
+            else:
+                matches -= ids
+        if matches is None:
+            return list(range(len(self.keys)))
+        return sorted(matches)
+
+    @staticmethod
+    def matcher(text: str):
+        # the same query as a predicate over one tag set, for filtering images
+        # as they are added
+        clauses, excluded = parse_query(text)
+
+        def matches(tags: set) -> bool:
+            return all(any(t in tags for t in terms) for terms in clauses) and not any(
+                t in tags for t in excluded
+            )
+
+        return matches
+
+    def query(self, text: str) -> list:
+        return [self.keys[i] for i in self.query_ids(text)]
@@ -4,7 +4,39 @@ from pathlib import Path
 CONFIG_DIR = Path.home() / ".waifu_tagger"
 CONFIG_PATH = CONFIG_DIR / "config.json"
 
-DEFAULT_CONFIG = {"include_rating": False, "exclude_character": False}
+DEFAULT_CONFIG = {
+    "include_rating": False,
+    "exclude_character": False,
+    "recursive_scan": False,
+    "fast_decode": False,
+    "bulk_batch_size": 8,
+    "bulk_workers": 1,
+    "bulk_threads_per_worker": 0,
+    "bulk_incremental": True,
+    "bulk_top_k": 0,
+    "bulk_metrics": False,
+    "prob_cache_enabled": True,
+    "prob_cache_max_mb": 2048,
+    "model_pool_budget_mb": 3072,
+    "preload_model": True,
+    "execution_providers": ["CPUExecutionProvider"],
+    "graph_optimization": "all",
+    "cache_optimized_model": False,
+    "intra_op_threads": 0,
+    "inter_op_threads": 0,
+    "execution_mode": "sequential",
+    "cpu_mem_arena": True,
+    "mem_pattern": True,
+    "allow_spinning": True,
+    "editor_autosave": False,
+    "editor_autosave_interval": 30,
+    "editor_autosave_batch": 500,
+    "caption_store": False,
+    "thumbnail_size": 512,
+    "thumbnail_memory_items": 256,
+    "thumbnail_prefetch": 3,
+    "thumbnail_cache_max_mb": 512,
+}
 
 
 class ConfigManager:
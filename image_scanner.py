@@ -0,0 +1,31 @@
+import os
+from pathlib import Path
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def scan_images(root, recursive=False, extensions=IMAGE_EXTENSIONS, sort=False):
+    # streams image paths as directories are read; extension filtering uses the
+    # name and the dirent type only, so no per-file stat is issued. Hidden
+    # directories (.git, caches) are skipped. sort=True orders each directory's
+    # entries by name at the cost of listing that one directory up front.
+    pending = [os.fspath(root)]
+    while pending:
+        directory = pending.pop()
+        subdirs = []
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda e: e.name) if sort else it
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and not entry.name.startswith("."):
+                            subdirs.append(entry.path)
+                    elif (
+                        os.path.splitext(entry.name)[1].lower() in extensions
+                        and entry.is_file()
+                    ):
+                        yield Path(entry.path)
+        except OSError as e:
+            print(f"[scan_images] Cannot read {directory}: {e}")
+        # depth-first, visiting subdirectories in listing order
+        pending.extend(reversed(subdirs))
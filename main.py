@@ -1,20 +1,28 @@
 # entry point
+import time
+
+START_TIME = time.perf_counter()
+
 from PySide6.QtWidgets import (
     QMainWindow,
     QTabWidget,
     QApplication,
     QMessageBox,
 )
+from PySide6.QtCore import QTimer
 from PySide6.QtGui import QIcon
 import sys
 from ui.tagging_tab import TaggingTab
 from ui.editor_tab import EditorTab
 from ui.settings_tab import SettingsTab
+from ui.thumbnails import ThumbnailCache
+import config_manager
+from tagger.model_registry import discover_models
 from pathlib import Path
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, model_paths=None):
         super().__init__()
         self.setWindowTitle("Tag-Manager")
         self.resize(1000, 600)
@@ -25,14 +33,17 @@ class MainWindow(QMainWindow):
         else:
             print("⚠️ Icon file not found:", icon_path)
 
-        self.model_paths = {
-            "wd-vit-tagger-v3": Path("models/wd-vit-tagger-v3.onnx"),
-            "wd-vit-large-tagger-v3": Path("models/wd-vit-large-tagger-v3.onnx"),
-        }
+        # includes quantized variants made by quantize_models.py
+        self.model_paths = model_paths or discover_models()
+
+        # one preview cache for both tabs
+        self.config = config_manager.ConfigManager()
+        self.thumbnails = ThumbnailCache.from_config(self.config, self)
+        self.started = False
 
         self.tabs = QTabWidget()
-        self.tagging_tab = TaggingTab(self.model_paths)
-        self.editor_tab = EditorTab()
+        self.tagging_tab = TaggingTab(self.model_paths, thumbnails=self.thumbnails)
+        self.editor_tab = EditorTab(thumbnails=self.thumbnails)
         self.settings_tab = SettingsTab()
 
         self.tabs.addTab(self.tagging_tab, "Tagging")
@@ -40,6 +51,24 @@ class MainWindow(QMainWindow):
         self.tabs.addTab(self.settings_tab, "Settings")
         self.setCentralWidget(self.tabs)
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        if not self.started:
+            self.started = True
+            # queued behind the first paint, so the window appears before any
+            # model or cache work starts
+            QTimer.singleShot(0, self.start_background_work)
+
+    def start_background_work(self):
+        print(
+            f"[MainWindow] Window shown after {time.perf_counter() - START_TIME:.2f}s"
+        )
+        # old thumbnails are pruned in the background so the disk cache stays
+        # within its budget
+        self.thumbnails.prune(self.config.get("thumbnail_cache_max_mb", 512) << 20)
+        if self.config.get("preload_model", True):
+            self.tagging_tab.preload_model()
+
     def closeEvent(self, event):
         if self.editor_tab.unsaved_changes:
             reply = QMessageBox.question(
@@ -50,12 +79,15 @@ class MainWindow(QMainWindow):
                 QMessageBox.Save,
             )
             if reply == QMessageBox.Save:
-                self.editor_tab.save_all_tags()
+                self.editor_tab.shutdown()
                 event.accept()
             else:
                 event.ignore()
         else:
             event.accept()
+        if event.isAccepted():
+            self.tagging_tab.shutdown()
+            self.editor_tab.stop_loading()
 
 
 if __name__ == "__main__":
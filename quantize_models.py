@@ -0,0 +1,301 @@
+# creates INT8 (and, with onnxconverter-common installed, FP16) variants of the
+# tagger models and reports how their tags and speed compare to the FP32 model
+#   python quantize_models.py quantize wd-vit-large-tagger-v3 --mode dynamic
+#   python quantize_models.py quantize wd-vit-large-tagger-v3 --mode static --calibration path/to/images
+#   python quantize_models.py report wd-vit-large-tagger-v3 wd-vit-large-tagger-v3-int8 --images path/to/images
+import argparse
+import json
+import multiprocessing
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from benchmarks.measure import peak_rss_mb
+from image_scanner import scan_images
+from tagger.model_registry import (
+    MODELS_DIR,
+    base_model_name,
+    resolve_model,
+    variant_path,
+)
+
+MODES = {"dynamic": "-int8", "static": "-int8-static", "fp16": "-fp16"}
+
+
+def tags_csv_for(model_path: Path) -> Path:
+    return model_path.parent / "selected_tags.csv"
+
+
+def load_tagger(model_path: Path, csv_path: Path):
+    from tagger.model_runner import ONNXTagger
+    from tagger.selected_tags_loader import SelectedTagsLoader
+
+    tag_names, rating_indexes, general_indexes, character_indexes = SelectedTagsLoader(
+        csv_path
+    ).load_tags()
+    return ONNXTagger(
+        model_path, tag_names, rating_indexes, general_indexes, character_indexes
+    )
+
+
+def image_paths(folder: Path, limit: int) -> list:
+    return sorted(scan_images(folder, recursive=True))[:limit]
+
+
+def preprocessed(model_path: Path, paths: list):
+    # model inputs exactly as ONNXTagger feeds them, one image per tensor;
+    # the fixed batch dimension some exports use is filled by repeating it
+    tagger = load_tagger(model_path, tags_csv_for(model_path))
+    tensors = []
+    for path in paths:
+        with Image.open(path) as image:
+            tensor = tagger.prepare_image(image, tagger.target_size)
+        if tagger.fixed_batch_size:
+            tensor = np.repeat(tensor, tagger.fixed_batch_size, axis=0)
+        tensors.append(tensor)
+    return tagger.input_name, tensors
+
+
+class CalibrationReader:
+    # onnxruntime's CalibrationDataReader protocol over a folder of images
+    def __init__(self, input_name: str, tensors: list):
+        self.feeds = iter({input_name: tensor} for tensor in tensors)
+
+    def get_next(self):
+        return next(self.feeds, None)
+
+    def rewind(self):
+        pass
+
+
+def quantize(model_path: Path, mode: str, calibration: Path, count: int) -> Path:
+    from onnxruntime.quantization import QuantFormat, QuantType
+    from onnxruntime.quantization import quantize_dynamic, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    output = variant_path(model_path, MODES[mode])
+    if mode == "fp16":
+        try:
+            import onnx
+            from onnxconverter_common import float16
+        except ImportError:
+            raise SystemExit(
+                "FP16 conversion needs onnxconverter-common: "
+                "pip install onnxconverter-common"
+            )
+        model = float16.convert_float_to_float16(
+            onnx.load(str(model_path)), keep_io_types=True
+        )
+        onnx.save(model, str(output))
+        return output
+
+    with tempfile.TemporaryDirectory() as temp:
+        # shape inference and graph cleanup let more nodes be quantized
+        source = Path(temp) / "preprocessed.onnx"
+        try:
+            quant_pre_process(str(model_path), str(source), skip_symbolic_shape=True)
+        except Exception as e:
+            print(f"[quantize] Pre-processing skipped: {e}")
+            source = model_path
+        if mode == "dynamic":
+            quantize_dynamic(str(source), str(output), weight_type=QuantType.QInt8)
+            return output
+        if calibration is None:
+            raise SystemExit("Static quantization needs --calibration <folder>")
+        paths = image_paths(calibration, count)
+        if not paths:
+            raise SystemExit(f"No calibration images in {calibration}")
+        print(f"[quantize] Calibrating on {len(paths)} images")
+        input_name, tensors = preprocessed(model_path, paths)
+        quantize_static(
+            str(source),
+            str(output),
+            CalibrationReader(input_name, tensors),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+        )
+    return output
+
+
+def measure(model_path: Path, csv_path: Path, paths: list, batch_size: int):
+    # runs in a fresh process so peak RSS belongs to this model alone
+    start = time.perf_counter()
+    tagger = load_tagger(model_path, csv_path)
+    load_time = time.perf_counter() - start
+    resized = []
+    for path in paths:
+        with Image.open(path) as image:
+            resized.append(tagger.resize_image(image, tagger.target_size))
+    tagger.run_resized(resized[:batch_size])
+    start = time.perf_counter()
+    preds = np.concatenate(
+        [
+            tagger.run_resized(resized[i : i + batch_size])
+            for i in range(0, len(resized), batch_size)
+        ]
+    )
+    throughput = len(resized) / (time.perf_counter() - start)
+    return {
+        "model": model_path.stem,
+        "size_mb": model_path.stat().st_size / (1 << 20),
+        "load_seconds": load_time,
+        "images_per_second": throughput,
+        "peak_rss_mb": peak_rss_mb(),
+        "preds": preds,
+    }
+
+
+def tag_matrix(tagger, preds: np.ndarray) -> np.ndarray:
+    # boolean [images, tags] of what predict() would output at its thresholds
+    names = {name: i for i, name in enumerate(tagger.tag_names)}
+    chosen = np.zeros(preds.shape, dtype=bool)
+    for row, (general, rating, character, _) in enumerate(
+        tagger.postprocess_batch(preds)
+    ):
+        for tag in list(general) + list(character):
+            chosen[row, names[tag]] = True
+    return chosen
+
+
+def compare(tagger, reference: np.ndarray, candidate: np.ndarray, worst: int):
+    expected = tag_matrix(tagger, reference)
+    got = tag_matrix(tagger, candidate)
+    tp = (expected & got).sum(axis=0)
+    fp = (~expected & got).sum(axis=0)
+    fn = (expected & ~got).sum(axis=0)
+    present = (tp + fp + fn) > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), 1.0)
+        f1 = np.where(
+            precision + recall > 0,
+            2 * precision * recall / (precision + recall),
+            0.0,
+        )
+    order = [i for i in np.argsort(f1, kind="stable") if present[i]][:worst]
+    return {
+        "micro_precision": float(tp.sum() / max(tp.sum() + fp.sum(), 1)),
+        "micro_recall": float(tp.sum() / max(tp.sum() + fn.sum(), 1)),
+        "macro_precision": float(precision[present].mean()) if present.any() else 1.0,
+        "macro_recall": float(recall[present].mean()) if present.any() else 1.0,
+        "max_abs_prob_diff": float(np.abs(reference - candidate).max()),
+        "worst_tags": [
+            {
+                "tag": tagger.tag_names[i],
+                "precision": float(precision[i]),
+                "recall": float(recall[i]),
+                "reference_count": int(tp[i] + fn[i]),
+            }
+            for i in order
+        ],
+    }
+
+
+def report(args) -> dict:
+    reference_path = resolve_model(args.reference)
+    paths = image_paths(args.images, args.limit)
+    if not paths:
+        raise SystemExit(f"No images in {args.images}")
+    csv_path = args.tags or tags_csv_for(reference_path)
+    models = [reference_path] + [resolve_model(m) for m in args.variants]
+    # one process per model, one at a time, so the RSS figures do not overlap
+    ctx = multiprocessing.get_context("spawn")
+    measurements = []
+    for model_path in models:
+        with ctx.Pool(1) as pool:
+            measurements.append(
+                pool.apply(measure, (model_path, csv_path, paths, args.batch_size))
+            )
+
+    # supplies the tag categories and thresholds predict() would use
+    tagger = load_tagger(reference_path, csv_path)
+    tagger.set_thresholds(args.general_threshold, args.character_threshold)
+    reference = measurements[0]
+    results = {"images": len(paths), "models": []}
+    for measured in measurements:
+        entry = {k: v for k, v in measured.items() if k != "preds"}
+        entry["speedup"] = (
+            measured["images_per_second"] / reference["images_per_second"]
+        )
+        if measured is not reference:
+            entry.update(
+                compare(tagger, reference["preds"], measured["preds"], args.worst)
+            )
+        results["models"].append(entry)
+    return results
+
+
+def print_report(results: dict):
+    print(f"\n{results['images']} images")
+    print(
+        f"{'model':<36} {'MB':>7} {'load s':>7} {'img/s':>7} {'x':>5} "
+        f"{'RSS MB':>7} {'prec':>6} {'recall':>6}"
+    )
+    for entry in results["models"]:
+        rss = entry["peak_rss_mb"]
+        print(
+            f"{entry['model']:<36} {entry['size_mb']:7.1f} "
+            f"{entry['load_seconds']:7.2f} {entry['images_per_second']:7.1f} "
+            f"{entry['speedup']:5.2f} {rss if rss is not None else float('nan'):7.0f} "
+            f"{entry.get('micro_precision', 1.0):6.3f} "
+            f"{entry.get('micro_recall', 1.0):6.3f}"
+        )
+    for entry in results["models"][1:]:
+        if entry["worst_tags"]:
+            print(f"\nLeast consistent tags for {entry['model']}:")
+        for tag in entry["worst_tags"]:
+            print(
+                f"  {tag['tag']:<40} precision {tag['precision']:.2f} "
+                f"recall {tag['recall']:.2f} ({tag['reference_count']} images)"
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Quantized model variants")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    make = commands.add_parser("quantize", help="write a quantized variant")
+    make.add_argument("model", help=f"model name in {MODELS_DIR}/ or .onnx path")
+    make.add_argument("--mode", choices=list(MODES), default="dynamic")
+    make.add_argument("--calibration", type=Path, help="images for --mode static")
+    make.add_argument("--calibration-count", type=int, default=200)
+
+    check = commands.add_parser("report", help="compare variants with the FP32 model")
+    check.add_argument("reference", help="the FP32 model")
+    check.add_argument("variants", nargs="+")
+    check.add_argument("--images", type=Path, required=True)
+    check.add_argument("--tags", type=Path, help="defaults to selected_tags.csv")
+    check.add_argument("--limit", type=int, default=500)
+    check.add_argument("--batch-size", type=int, default=8)
+    check.add_argument("--general-threshold", type=float, default=0.35)
+    check.add_argument("--character-threshold", type=float, default=0.85)
+    check.add_argument("--worst", type=int, default=10, help="tags to list")
+    check.add_argument("--json", type=Path, help="also write the report here")
+    args = parser.parse_args(argv)
+
+    if args.command == "quantize":
+        model_path = resolve_model(args.model)
+        if not model_path.exists():
+            raise SystemExit(f"Model not found: {model_path}")
+        if base_model_name(model_path.stem) != model_path.stem:
+            raise SystemExit(f"{model_path.stem} is already a variant")
+        start = time.perf_counter()
+        output = quantize(
+            model_path, args.mode, args.calibration, args.calibration_count
+        )
+        print(
+            f"Wrote {output} ({output.stat().st_size / (1 << 20):.1f} MB, "
+            f"{time.perf_counter() - start:.1f}s)"
+        )
+    else:
+        results = report(args)
+        print_report(results)
+        if args.json:
+            args.json.write_text(json.dumps(results, indent=2), "utf-8")
+
+
+if __name__ == "__main__":
+    main()
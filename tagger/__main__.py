@@ -0,0 +1,459 @@
+# headless entry point: python -m tagger bulk <folder> [options]
+# nothing here may import Qt, so it runs on servers without a display
+import time
+
+START_TIME = time.perf_counter()
+
+import argparse
+import sys
+from pathlib import Path
+import config_manager
+from tagger.model_registry import MODELS_DIR, discover_models, resolve_model
+
+DEFAULT_MODEL = "wd-vit-tagger-v3"
+
+
+def build_parser(config) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m tagger", description="Headless Tag-Manager tools"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("models", help="list the models and quantized variants")
+
+    bulk = commands.add_parser("bulk", help="tag every image in a folder")
+    bulk.add_argument("folder", type=Path)
+    bulk.add_argument(
+        "--model",
+        default=DEFAULT_MODEL,
+        help=f"model name in {MODELS_DIR}/ or a path to an .onnx file",
+    )
+    bulk.add_argument("--tags", type=Path, help="defaults to selected_tags.csv")
+    bulk.add_argument(
+        "--general-threshold",
+        type=float,
+        default=config.get("general_threshold", 0.35),
+    )
+    bulk.add_argument(
+        "--character-threshold",
+        type=float,
+        default=config.get("character_threshold", 0.85),
+    )
+    bulk.add_argument("--mcut", action="store_true", help="use MCut thresholding")
+    bulk.add_argument(
+        "--include-rating",
+        action="store_true",
+        default=config.get("include_rating", False),
+    )
+    bulk.add_argument(
+        "--exclude-character",
+        action="store_true",
+        default=config.get("exclude_character", False),
+    )
+    bulk.add_argument(
+        "--batch-size", type=int, default=config.get("bulk_batch_size", 8)
+    )
+    bulk.add_argument("--workers", type=int, default=config.get("bulk_workers", 1))
+    bulk.add_argument(
+        "--threads-per-worker",
+        type=int,
+        default=config.get("bulk_threads_per_worker", 0),
+        help="0 picks cores / workers",
+    )
+    bulk.add_argument("--decode-workers", type=int, default=0)
+    bulk.add_argument(
+        "--fast-decode",
+        action="store_true",
+        default=config.get("fast_decode", False),
+        help="decode JPEGs at reduced scale",
+    )
+    bulk.add_argument(
+        "--recursive",
+        action="store_true",
+        default=config.get("recursive_scan", False),
+    )
+    bulk.add_argument(
+        "--no-incremental",
+        dest="incremental",
+        action="store_false",
+        help="ignore and do not update the folder manifest",
+    )
+    bulk.add_argument("--force", action="store_true", help="retag every image")
+    bulk.add_argument(
+        "--no-resume",
+        dest="resume",
+        action="store_false",
+        help="start over instead of resuming a run that stopped early",
+    )
+    bulk.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="only retag the images that failed in the last run",
+    )
+    bulk.add_argument(
+        "--dry-run", action="store_true", help="only list what would be tagged"
+    )
+    bulk.add_argument(
+        "--progress-every",
+        type=int,
+        default=100,
+        help="images per progress line (0 = none)",
+    )
+    bulk.add_argument(
+        "--caption-store",
+        action="store_true",
+        default=config.get("caption_store", False),
+        help="write captions to the folder's caption store instead of .txt files",
+    )
+    bulk.add_argument(
+        "--top-k",
+        type=int,
+        default=config.get("bulk_top_k", 0),
+        help="also save each image's K most likely tags for rethreshold (0 = off)",
+    )
+    bulk.add_argument(
+        "--metrics",
+        nargs="?",
+        type=Path,
+        const=True,
+        default=config.get("bulk_metrics", False) or None,
+        help="write per-stage timings, the slowest files and throughput as JSON "
+        "lines (to PATH, or under ~/.waifu_tagger/metrics)",
+    )
+    bulk.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=5.0,
+        help="seconds between throughput snapshots in the metrics file",
+    )
+    bulk.add_argument(
+        "--profile",
+        choices=["cprofile", "pyinstrument"],
+        help="profile the run's main loop",
+    )
+    bulk.add_argument(
+        "--profile-out", type=Path, help="defaults to bulk.prof / bulk.html"
+    )
+    add_session_arguments(bulk, config)
+
+    rethreshold = commands.add_parser(
+        "rethreshold",
+        help="rewrite captions from the probabilities saved by bulk --top-k",
+    )
+    rethreshold.add_argument("folder", type=Path)
+    rethreshold.add_argument(
+        "--general-threshold",
+        type=float,
+        default=config.get("general_threshold", 0.35),
+    )
+    rethreshold.add_argument(
+        "--character-threshold",
+        type=float,
+        default=config.get("character_threshold", 0.85),
+    )
+    rethreshold.add_argument(
+        "--include-rating",
+        action="store_true",
+        default=config.get("include_rating", False),
+    )
+    rethreshold.add_argument(
+        "--exclude-character",
+        action="store_true",
+        default=config.get("exclude_character", False),
+    )
+    rethreshold.add_argument(
+        "--caption-store",
+        action="store_true",
+        default=config.get("caption_store", False),
+        help="write to the folder's caption store instead of .txt files",
+    )
+    rethreshold.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="only print how often each tag would be kept",
+    )
+
+    store = commands.add_parser(
+        "store", help="move captions between .txt files and a caption store"
+    )
+    store_commands = store.add_subparsers(dest="store_command", required=True)
+    store_import = store_commands.add_parser(
+        "import", help="copy the folder's .txt captions into its store"
+    )
+    store_import.add_argument("folder", type=Path)
+    store_import.add_argument(
+        "--recursive",
+        action="store_true",
+        default=config.get("recursive_scan", False),
+    )
+    store_export = store_commands.add_parser(
+        "export", help="write a .txt next to every image in the store"
+    )
+    store_export.add_argument("folder", type=Path)
+    store_export.add_argument(
+        "--keep-existing",
+        action="store_true",
+        help="do not overwrite .txt files that already exist",
+    )
+    store_info = store_commands.add_parser("info", help="summarize a caption store")
+    store_info.add_argument("folder", type=Path)
+    return parser
+
+
+def add_session_arguments(parser, config):
+    from tagger.session_config import EXECUTION_MODES, GRAPH_OPTIMIZATION_LEVELS
+
+    group = parser.add_argument_group("onnxruntime session")
+    group.add_argument(
+        "--providers",
+        default=",".join(config.get("execution_providers", ["CPUExecutionProvider"])),
+        help="comma separated execution providers, in order of preference",
+    )
+    group.add_argument(
+        "--graph-optimization",
+        choices=list(GRAPH_OPTIMIZATION_LEVELS),
+        default=config.get("graph_optimization", "all"),
+    )
+    group.add_argument(
+        "--cache-optimized-model",
+        action="store_true",
+        default=config.get("cache_optimized_model", False),
+        help="save the optimized graph and load it on later runs",
+    )
+    group.add_argument(
+        "--intra-op-threads", type=int, default=config.get("intra_op_threads", 0)
+    )
+    group.add_argument(
+        "--inter-op-threads", type=int, default=config.get("inter_op_threads", 0)
+    )
+    group.add_argument(
+        "--execution-mode",
+        choices=list(EXECUTION_MODES),
+        default=config.get("execution_mode", "sequential"),
+    )
+    group.add_argument(
+        "--no-cpu-mem-arena",
+        dest="cpu_mem_arena",
+        action="store_false",
+        default=config.get("cpu_mem_arena", True),
+    )
+    group.add_argument(
+        "--no-mem-pattern",
+        dest="mem_pattern",
+        action="store_false",
+        default=config.get("mem_pattern", True),
+    )
+    group.add_argument(
+        "--no-spinning",
+        dest="allow_spinning",
+        action="store_false",
+        default=config.get("allow_spinning", True),
+        help="let idle onnxruntime threads sleep instead of spinning",
+    )
+
+
+def session_config_from_args(args, config):
+    from tagger.session_config import SessionConfig
+
+    return SessionConfig(
+        providers=[p.strip() for p in args.providers.split(",") if p.strip()],
+        provider_options=config.get("provider_options", {}),
+        graph_optimization=args.graph_optimization,
+        cache_optimized_model=args.cache_optimized_model,
+        intra_op_num_threads=args.intra_op_threads,
+        inter_op_num_threads=args.inter_op_threads,
+        execution_mode=args.execution_mode,
+        cpu_mem_arena=args.cpu_mem_arena,
+        mem_pattern=args.mem_pattern,
+        allow_spinning=args.allow_spinning,
+        thread_affinities=config.get("thread_affinities", ""),
+    )
+
+
+def run_bulk(args, config) -> int:
+    from tagger.model_runner import ONNXTagger
+    from tagger.selected_tags_loader import SelectedTagsLoader
+    from bulk.bulk_processor import bulk_tag_images
+    from bulk.metrics import RunMetrics, default_metrics_path
+
+    model_path = resolve_model(args.model)
+    csv_path = args.tags or model_path.parent / "selected_tags.csv"
+    if not model_path.exists():
+        print(f"Model not found: {model_path}", file=sys.stderr)
+        return 2
+    if not args.folder.is_dir():
+        print(f"Not a folder: {args.folder}", file=sys.stderr)
+        return 2
+
+    tag_names, rating_indexes, general_indexes, character_indexes = SelectedTagsLoader(
+        csv_path
+    ).load_tags()
+    tagger = ONNXTagger(
+        model_path,
+        tag_names,
+        rating_indexes,
+        general_indexes,
+        character_indexes,
+        general_threshold=args.general_threshold,
+        character_threshold=args.character_threshold,
+        fast_decode=args.fast_decode,
+        session_config=session_config_from_args(args, config),
+    )
+    print(f"Loaded {tagger.get_model_info()}")
+    print(f"Session: {tagger.session_config.describe()}")
+    print(f"Startup: {time.perf_counter() - START_TIME:.2f}s")
+
+    first_result = []
+
+    def progress(processed, failed, skipped):
+        if not first_result:
+            first_result.append(time.perf_counter() - START_TIME)
+            print(f"Time to first result: {first_result[0]:.2f}s")
+        if args.progress_every > 0 and processed % args.progress_every == 0:
+            print(
+                f"{processed} processed, {failed} failed, {skipped} unchanged",
+                flush=True,
+            )
+
+    metrics = None
+    if args.metrics and not args.dry_run:
+        path = args.metrics
+        if path is True:
+            path = default_metrics_path(args.folder)
+        metrics = RunMetrics(path, snapshot_interval=args.metrics_interval)
+    profile_path = args.profile_out
+    if args.profile and profile_path is None:
+        profile_path = Path("bulk.prof" if args.profile == "cprofile" else "bulk.html")
+
+    summary = bulk_tag_images(
+        tagger,
+        args.folder,
+        general_mcut=args.mcut,
+        character_mcut=args.mcut,
+        batch_size=args.batch_size,
+        decode_workers=args.decode_workers or None,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker or None,
+        incremental=args.incremental,
+        force=args.force,
+        dry_run=args.dry_run,
+        resume=args.resume,
+        retry_failed=args.retry_failed,
+        recursive=args.recursive,
+        progress_callback=progress,
+        include_rating=args.include_rating,
+        exclude_character=args.exclude_character,
+        caption_store=args.caption_store,
+        top_k=args.top_k,
+        metrics=metrics,
+        profile=args.profile,
+        profile_path=profile_path,
+    )
+    if args.dry_run:
+        return 0
+    return 1 if summary.failed else 0
+
+
+def run_rethreshold(args) -> int:
+    from bulk.probabilities import TopKProbabilities
+
+    if not TopKProbabilities.exists(args.folder):
+        print(f"No saved probabilities in {args.folder}", file=sys.stderr)
+        return 2
+    start = time.perf_counter()
+    probabilities = TopKProbabilities(args.folder)
+    if args.dry_run:
+        counts = probabilities.tag_counts(
+            args.general_threshold, args.character_threshold
+        )
+        for tag, count in sorted(counts.items(), key=lambda item: -item[1])[:50]:
+            print(f"{count:8d}  {tag}")
+        print(f"{len(counts)} tags over {len(probabilities)} images")
+        return 0
+    captions = probabilities.rethreshold(
+        args.general_threshold,
+        args.character_threshold,
+        include_rating=args.include_rating,
+        exclude_character=args.exclude_character,
+    )
+    print(f"Rethresholded {len(captions)} images in {time.perf_counter() - start:.1f}s")
+    texts = {key: ", ".join(tags) for key, tags in captions.items()}
+    if args.caption_store:
+        from captions.caption_store import CaptionStore
+
+        with CaptionStore(args.folder) as store:
+            store.set_captions(texts)
+        failures = []
+    else:
+        from captions.caption_files import caption_path, write_captions
+
+        failures = write_captions(
+            [
+                (key, caption_path(args.folder / key), text)
+                for key, text in texts.items()
+            ]
+        )
+    for key, error in failures[:20]:
+        print(f"Failed to write {key}: {error}", file=sys.stderr)
+    print(f"Wrote {len(texts) - len(failures)} captions, {len(failures)} failed")
+    return 1 if failures else 0
+
+
+def run_store(args) -> int:
+    from captions.caption_store import CaptionStore
+
+    if not args.folder.is_dir():
+        print(f"Not a folder: {args.folder}", file=sys.stderr)
+        return 2
+    if args.store_command != "import" and not CaptionStore.exists(args.folder):
+        print(f"No caption store in {args.folder}", file=sys.stderr)
+        return 2
+    with CaptionStore(args.folder) as store:
+        if args.store_command == "import":
+            start = time.perf_counter()
+            count = store.import_txt(recursive=args.recursive)
+            elapsed = time.perf_counter() - start
+            print(f"Imported {count} captions in {elapsed:.1f}s")
+            return 0
+        if args.store_command == "export":
+            start = time.perf_counter()
+            written, failures = store.export_txt(overwrite=not args.keep_existing)
+            elapsed = time.perf_counter() - start
+            for key, error in failures[:20]:
+                print(f"Failed to write {key}: {error}", file=sys.stderr)
+            print(
+                f"Exported {written} captions in {elapsed:.1f}s, {len(failures)} failed"
+            )
+            return 1 if failures else 0
+        stats = store.stats()
+        print(f"{stats['captions']} captions, {stats['scored']} with model scores")
+        for name, count in stats["models"]:
+            print(f"  {name}: {count} captions")
+        return 0
+
+
+def list_models() -> int:
+    for name, path in discover_models().items():
+        if path.exists():
+            print(f"{name:<40} {path.stat().st_size / (1 << 20):8.1f} MB")
+        else:
+            print(f"{name:<40} {'missing':>11}")
+    return 0
+
+
+def main(argv=None) -> int:
+    config = config_manager.ConfigManager()
+    args = build_parser(config).parse_args(argv)
+    if args.command == "bulk":
+        return run_bulk(args, config)
+    if args.command == "models":
+        return list_models()
+    if args.command == "store":
+        return run_store(args)
+    if args.command == "rethreshold":
+        return run_rethreshold(args)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from tagger.model_runner import ONNXTagger
+from tagger.selected_tags_loader import SelectedTagsLoader
+from tagger.prob_cache import ProbabilityCache
+
+_tag_tables = {}
+_tag_tables_lock = threading.Lock()
+
+
+def load_tag_table(csv_path: Path):
+    # models sharing a selected_tags.csv share one parsed table; the table is
+    # re-read only when the file changes
+    csv_path = Path(csv_path).resolve()
+    key = (csv_path, csv_path.stat().st_mtime_ns)
+    with _tag_tables_lock:
+        table = _tag_tables.get(key)
+        if table is None:
+            table = SelectedTagsLoader(csv_path).load_tags()
+            for stale in [k for k in _tag_tables if k[0] == csv_path]:
+                del _tag_tables[stale]
+            _tag_tables[key] = table
+        return table
+
+
+class ModelPool:
+    # loads taggers on first use and keeps the most recently used ones warm.
+    # A session's footprint is estimated from the size of its .onnx file, which
+    # the weights dominate; least recently used sessions are dropped once the
+    # estimates exceed the budget. The newest session is always kept.
+    def __init__(
+        self,
+        model_paths: dict,
+        memory_budget: int = 3072 << 20,
+        prob_cache_bytes=None,
+        **tagger_kwargs,
+    ):
+        self.model_paths = model_paths
+        self.memory_budget = memory_budget
+        self.prob_cache_bytes = prob_cache_bytes
+        self.tagger_kwargs = tagger_kwargs
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.load_locks = {}
+
+    def is_loaded(self, name: str) -> bool:
+        with self.lock:
+            return name in self.sessions
+
+    def get(self, name: str) -> ONNXTagger:
+        with self.lock:
+            tagger = self.sessions.get(name)
+            if tagger is not None:
+                self.sessions.move_to_end(name)
+                return tagger
+            load_lock = self.load_locks.setdefault(name, threading.Lock())
+        # one load per model at a time; other callers wait for its result
+        with load_lock:
+            with self.lock:
+                tagger = self.sessions.get(name)
+                if tagger is not None:
+                    self.sessions.move_to_end(name)
+                    return tagger
+            tagger = self.load(name)
+            with self.lock:
+                self.sessions[name] = tagger
+                self._evict()
+            return tagger
+
+    def load(self, name: str) -> ONNXTagger:
+        model_path = self.model_paths[name]
+        csv_path = model_path.parent / "selected_tags.csv"
+        tag_names, rating_indexes, general_indexes, character_indexes = load_tag_table(
+            csv_path
+        )
+        print(f"[ModelPool] Loading {name}")
+        tagger = ONNXTagger(
+            model_path,
+            tag_names,
+            rating_indexes,
+            general_indexes,
+            character_indexes,
+            **self.tagger_kwargs,
+        )
+        if self.prob_cache_bytes:
+            try:
+                tagger.prob_cache = ProbabilityCache(
+                    model_path,
+                    csv_path,
+                    len(tag_names),
+                    max_bytes=self.prob_cache_bytes,
+                    variant="draft" if tagger.fast_decode else "",
+                )
+            except Exception as e:
+                print(f"[ModelPool] Probability cache disabled for {name}: {e}")
+        return tagger
+
+    def footprint(self, name: str) -> int:
+        try:
+            return self.model_paths[name].stat().st_size
+        except OSError:
+            return 0
+
+    def _evict(self):
+        used = sum(self.footprint(name) for name in self.sessions)
+        while used > self.memory_budget and len(self.sessions) > 1:
+            name, tagger = self.sessions.popitem(last=False)
+            used -= self.footprint(name)
+            if tagger.prob_cache is not None:
+                tagger.prob_cache.flush()
+            print(f"[ModelPool] Evicted {name}")
+
+    def evict(self, name: str):
+        with self.lock:
+            tagger = self.sessions.pop(name, None)
+        if tagger is not None and tagger.prob_cache is not None:
+            tagger.prob_cache.flush()
+
+    def clear(self):
+        with self.lock:
+            names = list(self.sessions)
+        for name in names:
+            self.evict(name)
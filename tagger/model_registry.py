@@ -0,0 +1,39 @@
+from pathlib import Path
+
+MODELS_DIR = Path("models")
+
+# the models download_models.py fetches, listed first and always offered
+BASE_MODELS = ["wd-vit-tagger-v3", "wd-vit-large-tagger-v3"]
+
+# quantize_models.py writes variants next to their source model as
+# <model><suffix>.onnx so they share its selected_tags.csv
+VARIANT_SUFFIXES = ["-int8", "-int8-static", "-fp16"]
+
+
+def resolve_model(model: str) -> Path:
+    # a path to an .onnx file, or the name of a model in MODELS_DIR
+    path = Path(model)
+    if path.suffix == ".onnx" or path.exists():
+        return path
+    return MODELS_DIR / f"{model}.onnx"
+
+
+def variant_path(model_path: Path, suffix: str) -> Path:
+    return model_path.with_name(f"{model_path.stem}{suffix}.onnx")
+
+
+def base_model_name(name: str) -> str:
+    for suffix in sorted(VARIANT_SUFFIXES, key=len, reverse=True):
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def discover_models(models_dir: Path = MODELS_DIR) -> dict:
+    # base models first, then every other .onnx file in the folder (quantized
+    # variants and user-added models) by name
+    model_paths = {name: models_dir / f"{name}.onnx" for name in BASE_MODELS}
+    if models_dir.is_dir():
+        for path in sorted(models_dir.glob("*.onnx"), key=lambda p: p.stem):
+            model_paths.setdefault(path.stem, path)
+    return model_paths
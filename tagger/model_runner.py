@@ -1,7 +1,10 @@
-import onnxruntime as ort
+import math
+import threading
 import numpy as np
 from PIL import Image
 from pathlib import Path
+from tagger.prob_cache import image_digest
+from tagger.session_config import SessionConfig
 
 MODEL_INPUT_SIZE = (448, 448)
 
@@ -14,6 +17,60 @@ def mcut_threshold(probs):
     return thresh
 
 
+def mcut_thresholds(probs: np.ndarray) -> np.ndarray:
+    # row-wise mcut_threshold over a [N, K] matrix
+    sorted_probs = -np.sort(-probs, axis=1)
+    difs = sorted_probs[:, :-1] - sorted_probs[:, 1:]
+    t = difs.argmax(axis=1)
+    rows = np.arange(len(probs))
+    return (sorted_probs[rows, t] + sorted_probs[rows, t + 1]) / 2
+
+
+def draft_for_target(image: Image.Image, target_size: int):
+    # JPEG can be decoded at 1/2, 1/4 or 1/8 scale; request the smallest scale
+    # whose long side still covers target_size so the final resize only shrinks
+    if image.format != "JPEG":
+        return
+    max_dim = max(image.size)
+    if max_dim <= target_size:
+        return
+    scale = target_size / max_dim
+    image.draft(
+        "RGB",
+        (math.ceil(image.size[0] * scale), math.ceil(image.size[1] * scale)),
+    )
+
+
+def compose_tags(
+    sorted_general,
+    rating,
+    sorted_character,
+    include_rating=False,
+    exclude_character=False,
+) -> list:
+    tags = []
+    if include_rating and rating:
+        tags.append(max(rating.items(), key=lambda x: x[1])[0])
+    tags.extend(sorted_general)
+    if not exclude_character:
+        tags.extend(sorted_character)
+    return tags
+
+
+def _square_span(length: int, max_dim: int, target_size: int):
+    # for one axis of the padded square: the output pixels whose bicubic
+    # window reaches the image (first, count) and the part of the square
+    # their windows read (lo, hi); every other output pixel is pure padding
+    scale = max_dim / target_size
+    support = 2 * max(scale, 1.0)
+    pad = (max_dim - length) // 2
+    first = max(0, math.floor((pad - support) / scale - 0.5) - 1)
+    last = min(target_size, math.ceil((pad + length + support) / scale - 0.5) + 2)
+    lo = max(0, math.floor(first * scale - support) - 1)
+    hi = min(max_dim, math.ceil(last * scale + support) + 1)
+    return first, last - first, lo, hi, pad
+
+
 class ONNXTagger:
     def __init__(
         self,
@@ -24,6 +81,10 @@ class ONNXTagger:
         character_indexes: list,
         general_threshold: float = 0.35,
         character_threshold: float = 0.85,
+        intra_op_num_threads: int = 0,
+        inter_op_num_threads: int = 0,
+        fast_decode: bool = False,
+        session_config: SessionConfig = None,
     ):
         self.model_path = model_path
         self.tag_names = tag_names
@@ -32,64 +93,222 @@ class ONNXTagger:
         self.character_indexes = character_indexes
         self.general_threshold = general_threshold
         self.character_threshold = character_threshold
-        self.session = ort.InferenceSession(
-            str(model_path), providers=["CPUExecutionProvider"]
+        self.fast_decode = fast_decode
+        # index arrays and per-category name arrays used by postprocess_batch
+        self.rating_idx = np.asarray(rating_indexes, dtype=np.intp)
+        self.general_idx = np.asarray(general_indexes, dtype=np.intp)
+        self.character_idx = np.asarray(character_indexes, dtype=np.intp)
+        names = np.asarray(tag_names, dtype=object)
+        self.rating_names = names[self.rating_idx].tolist()
+        self.general_names = names[self.general_idx]
+        self.character_names = names[self.character_idx]
+        # tag -> column in the model output, for looking up a caption's scores
+        self.tag_columns = {name: i for i, name in enumerate(tag_names)}
+        # optional ProbabilityCache; when set, predict re-thresholds cached vectors
+        self.prob_cache = None
+        # float32 input buffer reused across batches; see run_resized
+        self.batch_buffer = None
+        self.buffer_lock = threading.Lock()
+        # non-zero thread counts here override the ones in session_config
+        self.session_config = session_config or SessionConfig()
+        self.session = self.session_config.create_session(
+            model_path, intra_op_num_threads, inter_op_num_threads
+        )
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.target_size = model_input.shape[1]
+        # exported models either use a symbolic batch dimension or pin it to a fixed size
+        self.fixed_batch_size = (
+            model_input.shape[0] if isinstance(model_input.shape[0], int) else None
         )
-        self.input_name = self.session.get_inputs()[0].name
-        self.target_size = self.session.get_inputs()[0].shape[1]
 
-    def prepare_image(self, image: Image.Image, target_size: int) -> np.ndarray:
+    def resize_image(self, image: Image.Image, target_size: int):
+        # returns (pixels, top, left): the output pixels the image reaches when
+        # it is padded to a white square and resized, as the original
+        # prepare_image did, and where they sit in that square; the rest is
+        # padding, written later straight into the batch buffer
+        if self.fast_decode:
+            draft_for_target(image, target_size)
         if image.mode == "RGBA":
             canvas = Image.new("RGBA", image.size, (255, 255, 255))
             canvas.alpha_composite(image)
             image = canvas.convert("RGB")
         else:
             image = image.convert("RGB")
-        max_dim = max(image.size)
-        pad_left = (max_dim - image.size[0]) // 2
-        pad_top = (max_dim - image.size[1]) // 2
-        padded = Image.new("RGB", (max_dim, max_dim), (255, 255, 255))
-        padded.paste(image, (pad_left, pad_top))
-        if max_dim != target_size:
-            padded = padded.resize((target_size, target_size), Image.BICUBIC)
-        image_np = np.asarray(padded, dtype=np.float32)
-        image_np = image_np[:, :, ::-1]
-        image_np = np.expand_dims(image_np, axis=0)
-        return image_np
-
-    def predict(self, image: Image.Image, general_mcut=False, character_mcut=False):
-        input_tensor = self.prepare_image(image, self.target_size)
-        preds = self.session.run(None, {self.input_name: input_tensor})[0][0]
-        labels = list(zip(self.tag_names, preds.astype(float)))
-
-        ratings = [labels[i] for i in self.rating_indexes]
-        rating = dict(ratings)
-
-        general_names = [labels[i] for i in self.general_indexes]
-        general_probs = np.array([x[1] for x in general_names])
-        general_thresh = (
-            mcut_threshold(general_probs) if general_mcut else self.general_threshold
+        width, height = image.size
+        max_dim = max(width, height)
+        if max_dim == target_size:
+            return (
+                np.asarray(image),
+                (max_dim - height) // 2,
+                (max_dim - width) // 2,
+            )
+        # only the strip of the square the filter windows read is built: the
+        # image plus enough padding around it, resized on the same grid
+        left, out_width, x_lo, x_hi, pad_left = _square_span(
+            width, max_dim, target_size
+        )
+        top, out_height, y_lo, y_hi, pad_top = _square_span(
+            height, max_dim, target_size
+        )
+        if (x_hi - x_lo, y_hi - y_lo) != image.size:
+            strip = Image.new("RGB", (x_hi - x_lo, y_hi - y_lo), (255, 255, 255))
+            strip.paste(image, (pad_left - x_lo, pad_top - y_lo))
+            image = strip
+        scale = max_dim / target_size
+        box = (
+            left * scale - x_lo,
+            top * scale - y_lo,
+            (left + out_width) * scale - x_lo,
+            (top + out_height) * scale - y_lo,
         )
-        general_res = [x for x in general_names if x[1] > general_thresh]
-        general_res = dict(general_res)
+        image = image.resize((out_width, out_height), Image.BICUBIC, box=box)
+        return np.asarray(image), top, left
+
+    def pad_into(self, resized, out: np.ndarray):
+        # writes resized pixels onto a white square as float32 BGR
+        pixels, top, left = resized
+        height, width = pixels.shape[:2]
+        out.fill(255)
+        out[top : top + height, left : left + width] = pixels[:, :, ::-1]
+
+    def prepare_image(self, image: Image.Image, target_size: int) -> np.ndarray:
+        out = np.empty((1, target_size, target_size, 3), dtype=np.float32)
+        self.pad_into(self.resize_image(image, target_size), out[0])
+        return out
+
+    def run_resized(self, batch_resized: list) -> np.ndarray:
+        # packs resized images into a reused C-contiguous batch buffer and runs it
+        with self.buffer_lock:
+            count = len(batch_resized)
+            if self.batch_buffer is None or len(self.batch_buffer) < count:
+                self.batch_buffer = np.empty(
+                    (count, self.target_size, self.target_size, 3), dtype=np.float32
+                )
+            batch = self.batch_buffer[:count]
+            for resized, out in zip(batch_resized, batch):
+                self.pad_into(resized, out)
+            return self.run_batch(batch)
 
-        character_names = [labels[i] for i in self.character_indexes]
-        character_probs = np.array([x[1] for x in character_names])
+    def run_batch(self, input_tensor: np.ndarray) -> np.ndarray:
+        if self.fixed_batch_size is None:
+            return self.session.run(None, {self.input_name: input_tensor})[0]
+        # fixed batch dimension: feed exactly that many rows, padding the last chunk
+        outputs = []
+        for start in range(0, len(input_tensor), self.fixed_batch_size):
+            chunk = input_tensor[start : start + self.fixed_batch_size]
+            count = len(chunk)
+            if count < self.fixed_batch_size:
+                padding = np.zeros(
+                    (self.fixed_batch_size - count,) + chunk.shape[1:],
+                    dtype=chunk.dtype,
+                )
+                chunk = np.concatenate([chunk, padding])
+            outputs.append(self.session.run(None, {self.input_name: chunk})[0][:count])
+        return np.concatenate(outputs)
+
+    def predict(
+        self,
+        image: Image.Image,
+        general_mcut=False,
+        character_mcut=False,
+        thresholds=None,
+    ):
+        if self.prob_cache is None:
+            resized = self.resize_image(image, self.target_size)
+            preds = self.run_resized([resized])[0]
+            return self.postprocess(preds, general_mcut, character_mcut, thresholds)
+        digest = image_digest(image)
+        preds = self.prob_cache.get(digest)
+        if preds is None:
+            resized = self.resize_image(image, self.target_size)
+            preds = self.run_resized([resized])[0]
+            self.prob_cache.put(digest, preds)
+            self.prob_cache.flush()
+        return self.postprocess(preds, general_mcut, character_mcut, thresholds)
+
+    def predict_batch(
+        self,
+        images: list,
+        batch_size: int = 8,
+        general_mcut=False,
+        character_mcut=False,
+    ) -> list:
+        results = []
+        for start in range(0, len(images), batch_size):
+            batch_resized = [
+                self.resize_image(image, self.target_size)
+                for image in images[start : start + batch_size]
+            ]
+            results.extend(
+                self.postprocess_batch(
+                    self.run_resized(batch_resized), general_mcut, character_mcut
+                )
+            )
+        return results
+
+    def postprocess(
+        self,
+        preds: np.ndarray,
+        general_mcut=False,
+        character_mcut=False,
+        thresholds=None,
+    ):
+        return self.postprocess_batch(
+            preds[np.newaxis], general_mcut, character_mcut, thresholds
+        )[0]
+
+    def postprocess_batch(
+        self,
+        preds: np.ndarray,
+        general_mcut=False,
+        character_mcut=False,
+        thresholds=None,
+    ) -> list:
+        # thresholds is an optional (general, character) pair used instead of
+        # the tagger's own, for callers sharing this tagger with other settings.
+        # They are compared in float64, exactly like the python floats the
+        # per-tag loop used to work with
+        general_threshold, character_threshold = thresholds or (
+            self.general_threshold,
+            self.character_threshold,
+        )
+        probs = preds.astype(np.float64)
+        rating_probs = probs[:, self.rating_idx].tolist()
+        general_probs = probs[:, self.general_idx]
+        character_probs = probs[:, self.character_idx]
+        general_thresh = (
+            mcut_thresholds(general_probs)
+            if general_mcut
+            else np.full(len(probs), general_threshold)
+        )
         character_thresh = (
-            mcut_threshold(character_probs)
+            mcut_thresholds(character_probs)
             if character_mcut
-            else self.character_threshold
+            else np.full(len(probs), character_threshold)
         )
-        character_res = [x for x in character_names if x[1] > character_thresh]
-        character_res = dict(character_res)
+        general_mask = general_probs > general_thresh[:, np.newaxis]
+        character_mask = character_probs > character_thresh[:, np.newaxis]
 
-        sorted_general = sorted(general_res.items(), key=lambda x: x[1], reverse=True)
-        sorted_general = [x[0] for x in sorted_general]
-        sorted_character = sorted(
-            character_res.items(), key=lambda x: x[1], reverse=True
-        )
-        sorted_character = [x[0] for x in sorted_character]
-        return sorted_general, rating, sorted_character, general_res
+        results = []
+        for row in range(len(probs)):
+            general_sel = np.flatnonzero(general_mask[row])
+            general_vals = general_probs[row, general_sel]
+            general_res = dict(
+                zip(self.general_names[general_sel].tolist(), general_vals.tolist())
+            )
+            # stable descending sort keeps tag order for equal probabilities
+            general_order = general_sel[np.argsort(-general_vals, kind="stable")]
+            sorted_general = self.general_names[general_order].tolist()
+
+            character_sel = np.flatnonzero(character_mask[row])
+            character_vals = character_probs[row, character_sel]
+            character_order = character_sel[np.argsort(-character_vals, kind="stable")]
+            sorted_character = self.character_names[character_order].tolist()
+
+            rating = dict(zip(self.rating_names, rating_probs[row]))
+            results.append((sorted_general, rating, sorted_character, general_res))
+        return results
 
     def set_thresholds(self, general, character):
         self.general_threshold = general
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from config_manager import CONFIG_DIR
+
+CACHE_ROOT = CONFIG_DIR / "prob_cache"
+FINGERPRINTS_PATH = CACHE_ROOT / "fingerprints.json"
+_fingerprint_lock = threading.Lock()
+
+
+def bytes_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_digest(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_file_digest(path: Path) -> str:
+    # hashing a 1GB model on every load is too slow, so digests are remembered
+    # per (path, size, mtime) and only recomputed when the file changes
+    path = Path(path).resolve()
+    stat = path.stat()
+    with _fingerprint_lock:
+        fingerprints = {}
+        if FINGERPRINTS_PATH.exists():
+            try:
+                fingerprints = json.loads(FINGERPRINTS_PATH.read_text("utf-8"))
+            except Exception:
+                fingerprints = {}
+        entry = fingerprints.get(str(path))
+        if entry and entry["size"] == stat.st_size:
+            if entry["mtime_ns"] == stat.st_mtime_ns:
+                return entry["digest"]
+        digest = file_digest(path)
+        fingerprints[str(path)] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "digest": digest,
+        }
+        CACHE_ROOT.mkdir(parents=True, exist_ok=True)
+        FINGERPRINTS_PATH.write_text(json.dumps(fingerprints, indent=2), "utf-8")
+        return digest
+
+
+def image_digest(image: Image.Image) -> str:
+    filename = getattr(image, "filename", None)
+    if filename and Path(filename).is_file():
+        return file_digest(Path(filename))
+    return bytes_digest(f"{image.mode}{image.size}".encode("utf-8") + image.tobytes())
+
+
+class ProbabilityCache:
+    # raw prediction vectors for one (model, tag table) pair, stored as a
+    # float16 memmap with an sqlite index of image digest -> row and LRU stamps
+    GROW_ROWS = 1024
+    # least recently used entries dropped at once when the cache is full
+    EVICT_ROWS = 256
+
+    def __init__(
+        self,
+        model_path: Path,
+        csv_path: Path,
+        num_tags: int,
+        max_bytes: int = 2048 << 20,
+        variant: str = "",
+        root: Path = CACHE_ROOT,
+    ):
+        self.num_tags = num_tags
+        self.capacity = max(1, max_bytes // (num_tags * 2))
+        # each preprocessing variant keeps its own vectors
+        name = Path(model_path).stem + (f"-{variant}" if variant else "")
+        self.cache_dir = Path(root) / name
+        self.matrix_path = self.cache_dir / "probs.f16"
+        self.lock = threading.Lock()
+        self.pending_writes = 0
+        # rows freed by the last eviction, reused before evicting again
+        self.free_slots = []
+        # vectors a bulk run may still add, None outside of one
+        self.bulk_budget = None
+
+        meta = {
+            "model_digest": cached_file_digest(model_path),
+            "csv_digest": cached_file_digest(csv_path),
+            "num_tags": num_tags,
+            "variant": variant,
+        }
+        meta_path = self.cache_dir / "meta.json"
+        if meta_path.exists():
+            try:
+                stale = json.loads(meta_path.read_text("utf-8")) != meta
+            except Exception:
+                stale = True
+            if stale:
+                print(f"[ProbabilityCache] Invalidating {self.cache_dir}")
+                shutil.rmtree(self.cache_dir, ignore_errors=True)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        meta_path.write_text(json.dumps(meta, indent=2), "utf-8")
+
+        self.db = sqlite3.connect(
+            self.cache_dir / "index.sqlite", check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(digest TEXT PRIMARY KEY, slot INTEGER NOT NULL, last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used)")
+        # rows past the highest committed slot may hold vectors whose index
+        # entries were lost in a crash, so new rows are appended after it
+        self.next_slot = self.db.execute(
+            "SELECT COALESCE(MAX(slot) + 1, 0) FROM entries"
+        ).fetchone()[0]
+        self.matrix = None
+        self._map_rows(self.next_slot)
+
+    def _map_rows(self, rows: int):
+        rows = min(self.capacity, max(rows, self.GROW_ROWS))
+        if self.matrix is not None and len(self.matrix) >= rows:
+            return
+        if self.matrix is not None:
+            self.matrix.flush()
+        size = rows * self.num_tags * 2
+        with open(self.matrix_path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        self.matrix = np.memmap(
+            self.matrix_path, dtype=np.float16, mode="r+", shape=(rows, self.num_tags)
+        )
+
+    def get(self, digest: str):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT slot FROM entries WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                "UPDATE entries SET last_used = ? WHERE digest = ?",
+                (time.time(), digest),
+            )
+            return np.asarray(self.matrix[row[0]], dtype=np.float32)
+
+    def put(self, digest: str, preds: np.ndarray):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT slot FROM entries WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row is not None:
+                slot = row[0]
+            elif self.next_slot < self.capacity:
+                slot = self.next_slot
+                self.next_slot += 1
+                if slot >= len(self.matrix):
+                    self._map_rows(len(self.matrix) * 2)
+            else:
+                if not self.free_slots:
+                    self._evict()
+                slot = self.free_slots.pop()
+            self.matrix[slot] = preds
+            self.db.execute(
+                "INSERT OR REPLACE INTO entries (digest, slot, last_used) "
+                "VALUES (?, ?, ?)",
+                (digest, slot, time.time()),
+            )
+            self.pending_writes += 1
+            if self.pending_writes >= 256:
+                self._flush()
+
+    def _evict(self):
+        # drops the least recently used entries in one transaction and keeps
+        # their rows for reuse; the delete is committed before any row is
+        # overwritten, so a crash can never leave an old digest pointing at a
+        # new vector
+        rows = self.db.execute(
+            "SELECT digest, slot FROM entries ORDER BY last_used LIMIT ?",
+            (self.EVICT_ROWS,),
+        ).fetchall()
+        self.db.executemany(
+            "DELETE FROM entries WHERE digest = ?", [(digest,) for digest, _ in rows]
+        )
+        self.matrix.flush()
+        self.db.commit()
+        self.pending_writes = 0
+        self.free_slots = [slot for _, slot in rows]
+
+    def put_many(self, digests: list, preds: np.ndarray):
+        # callers go on with the exact predictions, like an uncached run; only
+        # later hits see the float16 copy
+        with self.lock:
+            if self.bulk_budget is not None:
+                digests = digests[: max(self.bulk_budget, 0)]
+                self.bulk_budget -= len(digests)
+        for digest, row in zip(digests, preds):
+            self.put(digest, row)
+
+    def begin_bulk(self):
+        # a bulk run that has cached a full cache's worth of new vectors would
+        # only evict its own earlier ones from then on, so the rest of it is
+        # not cached
+        with self.lock:
+            self.bulk_budget = self.capacity
+
+    def end_bulk(self):
+        with self.lock:
+            self.bulk_budget = None
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.matrix.flush()
+        self.db.commit()
+        self.pending_writes = 0
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM entries")
+            self.db.commit()
+            self.next_slot = 0
+            self.free_slots = []
@@ -1,23 +1,113 @@
-import pandas as pd
+import csv
+import os
+import sys
 from pathlib import Path
+import numpy as np
+from tagger.prob_cache import file_digest
+
+# category column values in selected_tags.csv
+GENERAL = 0
+CHARACTER = 4
+RATING = 9
+
+CACHE_VERSION = 1
 
 
 class SelectedTagsLoader:
+    # reads selected_tags.csv into interned tag names plus int32 index arrays
+    # per category. The parsed table is cached as selected_tags.npz next to the
+    # CSV and reused while the CSV's mtime and size match, or its content hash
+    # does when only the mtime changed (a copy or re-download).
     def __init__(self, csv_path: Path):
-        self.csv_path = csv_path
+        self.csv_path = Path(csv_path)
+        self.cache_path = self.csv_path.with_suffix(".npz")
+        self.tags = None
+        self.categories = None
 
     def load_tags(self):
-        df = pd.read_csv(self.csv_path)
-        tag_names = df["name"].tolist()
-        rating_indexes = list(df.index[df["category"] == 9])
-        general_indexes = list(df.index[df["category"] == 0])
-        character_indexes = list(df.index[df["category"] == 4])
-        return tag_names, rating_indexes, general_indexes, character_indexes
+        self.load()
+        return (
+            self.tags,
+            self.indexes(RATING),
+            self.indexes(GENERAL),
+            self.indexes(CHARACTER),
+        )
+
+    def load(self):
+        if self.tags is not None:
+            return
+        stat = os.stat(self.csv_path)
+        stamp = [stat.st_mtime_ns, stat.st_size]
+        cached = self.read_cache(stamp)
+        if cached is not None:
+            self.tags, self.categories = cached
+            return
+        self.tags, self.categories = self.parse()
+        self.write_cache(stamp, file_digest(self.csv_path))
+
+    def indexes(self, category: int) -> np.ndarray:
+        return np.flatnonzero(self.categories == category).astype(np.int32)
+
+    def parse(self):
+        with open(self.csv_path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            name_column = header.index("name")
+            category_column = header.index("category")
+            tags = []
+            categories = []
+            for row in reader:
+                tags.append(sys.intern(row[name_column]))
+                categories.append(int(row[category_column]))
+        return tags, np.asarray(categories, dtype=np.int16)
+
+    def read_cache(self, stamp: list):
+        try:
+            with np.load(self.cache_path, allow_pickle=False) as cache:
+                if int(cache["version"]) != CACHE_VERSION:
+                    return None
+                if cache["stamp"].tolist() != stamp:
+                    digest = str(cache["digest"])
+                    if digest != file_digest(self.csv_path):
+                        return None
+                    # same content, newer mtime: refresh the stamp only
+                    refresh = digest
+                else:
+                    refresh = None
+                tags = [sys.intern(name) for name in cache["names"].tolist()]
+                categories = cache["categories"]
+        except (OSError, KeyError, ValueError):
+            return None
+        if refresh is not None:
+            self.tags, self.categories = tags, categories
+            self.write_cache(stamp, refresh)
+        return tags, categories
+
+    def write_cache(self, stamp: list, digest: str):
+        # written under a temporary name so a concurrent reader never sees a
+        # partial file; a read-only model folder just goes without a cache
+        temp = self.cache_path.with_name(f"{self.cache_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(temp, "wb") as f:
+                np.savez(
+                    f,
+                    version=CACHE_VERSION,
+                    stamp=np.asarray(stamp, dtype=np.int64),
+                    digest=digest,
+                    names=np.asarray(self.tags, dtype=str),
+                    categories=self.categories,
+                )
+            os.replace(temp, self.cache_path)
+        except OSError as e:
+            print(f"[SelectedTagsLoader] Could not cache {self.csv_path}: {e}")
+            temp.unlink(missing_ok=True)
 
     def get_tag_by_index(self, index: int) -> str:
+        self.load()
         if 0 <= index < len(self.tags):
             return self.tags[index]
         return ""
 
     def get_all_tags(self) -> list[str]:
+        self.load()
         return self.tags
@@ -0,0 +1,178 @@
+import os
+from pathlib import Path
+from config_manager import CONFIG_DIR
+from tagger.prob_cache import cached_file_digest
+
+OPTIMIZED_MODELS_DIR = CONFIG_DIR / "optimized_models"
+
+# onnxruntime enum names; onnxruntime itself is imported only when a session
+# is built, since importing it takes a noticeable part of the GUI's startup
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": "ORT_DISABLE_ALL",
+    "basic": "ORT_ENABLE_BASIC",
+    "extended": "ORT_ENABLE_EXTENDED",
+    "all": "ORT_ENABLE_ALL",
+}
+
+EXECUTION_MODES = {
+    "sequential": "ORT_SEQUENTIAL",
+    "parallel": "ORT_PARALLEL",
+}
+
+
+def resolve_providers(requested: list) -> list:
+    # keeps the requested providers that this onnxruntime build offers, in
+    # order, and always ends with the CPU provider as a fallback
+    import onnxruntime as ort
+
+    available = ort.get_available_providers()
+    providers = []
+    for name in requested:
+        if name in available:
+            providers.append(name)
+        else:
+            print(f"[SessionConfig] {name} is not available, skipping it")
+    if "CPUExecutionProvider" not in providers:
+        providers.append("CPUExecutionProvider")
+    return providers
+
+
+class SessionConfig:
+    # how ONNXTagger builds its InferenceSession; plain attributes so it can be
+    # pickled into bulk worker processes
+    def __init__(
+        self,
+        providers=("CPUExecutionProvider",),
+        provider_options=None,
+        graph_optimization="all",
+        cache_optimized_model=False,
+        intra_op_num_threads=0,
+        inter_op_num_threads=0,
+        execution_mode="sequential",
+        cpu_mem_arena=True,
+        mem_pattern=True,
+        allow_spinning=True,
+        thread_affinities="",
+    ):
+        if graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(f"Unknown graph optimization level: {graph_optimization}")
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError(f"Unknown execution mode: {execution_mode}")
+        self.providers = list(providers)
+        self.provider_options = provider_options or {}
+        self.graph_optimization = graph_optimization
+        self.cache_optimized_model = cache_optimized_model
+        self.intra_op_num_threads = intra_op_num_threads
+        self.inter_op_num_threads = inter_op_num_threads
+        self.execution_mode = execution_mode
+        self.cpu_mem_arena = cpu_mem_arena
+        self.mem_pattern = mem_pattern
+        self.allow_spinning = allow_spinning
+        self.thread_affinities = thread_affinities
+
+    @classmethod
+    def from_config(cls, config) -> "SessionConfig":
+        return cls(
+            providers=config.get("execution_providers", ["CPUExecutionProvider"]),
+            provider_options=config.get("provider_options", {}),
+            graph_optimization=config.get("graph_optimization", "all"),
+            cache_optimized_model=config.get("cache_optimized_model", False),
+            intra_op_num_threads=config.get("intra_op_threads", 0),
+            inter_op_num_threads=config.get("inter_op_threads", 0),
+            execution_mode=config.get("execution_mode", "sequential"),
+            cpu_mem_arena=config.get("cpu_mem_arena", True),
+            mem_pattern=config.get("mem_pattern", True),
+            allow_spinning=config.get("allow_spinning", True),
+            thread_affinities=config.get("thread_affinities", ""),
+        )
+
+    def describe(self) -> str:
+        return (
+            f"providers={','.join(self.providers)} "
+            f"optimization={self.graph_optimization} "
+            f"threads={self.intra_op_num_threads}/{self.inter_op_num_threads} "
+            f"mode={self.execution_mode} arena={self.cpu_mem_arena} "
+            f"mem_pattern={self.mem_pattern} spinning={self.allow_spinning}"
+        )
+
+    def session_options(
+        self, intra_op_num_threads=None, inter_op_num_threads=None
+    ) -> "ort.SessionOptions":
+        # explicit thread counts (per bulk worker) override the configured ones
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel,
+            GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization],
+        )
+        options.execution_mode = getattr(
+            ort.ExecutionMode, EXECUTION_MODES[self.execution_mode]
+        )
+        # 0 lets onnxruntime pick based on the available cores
+        options.intra_op_num_threads = intra_op_num_threads or self.intra_op_num_threads
+        options.inter_op_num_threads = inter_op_num_threads or self.inter_op_num_threads
+        options.enable_cpu_mem_arena = self.cpu_mem_arena
+        options.enable_mem_pattern = self.mem_pattern
+        if not self.allow_spinning:
+            options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+            options.add_session_config_entry("session.inter_op.allow_spinning", "0")
+        if self.thread_affinities:
+            options.add_session_config_entry(
+                "session.intra_op_thread_affinities", self.thread_affinities
+            )
+        return options
+
+    def optimized_model_path(self, model_path: Path, providers: list) -> Path:
+        # optimized graphs can contain provider specific nodes, so the cache key
+        # covers the providers, the level and the onnxruntime version
+        import onnxruntime as ort
+
+        digest = cached_file_digest(model_path)[:16]
+        provider_key = "-".join(p.replace("ExecutionProvider", "") for p in providers)
+        name = (
+            f"{Path(model_path).stem}-{digest}-{self.graph_optimization}-"
+            f"{provider_key}-ort{ort.__version__}.onnx"
+        )
+        return OPTIMIZED_MODELS_DIR / name
+
+    def create_session(
+        self, model_path: Path, intra_op_num_threads=None, inter_op_num_threads=None
+    ) -> "ort.InferenceSession":
+        import onnxruntime as ort
+
+        providers = resolve_providers(self.providers)
+        provider_options = [self.provider_options.get(p, {}) for p in providers]
+        options = self.session_options(intra_op_num_threads, inter_op_num_threads)
+        source = Path(model_path)
+        if self.cache_optimized_model and self.graph_optimization != "disable":
+            cached = self.optimized_model_path(model_path, providers)
+            if cached.exists():
+                # the graph is already optimized, skip doing it again
+                source = cached
+                options.graph_optimization_level = (
+                    ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+                )
+            else:
+                OPTIMIZED_MODELS_DIR.mkdir(parents=True, exist_ok=True)
+                # written under a temporary name so concurrent workers never
+                # load a half-written file
+                temp = cached.with_name(f"{cached.name}.{os.getpid()}.tmp")
+                options.optimized_model_filepath = str(temp)
+                session = ort.InferenceSession(
+                    str(source),
+                    sess_options=options,
+                    providers=providers,
+                    provider_options=provider_options,
+                )
+                try:
+                    os.replace(temp, cached)
+                except OSError as e:
+                    print(f"[SessionConfig] Could not cache optimized model: {e}")
+                return session
+        return ort.InferenceSession(
+            str(source),
+            sess_options=options,
+            providers=providers,
+            provider_options=provider_options,
+        )
@@ -0,0 +1,117 @@
+# a bulk run killed outright must never have journaled an image whose caption
+# or top-k row was lost, and resuming it must finish every image
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from benchmarks.fixtures import make_corpus, make_stand_in_model
+from bulk.journal import JOURNAL_NAME
+from bulk.probabilities import TopKProbabilities
+from captions.caption_store import CaptionStore
+
+ROOT = Path(__file__).resolve().parent.parent
+IMAGES = 300
+KILL_AT = 250
+
+# tags the folder and SIGKILLs itself once `kill_at` images are done (0 = never);
+# a fourth argument of 1 only retries the failed images
+CHILD = """
+import os, signal, sys
+from pathlib import Path
+from bulk.bulk_processor import bulk_tag_images
+from tagger.model_runner import ONNXTagger
+from tagger.selected_tags_loader import SelectedTagsLoader
+
+model, folder, kill_at = Path(sys.argv[1]), Path(sys.argv[2]), int(sys.argv[3])
+retry_failed = sys.argv[4:] == ["1"]
+tagger = ONNXTagger(model, *SelectedTagsLoader(model.parent / "selected_tags.csv").load_tags())
+
+def progress(processed, failed, skipped):
+    if processed == kill_at:
+        os.kill(os.getpid(), signal.SIGKILL)
+
+bulk_tag_images(
+    tagger, folder, False, False, caption_store=True, top_k=8,
+    progress_callback=progress, retry_failed=retry_failed,
+)
+"""
+
+
+def run_child(model: Path, folder: Path, home: Path, kill_at: int, retry=False):
+    env = dict(os.environ, HOME=str(home), USERPROFILE=str(home))
+    return subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            CHILD,
+            str(model),
+            str(folder),
+            str(kill_at),
+            "1" if retry else "0",
+        ],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGKILL"), reason="needs SIGKILL")
+def test_killed_run_keeps_journaled_outputs_and_resumes(tmp_path):
+    model = make_stand_in_model(tmp_path / "model" / "stand-in.onnx", tags=200)
+    folder = tmp_path / "images"
+    make_corpus(folder, IMAGES, (64, 64))
+    home = tmp_path / "home"
+    home.mkdir()
+
+    killed = run_child(model, folder, home, KILL_AT)
+    assert killed.returncode == -signal.SIGKILL, killed.stderr
+
+    db = sqlite3.connect(folder / JOURNAL_NAME)
+    journaled = [path for (path,) in db.execute("SELECT path FROM entries WHERE ok")]
+    db.close()
+    # the journal committed at least one batch before the kill
+    assert journaled
+    assert len(journaled) < IMAGES
+    store = CaptionStore(folder)
+    probabilities = TopKProbabilities(folder)
+    for key in journaled:
+        assert store.has(key), key
+        assert key in probabilities.rows, key
+    store.close()
+
+    resumed = run_child(model, folder, home, 0)
+    assert resumed.returncode == 0, resumed.stderr
+    assert "Resuming an interrupted run" in resumed.stdout
+    keys = {path.name for path in folder.glob("*.jpg")}
+    store = CaptionStore(folder)
+    assert all(store.has(key) for key in keys)
+    store.close()
+    assert keys <= set(TopKProbabilities(folder).rows)
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGKILL"), reason="needs SIGKILL")
+def test_retrying_a_killed_run_also_tags_the_images_it_never_reached(tmp_path):
+    model = make_stand_in_model(tmp_path / "model" / "stand-in.onnx", tags=200)
+    folder = tmp_path / "images"
+    make_corpus(folder, IMAGES, (64, 64))
+    (folder / "broken.jpg").write_bytes(b"not an image")
+    home = tmp_path / "home"
+    home.mkdir()
+
+    killed = run_child(model, folder, home, KILL_AT)
+    assert killed.returncode == -signal.SIGKILL, killed.stderr
+
+    retried = run_child(model, folder, home, 0, retry=True)
+    assert retried.returncode == 0, retried.stderr
+    assert "the rest of it is tagged too" in retried.stdout
+    store = CaptionStore(folder)
+    assert all(store.has(path.name) for path in folder.glob("synthetic_*.jpg"))
+    store.close()
+
+    # the job is finished now, so a normal run starts over rather than resuming
+    rerun = run_child(model, folder, home, 0)
+    assert "Resuming an interrupted run" not in rerun.stdout
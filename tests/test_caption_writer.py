@@ -0,0 +1,59 @@
+import sqlite3
+import threading
+from pathlib import Path
+import pytest
+from bulk.pipeline import CaptionWriter, ImageResult
+
+
+def failed_result(i: int) -> ImageResult:
+    # failed results skip the write, so only on_done runs
+    result = ImageResult(Path(f"image_{i}.jpg"))
+    result.error = "decode failed"
+    return result
+
+
+def run_with_timeout(fn, timeout=30):
+    outcome = {}
+
+    def target():
+        try:
+            fn()
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the caption writer hung"
+    return outcome.get("error")
+
+
+def test_on_done_error_reaches_the_caller_instead_of_hanging():
+    def on_done(result):
+        if result.path.name == "image_3.jpg":
+            raise sqlite3.OperationalError("database is locked")
+
+    def run():
+        with CaptionWriter(on_done, max_pending=4) as writer:
+            # far more than max_pending, so a dead writer would block put()
+            for i in range(1000):
+                writer.put(failed_result(i))
+
+    error = run_with_timeout(run)
+    assert isinstance(error, sqlite3.OperationalError)
+
+
+def test_close_reraises_an_error_raised_after_the_last_put():
+    done = []
+
+    def on_done(result):
+        done.append(result)
+        if len(done) == 2:
+            raise ValueError("metrics file closed")
+
+    writer = CaptionWriter(on_done)
+    writer.put(failed_result(0))
+    writer.put(failed_result(1))
+    error = run_with_timeout(writer.close)
+    assert isinstance(error, ValueError)
+    assert len(done) == 2
@@ -0,0 +1,66 @@
+# resize_image + pad_into must match the original prepare_image, which pasted
+# the image onto a white square and resized the whole square
+import numpy as np
+import pytest
+from PIL import Image
+from benchmarks.fixtures import make_stand_in_model
+from tagger.model_runner import ONNXTagger
+from tagger.selected_tags_loader import SelectedTagsLoader
+
+TARGET = 448
+
+
+def padded_square(image: Image.Image, target_size: int) -> np.ndarray:
+    if image.mode == "RGBA":
+        canvas = Image.new("RGBA", image.size, (255, 255, 255))
+        canvas.alpha_composite(image)
+        image = canvas.convert("RGB")
+    else:
+        image = image.convert("RGB")
+    max_dim = max(image.size)
+    pad_left = (max_dim - image.size[0]) // 2
+    pad_top = (max_dim - image.size[1]) // 2
+    padded = Image.new("RGB", (max_dim, max_dim), (255, 255, 255))
+    padded.paste(image, (pad_left, pad_top))
+    if max_dim != target_size:
+        padded = padded.resize((target_size, target_size), Image.BICUBIC)
+    return np.asarray(padded, dtype=np.float32)[np.newaxis, :, :, ::-1]
+
+
+@pytest.fixture(scope="module")
+def tagger(tmp_path_factory):
+    model = make_stand_in_model(
+        tmp_path_factory.mktemp("model") / "stand-in.onnx", tags=50
+    )
+    tags = SelectedTagsLoader(model.parent / "selected_tags.csv").load_tags()
+    return ONNXTagger(model, *tags)
+
+
+@pytest.mark.parametrize(
+    "size",
+    [
+        (1000, 999),
+        (300, 900),
+        (900, 300),
+        (447, 448),
+        (5, 700),
+        (3000, 17),
+        (449, 200),
+        (640, 480),
+        (100, 30),
+        (448, 448),
+        (1, 1),
+    ],
+)
+@pytest.mark.parametrize("mode", ["RGB", "RGBA"])
+def test_matches_the_padded_square_resize(tagger, size, mode):
+    width, height = size
+    rng = np.random.default_rng(width * 10007 + height)
+    pixels = rng.integers(0, 256, (height, width, len(mode)), dtype=np.uint8)
+    image = Image.fromarray(pixels, mode)
+    expected = padded_square(image, TARGET)
+    actual = tagger.prepare_image(image, TARGET)
+    assert actual.shape == expected.shape
+    # Pillow computes the resize grid of a cropped box with slightly different
+    # float rounding, which can move a pixel by one level, never more
+    assert np.abs(actual - expected).max() <= 1
@@ -0,0 +1,32 @@
+import threading
+import pytest
+from benchmarks.fixtures import make_corpus, make_stand_in_model
+from bulk.pipeline import CaptionOptions
+from bulk.process_pool import iter_captions_sharded
+from tagger.model_runner import ONNXTagger
+from tagger.selected_tags_loader import SelectedTagsLoader
+
+
+def test_a_worker_that_cannot_load_the_model_fails_the_run(tmp_path):
+    model = make_stand_in_model(tmp_path / "model" / "stand-in.onnx", tags=50)
+    tags = SelectedTagsLoader(model.parent / "selected_tags.csv").load_tags()
+    tagger = ONNXTagger(model, *tags)
+    # the workers load their own session from this path
+    corrupt = tmp_path / "model" / "corrupt.onnx"
+    corrupt.write_bytes(b"not a model")
+    tagger.model_path = corrupt
+    images = make_corpus(tmp_path / "images", 8, (64, 64))
+    outcome = {}
+
+    def run():
+        try:
+            list(iter_captions_sharded(tagger, images, CaptionOptions(), 2, 2, 1))
+        except Exception as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(120)
+    assert not thread.is_alive(), "the worker pool hung"
+    assert isinstance(outcome.get("error"), RuntimeError)
+    assert "could not load the model" in str(outcome["error"])
@@ -4,34 +4,76 @@ from PySide6.QtWidgets import (
     QVBoxLayout,
     QHBoxLayout,
     QListWidget,
+    QListView,
     QPushButton,
     QFileDialog,
     QLineEdit,
     QMessageBox,
-    QListWidgetItem,
+    QApplication,
+    QCompleter,
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer, QStringListModel, QThread, QThreadPool
 from PySide6.QtGui import QPixmap
 from pathlib import Path
 import os
+import config_manager
+from captions.tag_index import TagIndex
+from captions.caption_files import caption_path, write_captions
+from captions.caption_store import CaptionStore
+from ui.workers import FolderLoader, start_task
+from ui.image_list_model import ImageListModel
+from ui.thumbnails import ThumbnailCache
 
 
 class EditorTab(QWidget):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, thumbnails=None):
         super().__init__(parent)
+        config = config_manager.ConfigManager()
+        self.thumbnails = thumbnails or ThumbnailCache.from_config(config, self)
+        self.thumbnails.ready.connect(self.on_thumbnail_ready)
+        self.thumbnails.failed.connect(self.on_thumbnail_failed)
+        self.prefetch_rows = config.get("thumbnail_prefetch", 3)
         self.image_folder = None
-        self.image_files = []
+        self.store = None
+        self.loader = None
+        self.loader_thread = None
+        self.matches_filter = None
         self.current_image_path = None
-        self.tags_map = {}
-        self.unsaved_changes = False
+        self.index = TagIndex()
+        self.shown_tags = []
+        self.tasks = set()
+        self.saving = False
+        # the CaptionStore the save in flight writes to
+        self.saving_store = None
+        self.save_requested = False
         self.init_ui()
 
+        # autosave is checked on every tick so the settings tab can toggle it
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setInterval(
+            int(config.get("editor_autosave_interval", 30) * 1000)
+        )
+        self.autosave_timer.timeout.connect(self.autosave)
+        self.autosave_timer.start()
+
+    @property
+    def tags_map(self) -> dict:
+        return self.index.tags_map
+
+    @property
+    def unsaved_changes(self) -> bool:
+        return bool(self.index.dirty) or self.saving
+
     def init_ui(self):
         self.image_preview = QLabel("No image selected")
         self.image_preview.setMaximumSize(256, 256)
         self.image_preview.setAlignment(Qt.AlignCenter)
 
-        self.image_list = QListWidget()
+        self.image_model = ImageListModel(self)
+        self.image_list = QListView()
+        self.image_list.setModel(self.image_model)
+        # fixed row heights let the view skip measuring every row
+        self.image_list.setUniformItemSizes(True)
         self.tag_list = QListWidget()
 
         self.load_button = QPushButton("Open Folder")
@@ -46,6 +88,23 @@ class EditorTab(QWidget):
         self.add_tag_all_button = QPushButton("Add Tag to All")
         self.add_tag_all_button.clicked.connect(self.add_tag_to_all_captions)
 
+        self.filter_input = QLineEdit()
+        self.filter_input.setPlaceholderText("Filter: tag, a | b, -excluded")
+        # re-filter once typing pauses rather than on every keystroke
+        self.filter_timer = QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(200)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        self.filter_input.textChanged.connect(self.filter_timer.start)
+
+        # suggestions ordered by how many images use each tag
+        self.tag_suggestions = QStringListModel(self)
+        for line_edit in (self.add_tag_input, self.add_tag_all_input):
+            completer = QCompleter(self.tag_suggestions, self)
+            completer.setCaseSensitivity(Qt.CaseInsensitive)
+            completer.setFilterMode(Qt.MatchContains)
+            line_edit.setCompleter(completer)
+
         layout = QVBoxLayout()
         # column 1: Preview
         preview_col = QVBoxLayout()
@@ -54,7 +113,9 @@ class EditorTab(QWidget):
 
         # column 2: Images
         images_col = QVBoxLayout()
-        images_col.addWidget(QLabel("Images:"))
+        self.images_label = QLabel("Images:")
+        images_col.addWidget(self.images_label)
+        images_col.addWidget(self.filter_input)
         images_col.addWidget(self.image_list, stretch=1)
 
         # column 3: Tags
@@ -83,7 +144,9 @@ class EditorTab(QWidget):
         self.setLayout(layout)
 
         self.load_button.clicked.connect(self.select_folder)
-        self.image_list.currentItemChanged.connect(self.load_selected_image)
+        self.image_list.selectionModel().currentChanged.connect(
+            self.load_selected_image
+        )
         self.add_tag_button.clicked.connect(self.add_tag)
         self.remove_tag_button.clicked.connect(self.remove_tag)
         self.remove_global_button.clicked.connect(self.delete_tag_globally)
@@ -92,58 +155,161 @@ class EditorTab(QWidget):
     def select_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "Select Image Folder")
         if folder:
+            self.stop_loading()
             self.image_folder = Path(folder)
-            self.image_files = sorted(
-                p
-                for p in self.image_folder.iterdir()
-                if p.suffix.lower() in [".jpg", ".jpeg", ".png", ".webp"]
+            # a folder with a caption store is edited there when the store is
+            # enabled; a save in flight closes the old store once it is done
+            if self.store is not None and self.store is not self.saving_store:
+                self.store.close()
+            self.store = None
+            config = config_manager.ConfigManager()
+            if config.get("caption_store", False) and CaptionStore.exists(folder):
+                self.store = CaptionStore(self.image_folder)
+            self.index = TagIndex()
+            self.current_image_path = None
+            self.shown_tags = []
+            self.tag_list.clear()
+            self.image_model.set_keys([])
+            self.matches_filter = self.current_matcher()
+            # the scan and caption reads run on a worker thread; rows appear
+            # as chunks arrive
+            recursive = config.get("recursive_scan", False)
+            self.loader = FolderLoader(self.image_folder, recursive, self.store)
+            self.loader_thread = QThread(self)
+            self.loader.moveToThread(self.loader_thread)
+            self.loader_thread.started.connect(self.loader.run)
+            self.loader.chunk_loaded.connect(self.on_chunk_loaded)
+            self.loader.finished.connect(self.on_folder_loaded)
+            self.set_global_edits_enabled(False)
+            self.images_label.setText("Images: 0 (loading...)")
+            self.loader_thread.start()
+
+    def current_matcher(self):
+        query = self.filter_input.text()
+        return TagIndex.matcher(query) if query.strip() else None
+
+    def on_chunk_loaded(self, keys, tag_sets):
+        if self.sender() is not self.loader:
+            return
+        for key, tags in zip(keys, tag_sets):
+            self.index.add_image(key, tags)
+        if self.matches_filter is not None:
+            keys = [
+                key for key, tags in zip(keys, tag_sets) if self.matches_filter(tags)
+            ]
+        self.image_model.append_keys(keys)
+        self.update_images_label(loading=True)
+
+    def on_folder_loaded(self, total):
+        if self.sender() is not self.loader:
+            return
+        self.stop_loading()
+        self.set_global_edits_enabled(True)
+        self.update_images_label()
+        self.refresh_tag_suggestions()
+
+    def stop_loading(self):
+        if self.loader_thread is None:
+            return
+        self.loader.cancel()
+        self.loader_thread.quit()
+        self.loader_thread.wait()
+        self.loader_thread.deleteLater()
+        self.loader.deleteLater()
+        self.loader = None
+        self.loader_thread = None
+
+    def set_global_edits_enabled(self, enabled: bool):
+        # edits to "all" images wait until every caption is in the index
+        self.add_tag_all_button.setEnabled(enabled)
+        self.remove_global_button.setEnabled(enabled)
+
+    def update_images_label(self, loading=False):
+        suffix = " (loading...)" if loading else ""
+        if self.matches_filter is not None:
+            self.images_label.setText(
+                f"Images: {len(self.image_model.keys)} of {len(self.index)}{suffix}"
             )
-            self.tags_map = {}
-            self.image_list.clear()
-            for file in self.image_files:
-                self.image_list.addItem(file.name)
-                txt_path = file.with_suffix(".txt")
-                if txt_path.exists():
-                    with open(txt_path, "r", encoding="utf-8") as f:
-                        tags = {
-                            tag.strip() for tag in f.read().split(",") if tag.strip()
-                        }
-                        self.tags_map[file.name] = tags
-                else:
-                    self.tags_map[file.name] = set()
-
-    def load_selected_image(self, current: QListWidgetItem):
-        if not current:
+        else:
+            self.images_label.setText(f"Images: {len(self.index)}{suffix}")
+
+    def refresh_tag_suggestions(self):
+        self.tag_suggestions.setStringList(
+            [tag for tag, count in self.index.frequencies()]
+        )
+
+    def apply_filter(self):
+        self.matches_filter = self.current_matcher()
+        self.image_model.set_keys(self.index.query(self.filter_input.text()))
+        self.update_images_label(loading=self.loader is not None)
+
+    def image_key(self, path: Path) -> str:
+        # paths relative to the folder, so nested files with the same name differ
+        return path.relative_to(self.image_folder).as_posix()
+
+    def load_selected_image(self, current, previous=None):
+        if not current.isValid():
             return
-        filename = current.text()
+        row = current.row()
+        filename = self.image_model.key(row)
         self.current_image_path = self.image_folder / filename
-        pixmap = QPixmap(str(self.current_image_path))
-        if not pixmap.isNull():
-            scaled_pixmap = pixmap.scaled(
+        pixmap = self.thumbnails.request(str(self.current_image_path))
+        if pixmap is not None:
+            self.show_preview(pixmap)
+        else:
+            self.image_preview.setText("Loading...")
+        # decode the rows around the selection too, nearest first, so stepping
+        # through the list with the arrow keys finds them ready
+        neighbours = [str(self.current_image_path)]
+        for offset in range(1, self.prefetch_rows + 1):
+            for r in (row + offset, row - offset):
+                if 0 <= r < len(self.image_model.keys):
+                    neighbours.append(str(self.image_folder / self.image_model.key(r)))
+        self.thumbnails.prefetch(neighbours)
+        self.update_tag_list(filename)
+
+    def show_preview(self, pixmap: QPixmap):
+        self.image_preview.setPixmap(
+            pixmap.scaled(
                 self.image_preview.width(),
                 self.image_preview.height(),
                 Qt.KeepAspectRatio,
                 Qt.SmoothTransformation,
             )
-            self.image_preview.setPixmap(scaled_pixmap)
-        else:
+        )
+
+    def on_thumbnail_ready(self, path: str):
+        if self.current_image_path and path == str(self.current_image_path):
+            self.show_preview(self.thumbnails.get(path))
+
+    def on_thumbnail_failed(self, path: str, message: str):
+        if self.current_image_path and path == str(self.current_image_path):
+            print(f"[EditorTab] Cannot load {path}: {message}")
             self.image_preview.setText("Cannot load image")
-        self.update_tag_list(filename)
 
     def update_tag_list(self, filename):
+        # each tag shows how many images in the folder carry it; the bare tags
+        # are kept by row since the item text includes the count
         self.tag_list.clear()
-        for tag in sorted(self.tags_map.get(filename, [])):
-            self.tag_list.addItem(tag)
+        self.shown_tags = sorted(self.index.tags_for(filename))
+        self.tag_list.addItems(
+            [f"{tag} ({self.index.count(tag)})" for tag in self.shown_tags]
+        )
+
+    def selected_tags(self) -> list:
+        return [
+            self.shown_tags[self.tag_list.row(item)]
+            for item in self.tag_list.selectedItems()
+        ]
 
     def add_tag(self):
         tag = self.add_tag_input.text().strip()
         if not tag:
             return
-        filename = self.current_image_path.name
-        self.tags_map[filename].add(tag)
+        filename = self.image_key(self.current_image_path)
+        self.index.add_tag(filename, tag)
         self.update_tag_list(filename)
         self.add_tag_input.clear()
-        self.unsaved_changes = True
 
     def add_tag_to_all_captions(self):
         tag = self.add_tag_all_input.text().strip()
@@ -151,17 +317,12 @@ class EditorTab(QWidget):
             QMessageBox.warning(self, "No Tag", "Please enter a tag to add.")
             return
 
-        added_count = 0
-        for image_file in self.image_files:
-            tags = self.tags_map.get(image_file.name, set())
-            if tag not in tags:
-                tags.add(tag)
-                self.tags_map[image_file.name] = tags
-                added_count += 1
-                self.unsaved_changes = True
+        added_count = len(self.index.add_tag_to_all(tag))
+        if added_count:
+            self.refresh_tag_suggestions()
 
         if self.current_image_path:
-            self.update_tag_list(self.current_image_path.name)
+            self.update_tag_list(self.image_key(self.current_image_path))
 
         QMessageBox.information(
             self, "Done", f"Added tag '{tag}' to {added_count} images."
@@ -169,30 +330,103 @@ class EditorTab(QWidget):
         self.add_tag_all_input.clear()
 
     def remove_tag(self):
-        selected_items = self.tag_list.selectedItems()
-        if not selected_items:
+        selected_tags = self.selected_tags()
+        if not selected_tags:
             return
-        filename = self.current_image_path.name
-        for item in selected_items:
-            self.tags_map[filename].discard(item.text())
-            self.unsaved_changes = True
+        filename = self.image_key(self.current_image_path)
+        for tag in selected_tags:
+            self.index.remove_tag(filename, tag)
         self.update_tag_list(filename)
 
     def delete_tag_globally(self):
-        selected_items = self.tag_list.selectedItems()
-        if not selected_items:
+        selected_tags = self.selected_tags()
+        if not selected_tags:
             return
-        tag_to_remove = selected_items[0].text()
-        for filename in self.tags_map:
-            self.tags_map[filename].discard(tag_to_remove)
-            self.unsaved_changes = True
-        self.update_tag_list(self.current_image_path.name)
+        tag_to_remove = selected_tags[0]
+        if self.index.remove_tag_everywhere(tag_to_remove):
+            self.refresh_tag_suggestions()
+        self.update_tag_list(self.image_key(self.current_image_path))
 
     def save_all_tags(self):
-        for file in self.image_files:
-            tags = self.tags_map.get(file.name, set())
-            txt_path = file.with_suffix(".txt")
-            with open(txt_path, "w", encoding="utf-8") as f:
-                f.write(", ".join(sorted(tags)))
-        self.unsaved_changes = False
-        QMessageBox.information(self, "Success", "All tags saved.")
+        self.save_dirty(notify=True)
+
+    def autosave(self):
+        config = config_manager.ConfigManager()
+        if config.get("editor_autosave", False) and self.index.dirty:
+            self.save_dirty(limit=config.get("editor_autosave_batch", 500))
+
+    def caption_writer(self):
+        if self.store is not None:
+            return self.store.write_captions
+        return write_captions
+
+    def save_jobs(self, limit=None) -> list:
+        return [
+            (key, caption_path(self.image_folder / key), text)
+            for key, text in self.index.take_dirty(limit).items()
+        ]
+
+    def save_dirty(self, limit=None, notify=False):
+        # writes only the captions edited since the last save, off the GUI
+        # thread; saves never overlap, so a newer caption is never overwritten
+        # by an older one still in flight
+        if self.saving:
+            self.save_requested = self.save_requested or notify
+            return
+        jobs = self.save_jobs(limit)
+        if not jobs:
+            if notify:
+                QMessageBox.information(self, "Success", "No changes to save.")
+            return
+        self.saving = True
+        self.saving_store = self.store
+        index = self.index
+        start_task(
+            self.tasks,
+            self.caption_writer(),
+            jobs,
+            on_finished=lambda failures: self.on_saved(index, jobs, failures, notify),
+            on_failed=lambda message: self.on_saved(
+                index, jobs, [(key, message) for key, _, _ in jobs], notify
+            ),
+        )
+
+    def on_saved(self, index, jobs, failures, notify):
+        self.saving = False
+        store, self.saving_store = self.saving_store, None
+        # the folder changed while saving
+        if store is not None and store is not self.store:
+            store.close()
+        # failed captions stay dirty for the next save
+        index.mark_dirty(key for key, error in failures)
+        for key, error in failures[:20]:
+            print(f"[EditorTab] Failed to save {key}: {error}")
+        if self.save_requested:
+            self.save_requested = False
+            self.save_dirty(notify=True)
+        elif notify and failures:
+            QMessageBox.warning(
+                self,
+                "Save Failed",
+                f"{len(failures)} of {len(jobs)} captions could not be saved.",
+            )
+        elif notify:
+            QMessageBox.information(
+                self, "Success", f"Saved {len(jobs)} changed captions."
+            )
+
+    def shutdown(self):
+        self.stop_loading()
+        self.thumbnails.shutdown()
+        # on exit: let a save in flight finish and report back, so its failures
+        # are dirty again, then write whatever is left on this thread
+        QThreadPool.globalInstance().waitForDone()
+        self.save_requested = False
+        QApplication.processEvents()
+        if self.image_folder is None:
+            return
+        write = self.caption_writer()
+        for key, error in write(self.save_jobs()):
+            print(f"[EditorTab] Failed to save {key}: {error}")
+        if self.store is not None:
+            self.store.close()
@@ -0,0 +1,47 @@
+from PySide6.QtCore import QAbstractListModel, QModelIndex, Qt
+
+
+class ImageListModel(QAbstractListModel):
+    # the Editor's image list: one row per image key. Rows are handed to the
+    # view FETCH_ROWS at a time as it scrolls, so a folder of a million images
+    # costs the view no more than the rows it has shown
+    FETCH_ROWS = 2000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.keys = []
+        self.exposed = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.exposed
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and index.isValid():
+            return self.keys[index.row()]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.exposed < len(self.keys)
+
+    def fetchMore(self, parent=QModelIndex()):
+        count = min(self.FETCH_ROWS, len(self.keys) - self.exposed)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self.exposed, self.exposed + count - 1)
+        self.exposed += count
+        self.endInsertRows()
+
+    def key(self, row: int) -> str:
+        return self.keys[row]
+
+    def set_keys(self, keys: list):
+        self.beginResetModel()
+        self.keys = keys
+        self.exposed = min(self.FETCH_ROWS, len(keys))
+        self.endResetModel()
+
+    def append_keys(self, keys: list):
+        # rows that arrive while the view has room for them are shown at once
+        self.keys.extend(keys)
+        if self.exposed < self.FETCH_ROWS:
+            self.fetchMore()
@@ -16,15 +16,35 @@ class SettingsTab(QWidget):
         self.exclude_character = QCheckBox("Exclude Character Tags")
         self.exclude_character.setChecked(self.config.get("exclude_character", False))
 
+        self.recursive_scan = QCheckBox("Include Subfolders")
+        self.recursive_scan.setChecked(self.config.get("recursive_scan", False))
+
+        self.editor_autosave = QCheckBox("Autosave Editor Changes")
+        self.editor_autosave.setChecked(self.config.get("editor_autosave", False))
+
+        self.caption_store = QCheckBox("Keep Captions in a Single Store File")
+        self.caption_store.setChecked(self.config.get("caption_store", False))
+
+        self.bulk_metrics = QCheckBox("Save Bulk Tagging Metrics")
+        self.bulk_metrics.setChecked(self.config.get("bulk_metrics", False))
+
         save_btn = QPushButton("Save Settings")
         save_btn.clicked.connect(self.save_settings)
 
         layout.addWidget(self.include_rating)
         layout.addWidget(self.exclude_character)
+        layout.addWidget(self.recursive_scan)
+        layout.addWidget(self.editor_autosave)
+        layout.addWidget(self.caption_store)
+        layout.addWidget(self.bulk_metrics)
         layout.addWidget(save_btn)
         self.setLayout(layout)
 
     def save_settings(self):
         self.config.set("include_rating", self.include_rating.isChecked())
         self.config.set("exclude_character", self.exclude_character.isChecked())
+        self.config.set("recursive_scan", self.recursive_scan.isChecked())
+        self.config.set("editor_autosave", self.editor_autosave.isChecked())
+        self.config.set("caption_store", self.caption_store.isChecked())
+        self.config.set("bulk_metrics", self.bulk_metrics.isChecked())
         QMessageBox.information(self, "Settings", "Settings saved!")
\ No newline at end of file
@@ -11,29 +11,63 @@ from PySide6.QtWidgets import (
     QFormLayout,
     QProgressBar,
     QCheckBox,
-    QApplication,
     QLineEdit,
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QThread, QThreadPool
 from PySide6.QtGui import QPixmap
+from functools import partial
 from pathlib import Path
 from PIL import Image
-from tagger.model_runner import ONNXTagger
-from tagger.selected_tags_loader import SelectedTagsLoader
+from tagger.model_runner import compose_tags
+from tagger.model_pool import ModelPool
+from tagger.session_config import SessionConfig
+from ui.workers import BulkTaggingWorker, start_task
+from ui.thumbnails import ThumbnailCache
+from bulk.metrics import default_metrics_path, format_stage_ms
 import config_manager
 
 
+def format_eta(seconds: float) -> str:
+    if seconds < 0:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes:02d}:{seconds:02d}"
+
+
 class TaggingTab(QWidget):
-    def __init__(self, model_paths: dict[str, Path], parent=None):
+    def __init__(self, model_paths: dict[str, Path], parent=None, thumbnails=None):
         super().__init__(parent)
 
         self.model_paths = model_paths
         self.tagger = None
         self.image_path = None
+        self.tagged_path = None
         self.label_list = []
+        self.model_name = None
+        self.tag_request = 0
+        self.tasks = set()
+        self.bulk_thread = None
+        self.bulk_worker = None
+        self.thread_pool = QThreadPool.globalInstance()
         self.config = config_manager.ConfigManager()
         self.general_threshold = self.config.get("general_threshold", 0.35)
         self.character_threshold = self.config.get("character_threshold", 0.85)
+        prob_cache_bytes = None
+        if self.config.get("prob_cache_enabled", True):
+            prob_cache_bytes = self.config.get("prob_cache_max_mb", 2048) << 20
+        self.pool = ModelPool(
+            model_paths,
+            memory_budget=self.config.get("model_pool_budget_mb", 3072) << 20,
+            prob_cache_bytes=prob_cache_bytes,
+            fast_decode=self.config.get("fast_decode", False),
+            session_config=SessionConfig.from_config(self.config),
+        )
+        self.thumbnails = thumbnails or ThumbnailCache.from_config(self.config, self)
+        self.thumbnails.ready.connect(self.on_thumbnail_ready)
+        self.thumbnails.failed.connect(self.on_thumbnail_failed)
 
         self.init_ui()
 
@@ -68,6 +102,20 @@ class TaggingTab(QWidget):
         self.bulk_browse.clicked.connect(self.browse_bulk_folder)
         self.bulk_run = QPushButton("Run Bulk Tagging")
         self.bulk_run.clicked.connect(self.run_bulk_tagging)
+        self.bulk_retry = QPushButton("Retry Failed")
+        self.bulk_retry.clicked.connect(
+            lambda: self.run_bulk_tagging(retry_failed=True)
+        )
+        self.bulk_pause = QPushButton("Pause")
+        self.bulk_pause.setCheckable(True)
+        self.bulk_pause.setEnabled(False)
+        self.bulk_pause.toggled.connect(self.toggle_bulk_pause)
+        self.bulk_cancel = QPushButton("Cancel")
+        self.bulk_cancel.setEnabled(False)
+        self.bulk_cancel.clicked.connect(self.cancel_bulk_tagging)
+        self.status_label = QLabel()
+        self.metrics_label = QLabel()
+        self.metrics_label.setVisible(False)
 
         self.progress_bar = QProgressBar()
         self.progress_bar.setMinimum(0)
@@ -75,6 +123,7 @@ class TaggingTab(QWidget):
         self.progress_bar.setVisible(False)
 
         self.mcut_checkbox = QCheckBox("Use MCut Thresholding")
+        self.mcut_checkbox.toggled.connect(self.retag_from_cache)
 
         self.general_slider = QSlider(Qt.Horizontal)
         self.general_slider.setMinimum(0)
@@ -103,6 +152,9 @@ class TaggingTab(QWidget):
         bulk_layout.addWidget(self.bulk_input)
         bulk_layout.addWidget(self.bulk_browse)
         bulk_layout.addWidget(self.bulk_run)
+        bulk_layout.addWidget(self.bulk_retry)
+        bulk_layout.addWidget(self.bulk_pause)
+        bulk_layout.addWidget(self.bulk_cancel)
 
         layout = QVBoxLayout()
         top_row = QHBoxLayout()
@@ -116,6 +168,8 @@ class TaggingTab(QWidget):
         layout.addLayout(image_and_tags)
         layout.addWidget(self.mcut_checkbox)
         layout.addWidget(self.progress_bar)
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.metrics_label)
         layout.addLayout(bulk_layout)
         self.setLayout(layout)
 
@@ -133,97 +187,302 @@ class TaggingTab(QWidget):
         self.character_label.setText(
             f"Character Threshold: {self.character_threshold:.2f}"
         )
-        if self.tagger:
-            self.tagger.set_thresholds(self.general_threshold, self.character_threshold)
+        self.retag_from_cache()
 
-    def update_model(self, selected_model: str):
-        model_path = self.model_paths[selected_model]
-        csv_path = model_path.parent / "selected_tags.csv"
-        loader = SelectedTagsLoader(csv_path)
-        tag_names, rating_indexes, general_indexes, character_indexes = (
-            loader.load_tags()
+    def retag_from_cache(self):
+        # with cached probabilities, changing a cutoff only re-thresholds
+        if not (self.tagger and self.tagger.prob_cache):
+            return
+        if self.tagged_path and self.tagged_path == self.image_path:
+            self.run_tagging()
+
+    def start_task(self, fn, *args, on_finished=None, on_failed=None):
+        return start_task(
+            self.tasks, fn, *args, on_finished=on_finished, on_failed=on_failed
         )
-        self.tagger = ONNXTagger(
-            model_path,
-            tag_names,
-            rating_indexes,
-            general_indexes,
-            character_indexes,
-            general_threshold=self.general_threshold,
-            character_threshold=self.character_threshold,
+
+    def update_model(self, selected_model: str):
+        # sessions load on first use through the pool, so switching models
+        # costs nothing until something is tagged
+        self.model_name = selected_model
+        self.tagger = None
+        self.tagged_path = None
+        if self.pool.is_loaded(selected_model):
+            self.tagger = self.pool.get(selected_model)
+        self.status_label.setText(f"Model: {selected_model}")
+
+    def preload_model(self):
+        # loads the selected model in the background once the window is up, so
+        # the first Tag Image does not wait for it; tagging meanwhile waits on
+        # the same load in the pool
+        name = self.model_name
+        if not name or self.pool.is_loaded(name):
+            return
+        if not self.model_paths[name].exists():
+            return
+        self.progress_bar.setVisible(True)
+        self.progress_bar.setMaximum(0)
+        self.status_label.setText(f"Loading {name}...")
+        self.start_task(
+            self.pool.get,
+            name,
+            on_finished=lambda tagger: self.on_model_loaded(name, tagger),
+            on_failed=lambda message: self.on_model_loaded(name, None, message),
         )
 
+    def on_model_loaded(self, name, tagger, error=None):
+        # other tasks still running (a tag request) keep the progress bar busy
+        if not self.tasks and self.bulk_thread is None:
+            self.progress_bar.setVisible(False)
+        if name != self.model_name:
+            return
+        if error is not None:
+            print(f"[TaggingTab] Could not load {name}: {error}")
+            self.status_label.setText(f"Could not load {name}")
+            return
+        self.tagger = tagger
+        self.status_label.setText(f"Model: {name}")
+
     def load_image(self):
         file_path, _ = QFileDialog.getOpenFileName(
             self, "Open Image", "", "Images (*.png *.jpg *.jpeg *.bmp *.webp)"
         )
         if file_path:
             self.image_path = file_path
-            pixmap = QPixmap(file_path)
-            self.image_label.setPixmap(
-                pixmap.scaled(
-                    self.image_label.width(),
-                    self.image_label.height(),
-                    Qt.KeepAspectRatio,
-                    Qt.SmoothTransformation,
-                )
+            # decoded off the GUI thread; on_thumbnail_ready shows it
+            pixmap = self.thumbnails.request(file_path)
+            if pixmap is not None:
+                self.show_image(pixmap)
+            else:
+                self.image_label.setText("Loading...")
+
+    def show_image(self, pixmap: QPixmap):
+        self.image_label.setPixmap(
+            pixmap.scaled(
+                self.image_label.width(),
+                self.image_label.height(),
+                Qt.KeepAspectRatio,
+                Qt.SmoothTransformation,
             )
+        )
+
+    def on_thumbnail_ready(self, path: str):
+        if path == self.image_path:
+            self.show_image(self.thumbnails.get(path))
+
+    def on_thumbnail_failed(self, path: str, message: str):
+        if path == self.image_path:
+            print(f"[TaggingTab] Cannot load {path}: {message}")
+            self.image_label.setText("Cannot load image")
 
     def run_tagging(self):
-        if not self.image_path or not self.tagger:
+        if not self.image_path:
             return
         self.progress_bar.setVisible(True)
         self.progress_bar.setMaximum(0)
-        QApplication.processEvents()
-        image = Image.open(self.image_path)
-        general_mcut = self.mcut_checkbox.isChecked()
-        character_mcut = self.mcut_checkbox.isChecked()
-        sorted_general, rating, sorted_character, general_res = self.tagger.predict(
-            image, general_mcut=general_mcut, character_mcut=character_mcut
-        )
-        # combine tags based on config settings
+        name = self.model_name
+        if not self.pool.is_loaded(name):
+            self.status_label.setText(f"Loading {name}...")
+        # slider drags queue several requests; only the newest is shown
+        self.tag_request += 1
+        request = self.tag_request
+        image_path = self.image_path
         config = config_manager.ConfigManager()
-        tags = []
-
-        # include rating tags if enabled
-        if config.get("include_rating", False) and rating:
-            best_rating = max(rating.items(), key=lambda x: x[1])[0]
-            tags.append(best_rating)
-
-        # always include general tags
-        tags.extend(sorted_general)
+        self.start_task(
+            self.tag_image,
+            name,
+            image_path,
+            self.general_threshold,
+            self.character_threshold,
+            self.mcut_checkbox.isChecked(),
+            config.get("include_rating", False),
+            config.get("exclude_character", False),
+            on_finished=lambda done: self.on_tagged(request, name, image_path, done),
+            on_failed=lambda message: self.on_tagged(
+                request, name, image_path, None, message
+            ),
+        )
 
-        # exclude character tags if enabled
-        if not config.get("exclude_character", False):
-            tags.extend(sorted_character)
+    def tag_image(
+        self,
+        name,
+        image_path,
+        general_threshold,
+        character_threshold,
+        mcut,
+        include_rating,
+        exclude_character,
+    ):
+        # pooled taggers are shared with bulk jobs, so the thresholds go with
+        # the call rather than onto the tagger
+        tagger = self.pool.get(name)
+        with Image.open(image_path) as image:
+            sorted_general, rating, sorted_character, general_res = tagger.predict(
+                image,
+                general_mcut=mcut,
+                character_mcut=mcut,
+                thresholds=(general_threshold, character_threshold),
+            )
+        # combine tags based on config settings
+        tags = compose_tags(
+            sorted_general,
+            rating,
+            sorted_character,
+            include_rating=include_rating,
+            exclude_character=exclude_character,
+        )
+        return tagger, tags
 
-        self.tag_output.setText(", ".join(tags))
-        self.progress_bar.setVisible(False)
+    def on_tagged(self, request, name, image_path, done, error=None):
+        if done is not None and name == self.model_name:
+            self.tagger = done[0]
+            self.status_label.setText(f"Model: {name}")
+        if request != self.tag_request:
+            return
+        if self.bulk_thread is None:
+            self.progress_bar.setVisible(False)
+        if error is not None:
+            self.tag_output.setText(f"Tagging failed: {error}")
+            self.status_label.setText(f"Model: {name}")
+            return
+        self.tag_output.setText(", ".join(done[1]))
+        self.tagged_path = image_path
 
     def browse_bulk_folder(self):
         folder = QFileDialog.getExistingDirectory(self, "Select Folder")
         if folder:
             self.bulk_input.setText(folder)
 
-    def run_bulk_tagging(self):
-        from bulk.bulk_processor import bulk_tag_images
-
+    def run_bulk_tagging(self, retry_failed=False):
         input_dir = Path(self.bulk_input.text())
-        output_dir = input_dir
         if not input_dir.exists():
             self.tag_output.setText("Invalid folder path.")
             return
+        if self.bulk_thread is not None:
+            return
+        self.tagged_path = None
+        config = config_manager.ConfigManager()
+        metrics_path = None
+        if config.get("bulk_metrics", False):
+            metrics_path = default_metrics_path(input_dir)
+        self.bulk_worker = BulkTaggingWorker(
+            partial(self.pool.get, self.model_name),
+            input_dir,
+            metrics_path=metrics_path,
+            general_threshold=self.general_threshold,
+            character_threshold=self.character_threshold,
+            general_mcut=self.mcut_checkbox.isChecked(),
+            character_mcut=self.mcut_checkbox.isChecked(),
+            batch_size=self.config.get("bulk_batch_size", 8),
+            workers=self.config.get("bulk_workers", 1),
+            threads_per_worker=self.config.get("bulk_threads_per_worker", 0) or None,
+            incremental=self.config.get("bulk_incremental", True),
+            recursive=config.get("recursive_scan", False),
+            include_rating=config.get("include_rating", False),
+            exclude_character=config.get("exclude_character", False),
+            caption_store=config.get("caption_store", False),
+            top_k=self.config.get("bulk_top_k", 0),
+            retry_failed=retry_failed,
+        )
+        self.bulk_thread = QThread(self)
+        self.bulk_worker.moveToThread(self.bulk_thread)
+        self.bulk_thread.started.connect(self.bulk_worker.run)
+        self.bulk_worker.status.connect(self.status_label.setText)
+        self.bulk_worker.progress.connect(self.on_bulk_progress)
+        self.bulk_worker.stages.connect(self.on_bulk_stages)
+        self.bulk_worker.finished.connect(self.on_bulk_finished)
+        self.bulk_worker.failed.connect(self.on_bulk_failed)
+
         self.progress_bar.setVisible(True)
         self.progress_bar.setMaximum(0)
-        QApplication.processEvents()
-        results = bulk_tag_images(self.tagger, input_dir)
-        self.progress_bar.setVisible(False)
-        success = sum(1 for r in results if r[1])
-        fail = len(results) - success
-        self.tag_output.setText(
-            f"Bulk tagging complete.\nSuccess: {success}, Failed: {fail}"
+        self.bulk_run.setEnabled(False)
+        self.bulk_retry.setEnabled(False)
+        self.bulk_pause.setEnabled(True)
+        self.bulk_cancel.setEnabled(True)
+        self.bulk_thread.start()
+
+    def toggle_bulk_pause(self, paused: bool):
+        if self.bulk_worker is None:
+            return
+        if paused:
+            self.bulk_worker.pause()
+        else:
+            self.bulk_worker.resume()
+        self.bulk_pause.setText("Resume" if paused else "Pause")
+
+    def cancel_bulk_tagging(self):
+        if self.bulk_worker is not None:
+            self.bulk_cancel.setEnabled(False)
+            self.bulk_pause.setEnabled(False)
+            self.bulk_worker.cancel()
+
+    def on_bulk_progress(self, done, failed, total, rate, eta):
+        # a total of 0 (retrying failures, or the folder is still being
+        # counted) keeps the bar busy
+        self.progress_bar.setMaximum(total)
+        self.progress_bar.setValue(min(done, total))
+        if self.bulk_worker.control.paused:
+            return
+        count = f"{done} / {total}" if total else f"{done}"
+        self.status_label.setText(
+            f"{count} images, {failed} failed, "
+            f"{rate:.1f} images/sec, ETA {format_eta(eta)}"
         )
 
+    def on_bulk_stages(self, snapshot):
+        text = f"Per image: {format_stage_ms(snapshot['stage_ms'])}"
+        if snapshot["slowest"]:
+            slowest = snapshot["slowest"][0]
+            text += f"  |  slowest: {slowest['path']} ({slowest['ms']:.0f}ms)"
+        self.metrics_label.setText(text)
+        self.metrics_label.setVisible(True)
+
+    def on_bulk_finished(self, summary, cancelled):
+        heading = "Bulk tagging cancelled." if cancelled else "Bulk tagging complete."
+        text = f"{heading}\nSuccess: {summary.succeeded}, Failed: {summary.failed}"
+        if summary.skipped:
+            text += f", Unchanged: {summary.skipped}"
+        if summary.resumed:
+            text += f", Done earlier: {summary.resumed}"
+        if cancelled:
+            text += "\nRun it again to pick up where it stopped."
+        elif summary.failed:
+            text += "\nRetry Failed retags only the failed images."
+        if self.bulk_worker.metrics.path is not None:
+            text += f"\nMetrics: {self.bulk_worker.metrics.path}"
+        self.tag_output.setText(text)
+        self.status_label.setText(heading)
+        self.finish_bulk()
+
+    def on_bulk_failed(self, message):
+        self.tag_output.setText(f"Bulk tagging failed: {message}")
+        self.status_label.setText("Bulk tagging failed.")
+        self.finish_bulk()
+
+    def finish_bulk(self):
+        self.bulk_thread.quit()
+        self.bulk_thread.wait()
+        self.bulk_thread.deleteLater()
+        self.bulk_worker.deleteLater()
+        self.bulk_thread = None
+        self.bulk_worker = None
+        self.progress_bar.setVisible(False)
+        self.metrics_label.setVisible(False)
+        self.bulk_run.setEnabled(True)
+        self.bulk_retry.setEnabled(True)
+        self.bulk_pause.setChecked(False)
+        self.bulk_pause.setEnabled(False)
+        self.bulk_cancel.setEnabled(False)
+
+    def shutdown(self):
+        # stop a running bulk job cleanly so the manifest and cache get flushed
+        if self.bulk_thread is not None:
+            self.bulk_worker.cancel()
+            self.bulk_thread.quit()
+            self.bulk_thread.wait()
+        self.thread_pool.waitForDone()
+        self.thumbnails.shutdown()
+
     def save_tags(self):
         if not self.image_path:
             return
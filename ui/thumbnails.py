@@ -0,0 +1,175 @@
+import hashlib
+import os
+from collections import OrderedDict
+from pathlib import Path
+from PIL import Image
+from PySide6.QtCore import QObject, QThreadPool, Signal
+from PySide6.QtGui import QImage, QPixmap
+from config_manager import CONFIG_DIR
+from ui.workers import start_task
+
+THUMBNAIL_DIR = CONFIG_DIR / "thumbnails"
+
+
+def thumbnail_file(path: Path, size: int) -> Path:
+    # keyed by path, mtime and size, so an edited image gets a new thumbnail
+    # and the stale one ages out through prune_thumbnails
+    stat = path.stat()
+    key = f"{path.resolve()}|{stat.st_mtime_ns}|{stat.st_size}|{size}"
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+    return THUMBNAIL_DIR / digest[:2] / digest
+
+
+def to_qimage(image: Image.Image) -> QImage:
+    if image.mode == "RGBA":
+        fmt, channels = QImage.Format_RGBA8888, 4
+    else:
+        fmt, channels = QImage.Format_RGB888, 3
+    data = image.tobytes()
+    # copy() so the QImage owns its pixels once `data` goes away
+    return QImage(data, image.width, image.height, image.width * channels, fmt).copy()
+
+
+def decode_thumbnail(path: Path, size: int) -> Image.Image:
+    with Image.open(path) as image:
+        # JPEGs decode straight at a fraction of their resolution
+        image.draft("RGB", (size, size))
+        has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    image.thumbnail((size, size), Image.LANCZOS)
+    return image
+
+
+def load_thumbnail(path: Path, size: int) -> QImage:
+    # runs on a worker thread: the cached thumbnail if there is one, otherwise
+    # the image is decoded, shrunk and written to the cache for next time
+    cached = thumbnail_file(path, size)
+    try:
+        with Image.open(cached) as image:
+            image.load()
+        return to_qimage(image)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"[Thumbnails] Discarding unreadable thumbnail {cached}: {e}")
+    image = decode_thumbnail(path, size)
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    temp = cached.with_name(f".{cached.name}.{os.getpid()}.tmp")
+    try:
+        if image.mode == "RGBA":
+            image.save(temp, "PNG")
+        else:
+            image.save(temp, "JPEG", quality=90)
+        os.replace(temp, cached)
+    except OSError as e:
+        print(f"[Thumbnails] Cannot cache thumbnail for {path}: {e}")
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+    return to_qimage(image)
+
+
+def prune_thumbnails(max_bytes: int) -> int:
+    # drops the oldest thumbnails until the cache fits in max_bytes; returns
+    # how many were removed
+    entries = []
+    total = 0
+    for subdir in THUMBNAIL_DIR.glob("*"):
+        if not subdir.is_dir():
+            continue
+        with os.scandir(subdir) as it:
+            for entry in it:
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+class ThumbnailCache(QObject):
+    # previews for the GUI: an LRU of QPixmaps in memory in front of the disk
+    # cache, with decoding on a small thread pool of its own so previews never
+    # wait behind saves or tagging. request() returns a pixmap when it is in
+    # memory; otherwise `ready` fires once it has been decoded.
+    ready = Signal(str)
+    failed = Signal(str, str)
+
+    def __init__(self, size=512, max_items=256, threads=2, parent=None):
+        super().__init__(parent)
+        self.size = size
+        self.max_items = max_items
+        self.pixmaps = OrderedDict()
+        self.pending = {}
+        self.tasks = set()
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(threads)
+
+    @classmethod
+    def from_config(cls, config, parent=None):
+        return cls(
+            size=config.get("thumbnail_size", 512),
+            max_items=config.get("thumbnail_memory_items", 256),
+            parent=parent,
+        )
+
+    def prune(self, max_bytes: int):
+        start_task(self.tasks, prune_thumbnails, max_bytes, pool=self.pool)
+
+    def get(self, path: str):
+        pixmap = self.pixmaps.get(path)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(path)
+        return pixmap
+
+    def request(self, path: str):
+        pixmap = self.get(path)
+        if pixmap is None and path not in self.pending:
+            self.pending[path] = start_task(
+                self.tasks,
+                load_thumbnail,
+                Path(path),
+                self.size,
+                on_finished=lambda image, path=path: self.on_loaded(path, image),
+                on_failed=lambda message, path=path: self.on_failed(path, message),
+                pool=self.pool,
+            )
+        return pixmap
+
+    def prefetch(self, paths: list):
+        # decodes `paths` ahead of time and drops queued work for anything
+        # else, so scrolling fast does not leave a backlog of stale decodes
+        wanted = set(paths)
+        for path, task in list(self.pending.items()):
+            if path not in wanted and self.pool.tryTake(task):
+                del self.pending[path]
+                self.tasks.discard(task)
+        for path in paths:
+            self.request(path)
+
+    def on_loaded(self, path: str, image: QImage):
+        self.pending.pop(path, None)
+        # QPixmaps may only be made on the GUI thread, hence the QImage hand-off
+        self.pixmaps[path] = QPixmap.fromImage(image)
+        self.pixmaps.move_to_end(path)
+        while len(self.pixmaps) > self.max_items:
+            self.pixmaps.popitem(last=False)
+        self.ready.emit(path)
+
+    def on_failed(self, path: str, message: str):
+        self.pending.pop(path, None)
+        self.failed.emit(path, message)
+
+    def shutdown(self):
+        self.pool.clear()
+        self.pool.waitForDone()
+        self.pending.clear()
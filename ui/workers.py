@@ -0,0 +1,216 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from PySide6.QtCore import QObject, QRunnable, QThreadPool, Signal, Slot
+from bulk.metrics import RunMetrics
+from bulk.pipeline import JobControl
+from image_scanner import scan_images
+from captions.caption_files import read_caption
+from captions.tag_index import parse_caption
+
+
+class TaskSignals(QObject):
+    finished = Signal(object)
+    failed = Signal(str)
+
+
+class Task(QRunnable):
+    # runs fn(*args, **kwargs) on a QThreadPool and reports the return value or
+    # the error message back to the GUI thread through its signals
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+
+    @Slot()
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+            return
+        self.signals.finished.emit(result)
+
+
+def start_task(tasks: set, fn, *args, on_finished=None, on_failed=None, pool=None):
+    # runs fn on `pool`, the global QThreadPool by default; `tasks` keeps each
+    # task referenced until it reports back
+    task = Task(fn, *args)
+    tasks.add(task)
+
+    def done(result):
+        tasks.discard(task)
+        if on_finished:
+            on_finished(result)
+
+    def failed(message):
+        tasks.discard(task)
+        if on_failed:
+            on_failed(message)
+        else:
+            print(f"[Task] {fn.__name__} failed: {message}")
+
+    task.signals.finished.connect(done)
+    task.signals.failed.connect(failed)
+    (pool or QThreadPool.globalInstance()).start(task)
+    return task
+
+
+class BulkTaggingWorker(QObject):
+    # runs bulk_tag_images off the GUI thread; move it to a QThread and connect
+    # the thread's started signal to run(). load_tagger is called on the worker
+    # thread, so a model that is not loaded yet does not block the GUI
+    status = Signal(str)
+    # processed, failed, total (0 while unknown), images/sec, eta in seconds
+    # (-1 while unknown)
+    progress = Signal(int, int, int, float, float)
+    # a RunMetrics snapshot: recent throughput, mean ms per stage, slowest file
+    stages = Signal(object)
+    finished = Signal(object, bool)
+    failed = Signal(str)
+
+    PROGRESS_INTERVAL = 0.1
+    SNAPSHOT_INTERVAL = 1.0
+
+    def __init__(self, load_tagger, folder: Path, metrics_path=None, **bulk_kwargs):
+        super().__init__()
+        self.load_tagger = load_tagger
+        self.folder = folder
+        self.bulk_kwargs = bulk_kwargs
+        self.control = JobControl()
+        self.total = 0
+        self.last_emit = 0.0
+        # always kept for the live stage breakdown; only written out with a path
+        self.metrics = RunMetrics(
+            metrics_path,
+            per_image=metrics_path is not None,
+            snapshot_interval=self.SNAPSHOT_INTERVAL,
+        )
+        self.last_snapshot = None
+
+    def pause(self):
+        self.control.pause()
+        self.status.emit("Paused")
+
+    def resume(self):
+        self.control.resume()
+        self.status.emit("Resuming...")
+
+    def cancel(self):
+        self.control.cancel()
+        self.status.emit("Cancelling, finishing images in flight...")
+
+    @Slot()
+    def run(self):
+        from bulk.bulk_processor import bulk_tag_images
+
+        retry = self.bulk_kwargs.get("retry_failed", False)
+        # the folder is counted alongside the run, for the progress bar and
+        # ETA; until then progress shows a running count. A retry only goes
+        # over the failed images, so the folder is not counted
+        if not retry:
+            threading.Thread(
+                target=self.count_images, name="count images", daemon=True
+            ).start()
+        try:
+            self.status.emit("Loading model...")
+            tagger = self.load_tagger()
+            self.status.emit(
+                "Retrying failed images..." if retry else "Tagging images..."
+            )
+            self.start_time = time.perf_counter()
+            summary = bulk_tag_images(
+                tagger,
+                self.folder,
+                progress_callback=self.on_progress,
+                control=self.control,
+                metrics=self.metrics,
+                **self.bulk_kwargs,
+            )
+        except Exception as e:
+            self.failed.emit(str(e))
+            return
+        self.finished.emit(summary, self.control.cancelled)
+
+    def count_images(self):
+        recursive = self.bulk_kwargs.get("recursive", False)
+        count = 0
+        for _ in scan_images(self.folder, recursive=recursive):
+            if self.control.cancelled:
+                return
+            count += 1
+        self.total = count
+
+    def on_progress(self, processed, failed, skipped):
+        # called from the caption writer thread; signals are queued to the GUI,
+        # so emits are throttled to keep the event loop from flooding
+        if self.metrics.latest is not self.last_snapshot:
+            self.last_snapshot = self.metrics.latest
+            self.stages.emit(self.last_snapshot)
+        now = time.perf_counter()
+        remaining = max(self.total - processed - skipped, 0)
+        unknown = self.total == 0
+        if (remaining or unknown) and now - self.last_emit < self.PROGRESS_INTERVAL:
+            return
+        self.last_emit = now
+        elapsed = now - self.start_time
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        eta = remaining / rate if rate > 0 and not unknown else -1.0
+        self.progress.emit(processed + skipped, failed, self.total, rate, eta)
+
+
+class FolderLoader(QObject):
+    # scans a folder and reads its captions on a worker thread, handing them to
+    # the GUI in chunks; the first chunk is small so rows appear right away.
+    # Captions are read by a few threads at once to hide network latency, or
+    # all in one query when the folder keeps them in a CaptionStore.
+    chunk_loaded = Signal(object, object)
+    finished = Signal(int)
+
+    FIRST_CHUNK = 200
+    CHUNK = 5000
+
+    def __init__(self, folder: Path, recursive: bool, store=None):
+        super().__init__()
+        self.folder = folder
+        self.recursive = recursive
+        self.store = store
+        self.captions = None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    @Slot()
+    def run(self):
+        total = 0
+        paths = []
+        chunk = self.FIRST_CHUNK
+        if self.store is not None:
+            self.captions = self.store.read_all()
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix="captions") as pool:
+            for path in scan_images(self.folder, recursive=self.recursive, sort=True):
+                if self.cancelled:
+                    return
+                paths.append(path)
+                if len(paths) >= chunk:
+                    self.emit_chunk(pool, paths)
+                    total += len(paths)
+                    paths = []
+                    chunk = self.CHUNK
+            if paths and not self.cancelled:
+                self.emit_chunk(pool, paths)
+                total += len(paths)
+        if not self.cancelled:
+            self.finished.emit(total)
+
+    def emit_chunk(self, pool, paths):
+        keys = [path.relative_to(self.folder).as_posix() for path in paths]
+        if self.captions is not None:
+            tags = [parse_caption(self.captions.get(key, "")) for key in keys]
+        else:
+            tags = list(pool.map(read_caption, paths))
+        self.chunk_loaded.emit(keys, tags)